@@ -0,0 +1,104 @@
+import os
+import threading
+import time
+from collections import deque
+
+from fastapi.responses import JSONResponse
+
+RETRY_AFTER_SECONDS = int(os.getenv('RETRY_AFTER_SECONDS', 10))
+WAIT_HISTOGRAM_BUCKETS = [0.1, 0.5, 1, 5, 10, 30, 60, 300, 900]
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, status_code, message):
+        super().__init__(message)
+        self.status_code = status_code
+        self.message = message
+
+    def response(self, request_id):
+        # 429 and 503 both mean "try again later", Retry-After tells the caller when
+        return JSONResponse(status_code=self.status_code,
+                            content={'id': request_id, 'message': self.message},
+                            headers={'Retry-After': str(RETRY_AFTER_SECONDS)})
+
+
+class AdmissionQueue:
+    """
+    Bounded admission for /invocations. Each task group has its own concurrency limit and
+    its waiters are let in first come first served, one group never blocks another.
+    """
+
+    def __init__(self, limits: dict, max_waiting: int, wait_timeout: float):
+        self.limits = limits
+        self.max_waiting = max_waiting
+        self.wait_timeout = wait_timeout
+        self.condition = threading.Condition()
+        self.running = {group: 0 for group in limits}
+        self.waiters = {group: deque() for group in limits}
+        self.wait_buckets = [0] * (len(WAIT_HISTOGRAM_BUCKETS) + 1)
+        self.wait_sum = 0.0
+        self.wait_count = 0
+        self.rejected = 0
+
+    def waiting(self):
+        return sum(len(waiters) for waiters in self.waiters.values())
+
+    def acquire(self, group: str):
+        start = time.monotonic()
+        ticket = object()
+        with self.condition:
+            if self.waiting() >= self.max_waiting:
+                self.rejected += 1
+                raise AdmissionRejected(429, f"too many waiting requests: {self.waiting()}")
+
+            waiters = self.waiters[group]
+            waiters.append(ticket)
+            try:
+                admitted = self.condition.wait_for(
+                    lambda: waiters[0] is ticket and self.running[group] < self.limits[group],
+                    timeout=self.wait_timeout)
+            finally:
+                waiters.remove(ticket)
+                # the next waiter of the group may be admitted as well
+                self.condition.notify_all()
+
+            if not admitted:
+                self.rejected += 1
+                raise AdmissionRejected(503, f"no {group} slot within {self.wait_timeout} seconds")
+
+            self.running[group] += 1
+            self.observe_wait(time.monotonic() - start)
+
+    def release(self, group: str):
+        with self.condition:
+            self.running[group] -= 1
+            self.condition.notify_all()
+
+    def observe_wait(self, seconds: float):
+        for i, bound in enumerate(WAIT_HISTOGRAM_BUCKETS):
+            if seconds <= bound:
+                self.wait_buckets[i] += 1
+                break
+        else:
+            self.wait_buckets[-1] += 1
+        self.wait_sum += seconds
+        self.wait_count += 1
+
+    def stats(self):
+        with self.condition:
+            cumulative = 0
+            buckets = {}
+            for bound, count in zip([*WAIT_HISTOGRAM_BUCKETS, '+Inf'], self.wait_buckets):
+                cumulative += count
+                buckets[str(bound)] = cumulative
+            return {
+                'queue_depth': {group: len(waiters) for group, waiters in self.waiters.items()},
+                'running': dict(self.running),
+                'limits': dict(self.limits),
+                'rejected': self.rejected,
+                'wait_seconds': {
+                    'buckets': buckets,
+                    'sum': self.wait_sum,
+                    'count': self.wait_count,
+                },
+            }
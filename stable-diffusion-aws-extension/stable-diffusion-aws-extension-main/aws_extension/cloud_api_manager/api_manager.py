@@ -84,7 +84,8 @@ class CloudApiManager:
                          autoscaling_enabled=True,
                          user_roles=None,
                          min_instance_number=1,
-                         username=""):
+                         username="",
+                         output_images_to_s3=False):
         """ Create SageMaker endpoint for GPU inference.
         Args:
             instance_type (string): the ML compute instance type.
@@ -108,6 +109,7 @@ class CloudApiManager:
             "autoscaling_enabled": autoscaling_enabled,
             "custom_docker_image_uri": custom_docker_image_uri,
             "custom_extensions": custom_extensions,
+            "output_images_to_s3": output_images_to_s3,
             'assign_to_roles': user_roles,
             "creator": username,
         }
@@ -1,11 +1,25 @@
 import os
 import io
+import json
 import base64
+import tarfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import boto3
+import botocore.config
+import boto3.s3.transfer as s3transfer
 from PIL import Image
-from utils import ModelsRef
-import subprocess
+from utils import split_s3_path
 import logging
 
+try:
+    import fcntl
+except ImportError:
+    # not available on Windows, the models dir is then only gated within the process
+    fcntl = None
+
 try:
     import modules.shared as shared
     from modules import sd_hijack, sd_models, sd_vae
@@ -17,7 +31,6 @@ logger.setLevel(os.environ.get('LOG_LEVEL') or logging.ERROR)
 
 CN_MODEL_EXTS = [".pt", ".pth", ".ckpt", ".safetensors"]
 models_type_list = ['Stable-diffusion', 'hypernetworks', 'Lora', 'ControlNet', 'embeddings', 'VAE']
-models_used_count = {key: ModelsRef() for key in models_type_list}
 models_path = {key: None for key in models_type_list}
 models_path['Stable-diffusion'] = 'models/Stable-diffusion'
 models_path['ControlNet'] = 'models/ControlNet'
@@ -27,78 +40,360 @@ models_path['embeddings'] = 'embeddings'
 models_path['VAE'] = 'models/VAE'
 disk_path = '/tmp'
 #disk_path = '/'
-TAR_TYPE_FILE = 'application/x-tar'
+# models of one request downloaded side by side, each large file is fetched with ranged GETs
+MODEL_DOWNLOAD_WORKERS = int(os.environ.get('MODEL_DOWNLOAD_WORKERS', 4))
+MODEL_DOWNLOAD_CONCURRENCY = int(os.environ.get('MODEL_DOWNLOAD_CONCURRENCY', 8))
+MODEL_DOWNLOAD_CHUNK_SIZE = 64 * 1024 * 1024
+PROGRESS_LOG_INTERVAL = 10
+# warm the page cache with the prefetched model files as well
+PREFETCH_TO_RAM = os.environ.get('PREFETCH_TO_RAM', 'false') == 'true'
+# checkpoints kept in CPU RAM by the webui after they are swapped out, 0 disables it
+CHECKPOINT_RAM_CACHE = int(os.environ.get('CHECKPOINT_RAM_CACHE', 2))
+MODEL_CACHE_MANIFEST = os.environ.get('MODEL_CACHE_MANIFEST', 'models/model_cache.json')
+# hits of a model lose half their weight after this many seconds without use
+MODEL_CACHE_HALF_LIFE = int(os.environ.get('MODEL_CACHE_HALF_LIFE', 3600))
+# lock file shared by the webui processes of all GPUs, next to the models dir rather than in it
+MODELS_DIR_LOCK = os.environ.get('MODELS_DIR_LOCK', 'models.lock')
+
+
+class ModelCache:
+    """
+    Index of the models on local disk with their size, last access and hit count, kept in
+    memory and saved to a small manifest so it survives restarts.
+
+    Eviction drops the models that are cheapest to bring back first: the score is the
+    size (download cost) times the hit count, decayed by the time since the last access.
+    Space for a download is reserved before it starts, so concurrent downloads don't
+    count the same free bytes twice.
+
+    The webui processes of all GPUs share the models folder, so the manifest also holds
+    the bytes each process has reserved and the models its running request needs. Every
+    change re-reads the manifest and writes it back under an exclusive flock, so a process
+    never evicts what another one is about to load nor counts its free space again.
+    """
+
+    def __init__(self, manifest_path: str):
+        self.manifest_path = manifest_path
+        self.lock_path = f'{manifest_path}.lock'
+        self.lock = threading.RLock()
+        self.lock_depth = 0
+        self.lock_file = None
+        self.owner = str(os.getpid())
+        self.entries = {}
+        # of the other processes, by owner: {'reserved': bytes, 'keep': [keys]}
+        self.processes = {}
+        self.reserved = 0
+        self.keep = set()
+        self.loaded = False
+
+    @staticmethod
+    def key(model_type, model_name):
+        return f'{model_type}/{model_name}'
+
+    @staticmethod
+    def local_path(model_type, model_name):
+        return os.path.join(models_path[model_type], model_name)
+
+    @staticmethod
+    def is_alive(owner):
+        try:
+            os.kill(int(owner), 0)
+        except ProcessLookupError:
+            return False
+        except Exception:
+            pass
+        return True
+
+    @contextmanager
+    def locked(self):
+        with self.lock:
+            if self.lock_depth == 0 and fcntl is not None:
+                os.makedirs(os.path.dirname(self.lock_path) or '.', exist_ok=True)
+                self.lock_file = open(self.lock_path, 'a')
+                fcntl.flock(self.lock_file, fcntl.LOCK_EX)
+            self.lock_depth += 1
+            try:
+                yield
+            finally:
+                self.lock_depth -= 1
+                if self.lock_depth == 0 and self.lock_file is not None:
+                    fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+                    self.lock_file.close()
+                    self.lock_file = None
+
+    def sync(self):
+        """
+        Re-reads the manifest, so models added or evicted by the other processes are seen.
+        Call with the lock held.
+        """
+        try:
+            with open(self.manifest_path) as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            manifest = {}
+        except Exception as e:
+            logger.error(f'model cache manifest {self.manifest_path} unreadable, rebuilding: {e}')
+            manifest = {}
+        # manifests of older versions hold the models only
+        models = manifest.get('models', {}) if 'processes' in manifest else manifest
+
+        entries = {}
+        for key, entry in models.items():
+            # touches of this process are kept until they are saved
+            ours = self.entries.get(key)
+            entries[key] = ours if ours and ours['last_access'] > entry['last_access'] else entry
+        self.entries = entries
+        self.processes = {owner: process for owner, process in manifest.get('processes', {}).items()
+                          if owner != self.owner and self.is_alive(owner)}
+
+    def write(self):
+        # call with the lock held, after sync
+        tmp_path = f'{self.manifest_path}.{self.owner}.tmp'
+        try:
+            os.makedirs(os.path.dirname(self.manifest_path) or '.', exist_ok=True)
+            processes = dict(self.processes)
+            processes[self.owner] = {'reserved': self.reserved, 'keep': sorted(self.keep)}
+            with open(tmp_path, 'w') as f:
+                json.dump({'models': self.entries, 'processes': processes}, f)
+            os.replace(tmp_path, self.manifest_path)
+        except Exception as e:
+            logger.error(f'save model cache manifest error: {e}')
+
+    def load(self):
+        with self.locked():
+            if self.loaded:
+                return
+            self.loaded = True
+            self.sync()
+
+            # one walk per process to pick up models that are not in the manifest yet
+            found = {}
+            for model_type in models_type_list:
+                if not models_path[model_type] or not os.path.isdir(models_path[model_type]):
+                    continue
+                for path, subdirs, files in os.walk(models_path[model_type]):
+                    for name in files:
+                        if os.path.splitext(name)[1] not in CN_MODEL_EXTS:
+                            continue
+                        full_path_name = os.path.join(path, name)
+                        name_local = os.path.relpath(full_path_name, models_path[model_type])
+                        key = self.key(model_type, name_local)
+                        found[key] = self.entries.get(key) or {
+                            'type': model_type,
+                            'name': name_local,
+                            'size': os.path.getsize(full_path_name),
+                            'last_access': 0,
+                            'hits': 0,
+                        }
+            self.entries = found
+            self.write()
+
+    def save(self):
+        with self.locked():
+            self.sync()
+            self.write()
+
+    def has(self, model_type, model_name):
+        with self.lock:
+            key = self.key(model_type, model_name)
+            path = self.local_path(model_type, model_name)
+            if key in self.entries:
+                if os.path.exists(path):
+                    return True
+                del self.entries[key]
+                return False
+            # files without a model extension, put in place by hand or by another process
+            if os.path.exists(path):
+                self.add(model_type, model_name)
+                return True
+            return False
+
+    def touch(self, model_type, model_name):
+        with self.lock:
+            entry = self.entries.get(self.key(model_type, model_name))
+            if entry:
+                entry['hits'] = self.weight(entry) + 1
+                entry['last_access'] = time.time()
+
+    def add(self, model_type, model_name):
+        path = self.local_path(model_type, model_name)
+        with self.locked():
+            self.sync()
+            self.entries[self.key(model_type, model_name)] = {
+                'type': model_type,
+                'name': model_name,
+                'size': os.path.getsize(path) if os.path.isfile(path) else 0,
+                'last_access': time.time(),
+                'hits': 1,
+            }
+            self.write()
+
+    def remove(self, key):
+        entry = self.entries.pop(key)
+        path = self.local_path(entry['type'], entry['name'])
+        try:
+            os.remove(path)
+            logger.info(f'remove model {path}')
+        except FileNotFoundError:
+            pass
+        return entry['size']
+
+    @staticmethod
+    def weight(entry):
+        age = time.time() - entry['last_access']
+        return entry['hits'] * 0.5 ** (age / MODEL_CACHE_HALF_LIFE)
+
+    def score(self, entry):
+        return entry['size'] * self.weight(entry)
+
+    def pin(self, keep):
+        """
+        Records the models the running request of this process needs, the other processes
+        leave them alone when they evict.
+        """
+        with self.locked():
+            self.keep = set(keep)
+            self.sync()
+            self.write()
+
+    def reserve(self, size, space_free_size, keep):
+        """
+        Evicts models outside of keep and of the models pinned by any process until there is
+        room for size bytes on top of the space_free_size headroom and the reservations of all
+        processes, then reserves size. Returns False when not enough can be freed.
+        """
+        with self.locked():
+            self.sync()
+            st = os.statvfs(disk_path)
+            reserved = self.reserved + sum(process.get('reserved', 0) for process in self.processes.values())
+            free = st.f_bavail * st.f_frsize - reserved
+            needed = max(space_free_size, size)
+            logger.info(f'current free space is {free}, needed {needed}')
+            if free < needed:
+                pinned = set(keep) | self.keep
+                for process in self.processes.values():
+                    pinned.update(process.get('keep', []))
+                candidates = sorted((key for key in self.entries if key not in pinned),
+                                    key=lambda key: self.score(self.entries[key]))
+                for key in candidates:
+                    free += self.remove(key)
+                    if free >= needed:
+                        break
+            if free >= needed:
+                self.reserved += size
+            self.write()
+            return free >= needed
+
+    def release(self, size):
+        with self.locked():
+            self.reserved -= size
+            self.sync()
+            self.write()
+
+
+model_cache = ModelCache(MODEL_CACHE_MANIFEST)
+
+s3_client = boto3.client('s3', config=botocore.config.Config(
+    max_pool_connections=MODEL_DOWNLOAD_WORKERS * MODEL_DOWNLOAD_CONCURRENCY))
+transfer_config = s3transfer.TransferConfig(
+    multipart_threshold=MODEL_DOWNLOAD_CHUNK_SIZE,
+    multipart_chunksize=MODEL_DOWNLOAD_CHUNK_SIZE,
+    max_concurrency=MODEL_DOWNLOAD_CONCURRENCY,
+)
+
+
+def get_model_size(model_s3_pos):
+    try:
+        bucket, key = split_s3_path(model_s3_pos)
+        return s3_client.head_object(Bucket=bucket, Key=key)['ContentLength']
+    except Exception as e:
+        logger.info(f'get size of {model_s3_pos} error: {e}')
+        return 0
+
+
+def selected_model_items(selected_models):
+    for model_type in models_type_list:
+        if model_type not in selected_models:
+            continue
+        for model in selected_models[model_type]:
+            if model_type == 'VAE' and model['model_name'] in ['Automatic', 'None']:
+                continue
+            yield model_type, model['model_name'], f'{model["s3"]}/{model["model_name"]}'
 
 
 def checkspace_and_update_models(selected_models):
+    global active_models
     print(selected_models)
-    models_num = len(models_type_list)
+    model_cache.load()
     space_free_size = selected_models['space_free_size']
-    # os.system("df -h")
-    for type_id in range(models_num):
-        model_type = models_type_list[type_id]
-        if model_type not in selected_models:
+    # models of this request must never be evicted to make room for each other
+    keep = {model_cache.key(model_type, model_name)
+            for model_type, model_name, _ in selected_model_items(selected_models)}
+    active_models = keep
+    model_cache.pin(keep)
+    downloads = []
+    for model_type, model_name, model_s3_pos in selected_model_items(selected_models):
+        if model_cache.has(model_type, model_name):
+            model_cache.touch(model_type, model_name)
             continue
+        downloads.append((model_type, model_name, model_s3_pos))
 
-        selected_models_name = selected_models[model_type]
-        local_models = []
-        for path, subdirs, files in os.walk(models_path[model_type]):
-            for name in files:
-                full_path_name = os.path.join(path, name)
-                name_local = os.path.relpath(full_path_name, models_path[model_type])
-                local_models.append(name_local)
-        for model in selected_models_name:
-            models_used_count[model_type].add_models_ref(model['model_name'])
-            if model['model_name'] in local_models:
-                continue
-            if model_type == 'VAE' and model['model_name'] in ['Automatic', 'None']:
-                print(f'skip vae download for {model["model_name"]}')
-                continue
-            else:
-                st = os.statvfs(disk_path)
-                free = (st.f_bavail * st.f_frsize)
-                print('!!!!!!!!!!!!current free space is', free)
-                if free < space_free_size:
-                    #### delete least used model to get more space ########
-                    space_check_success = False
-                    for i in range(models_num):
-                        type_id_check = (type_id + i)%models_num
-                        type_check = models_type_list[type_id_check]
-                        if type_check not in selected_models:
-                            continue
-                        selected_models_name_check = selected_models[type_check]
-                        print(f'check current model folder: {os.listdir(models_path[type_check])}')
-                        local_models_check = [f for f in os.listdir(models_path[type_check]) if os.path.splitext(f)[1] in CN_MODEL_EXTS]
-                        if len(local_models_check) == 0:
-                            continue
-                        sorted_local_modles = models_used_count[type_check].get_sorted_models(local_models_check)
-                        for local_model in sorted_local_modles:
-                            if local_model in selected_models_name_check:
-                                continue
-                            else:
-                                os.remove(os.path.join(models_path[type_check], local_model))
-                                print('remove models', os.path.join(models_path[type_check], local_model))
-                                models_used_count[type_check].remove_model_ref(local_model)
-                                st = os.statvfs(disk_path)
-                                free = (st.f_bavail * st.f_frsize)
-                                print('!!!!!!!!!!!!current free space is', free)
-                                if free > space_free_size:
-                                    space_check_success = True
-                                    break
-                        if space_check_success:
-                            break
-                    if not space_check_success:
-                        print('can not get enough space to download models!!!!!!')
-                        return
-
-                ####down load models######
-                download_and_update(model_type, f'{model["s3"]}/{model["model_name"]}')
-
-    shared.opts.sd_model_checkpoint = selected_models['Stable-diffusion'][0]["model_name"]
-    sd_models.reload_model_weights()
-    if 'VAE' in selected_models:
-        shared.opts.sd_vae = selected_models['VAE'][0]['model_name']
-        sd_vae.reload_vae_weights()
+    ####down load models######
+    downloaded = download_models(downloads, space_free_size, keep)
+    # also picks up what the prefetcher brought in while the previous job ran
+    refresh_stale_models()
+    model_cache.save()
+    if not downloaded:
+        print('can not get enough space to download models!!!!!!')
+        return
+
+    loaded_models.load(selected_models['Stable-diffusion'][0]["model_name"],
+                       selected_models['VAE'][0]['model_name'] if 'VAE' in selected_models else None)
+
+
+class LoadedModels:
+    """
+    Remembers the checkpoint and VAE in GPU memory, so a request for the same pair skips
+    the reload, and counts where each checkpoint load was served from.
+    """
+
+    def __init__(self):
+        self.checkpoint = None
+        self.vae = None
+        self.stats = {'loaded_hits': 0, 'ram_hits': 0, 'disk_loads': 0, 'vae_reloads': 0}
+
+    def is_loaded(self, checkpoint, vae):
+        return (shared.sd_model is not None and self.checkpoint == checkpoint
+                and (vae is None or self.vae == vae))
+
+    @staticmethod
+    def in_ram_cache(checkpoint):
+        checkpoint_info = sd_models.get_closet_checkpoint_match(checkpoint)
+        return checkpoint_info is not None and checkpoint_info in getattr(sd_models, 'checkpoints_loaded', {})
+
+    def load(self, checkpoint, vae):
+        if self.is_loaded(checkpoint, vae):
+            self.stats['loaded_hits'] += 1
+            return
+
+        if self.checkpoint != checkpoint or shared.sd_model is None:
+            # the webui keeps swapped out checkpoints in an LRU of CPU state dicts of this size
+            shared.opts.sd_checkpoint_cache = CHECKPOINT_RAM_CACHE
+            self.stats['ram_hits' if self.in_ram_cache(checkpoint) else 'disk_loads'] += 1
+            shared.opts.sd_model_checkpoint = checkpoint
+            sd_models.reload_model_weights()
+            self.checkpoint = checkpoint
+            # a checkpoint load may bring its own VAE along
+            self.vae = None
+
+        if vae is not None and self.vae != vae:
+            self.stats['vae_reloads'] += 1
+            shared.opts.sd_vae = vae
+            sd_vae.reload_vae_weights()
+            self.vae = vae
+
+
+loaded_models = LoadedModels()
 
 
 def download_model(model_name, model_s3_pos):
@@ -113,30 +408,337 @@ def upload_model(model_type, model_name, model_s3_pos):
     os.system(f's5cmd sync {model_name} {model_s3_pos}')
 
 
+class PeekableStream:
+    """
+    Read-only stream over a StreamingBody that hands out the first bytes before they are
+    consumed, and counts what has been read for progress reports.
+    """
+
+    def __init__(self, body, name):
+        self.body = body
+        self.name = name
+        self.head = b''
+        self.progress = DownloadProgress(name)
+
+    def peek(self, size):
+        while len(self.head) < size:
+            chunk = self.body.read(size - len(self.head))
+            if not chunk:
+                break
+            self.head += chunk
+        return self.head[:size]
+
+    def read(self, size=-1):
+        if self.head:
+            if size < 0:
+                data, self.head = self.head + self.body.read(), b''
+            else:
+                data, self.head = self.head[:size], self.head[size:]
+        else:
+            data = self.body.read() if size < 0 else self.body.read(size)
+        self.progress(len(data))
+        return data
+
+
+class DownloadProgress:
+
+    def __init__(self, name):
+        self.name = name
+        self.lock = threading.Lock()
+        self.bytes = 0
+        self.start = time.time()
+        self.logged = self.start
+
+    def __call__(self, bytes_amount):
+        with self.lock:
+            self.bytes += bytes_amount
+            now = time.time()
+            if now - self.logged >= PROGRESS_LOG_INTERVAL:
+                self.logged = now
+                logger.info(f'download {self.name}: {self.bytes / 1024 / 1024:.0f} MB '
+                            f'in {now - self.start:.0f}s')
+
+    def summary(self):
+        seconds = time.time() - self.start
+        return {
+            'model': self.name,
+            'bytes': self.bytes,
+            'seconds': round(seconds, 2),
+            'mb_per_second': round(self.bytes / 1024 / 1024 / seconds, 2) if seconds else 0,
+        }
+
+
+def is_tar(head: bytes):
+    return len(head) >= 262 and head[257:262] == b'ustar'
+
+
+def extract_tar_stream(stream, target_dir='.'):
+    with tarfile.open(fileobj=stream, mode='r|') as tar:
+        if hasattr(tarfile, 'data_filter'):
+            tar.extractall(target_dir, filter='data')
+        else:
+            tar.extractall(target_dir)
+
+
+def download_model_files(model_type, model_s3_pos):
+    """
+    Downloads a model and the files next to it that share its name (config, preview...)
+    straight into the model folder, each large file with parallel ranged GETs.
+    """
+    bucket, key = split_s3_path(model_s3_pos)
+    folder, file_name = os.path.split(key)
+    prefix = f'{folder}/{file_name.split(".")[0]}'
+    target_dir = models_path[model_type]
+    os.makedirs(target_dir, exist_ok=True)
+
+    progress = DownloadProgress(file_name)
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for item in page.get('Contents', []):
+            local_path = os.path.join(target_dir, os.path.basename(item['Key']))
+            tmp_path = f'{local_path}.downloading'
+            s3_client.download_file(bucket, item['Key'], tmp_path, Config=transfer_config, Callback=progress)
+            os.replace(tmp_path, local_path)
+    return progress
+
+
 def download_and_update(model_type, model_s3_pos):
-    #download from s3
-    logger.info(f's5cmd sync "{model_s3_pos}" ./')
-    os.system(f's5cmd sync "{model_s3_pos}" ./')
-    tar_name = model_s3_pos.split('/')[-1]
-    logger.info(tar_name)
-    command = f'file --mime-type -b ./"{tar_name}"'
-    file_type = subprocess.check_output(command, shell=True).decode('utf-8').strip()
-    logger.info(f"file_type is {file_type}")
-    if file_type == TAR_TYPE_FILE:
-        logger.info("model type is tar")
-        os.system(f"tar xvf '{tar_name}'")
-        os.system(f"rm '{tar_name}'")
-        os.system("df -h")
+    """
+    Downloads one model without shelling out. The first bytes tell a tar archive, which is
+    extracted while it streams, from a plain model file.
+    """
+    bucket, key = split_s3_path(model_s3_pos)
+    body = s3_client.get_object(Bucket=bucket, Key=key)['Body']
+    stream = PeekableStream(body, key.split('/')[-1])
+    if is_tar(stream.peek(512)):
+        logger.info(f"model {model_s3_pos} type is tar")
+        extract_tar_stream(stream)
+        progress = stream.progress
     else:
-        os.system(f"rm '{tar_name}'")  # 使用引号括起文件名
-        logger.info(f"model type is origin file type: {file_type}")
-        prefix_name = model_s3_pos.split('.')[0]
-        if model_type == 'embeddings':
-            os.system(f's5cmd sync "{prefix_name}"* ./{model_type}/')
-        else:
-            os.system(f's5cmd sync "{prefix_name}"* ./models/{model_type}/')
+        body.close()
+        logger.info(f"model {model_s3_pos} type is origin file type")
+        progress = download_model_files(model_type, model_s3_pos)
+
+    summary = progress.summary()
+    logger.info(f"download finished {summary}")
+    return summary
+
+
+class ModelsDirGate:
+    """
+    Lets any number of downloads write into the models folder at once, or one caller
+    replace the folder itself while nothing writes to it. The webui processes of the other
+    GPUs share the folder, so the gate is also held as a shared / exclusive flock on
+    MODELS_DIR_LOCK.
+    """
+
+    def __init__(self, lock_path: str):
+        self.lock_path = lock_path
+        self.condition = threading.Condition()
+        self.writers = 0
+        self.exclusive = False
+
+    @contextmanager
+    def file_lock(self, exclusive: bool):
+        if fcntl is None:
+            yield
+            return
+        with open(self.lock_path, 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    @contextmanager
+    def write(self):
+        with self.condition:
+            self.condition.wait_for(lambda: not self.exclusive)
+            self.writers += 1
+        try:
+            with self.file_lock(exclusive=False):
+                yield
+        finally:
+            with self.condition:
+                self.writers -= 1
+                self.condition.notify_all()
+
+    @contextmanager
+    def replace(self):
+        with self.condition:
+            self.condition.wait_for(lambda: not self.exclusive)
+            self.exclusive = True
+            self.condition.wait_for(lambda: self.writers == 0)
+        try:
+            with self.file_lock(exclusive=True):
+                yield
+        finally:
+            with self.condition:
+                self.exclusive = False
+                self.condition.notify_all()
+
+
+models_dir_gate = ModelsDirGate(MODELS_DIR_LOCK)
+
+# models being downloaded, by cache key, so a request and the prefetcher never fetch the same one twice
+inflight = {}
+inflight_lock = threading.Lock()
+# model types with new files the webui lists don't know about yet
+stale_model_types = set()
+# models of the request that holds the model slot
+active_models = set()
+
+
+def fetch_model(model_type, model_name, model_s3_pos, space_free_size, keep):
+    """
+    Makes sure one model is on local disk, waiting for a download of it that is already
+    running. Returns False when there is not enough space for it.
+    """
+    key = model_cache.key(model_type, model_name)
+    with inflight_lock:
+        event = inflight.get(key)
+        owner = event is None
+        if owner:
+            event = inflight[key] = threading.Event()
+    if not owner:
+        event.wait()
+        return model_cache.has(model_type, model_name)
+
+    try:
+        if model_cache.has(model_type, model_name):
+            return True
+        size = get_model_size(model_s3_pos)
+        # eviction removes files from the models dir as well, so it runs inside the gate too
+        with models_dir_gate.write():
+            if not model_cache.reserve(size, space_free_size, keep):
+                return False
+            try:
+                download_and_update(model_type, model_s3_pos)
+                model_cache.add(model_type, model_name)
+            finally:
+                model_cache.release(size)
+        with inflight_lock:
+            stale_model_types.add(model_type)
+        return True
+    finally:
+        with inflight_lock:
+            del inflight[key]
+        event.set()
+
+
+def download_models(downloads, space_free_size, keep):
+    """
+    Downloads the models of a request in parallel, so a cold start takes about as long as
+    the largest model instead of the sum of all. downloads holds
+    (model_type, model_name, model_s3_pos) tuples.
+    """
+    if not downloads:
+        return True
+
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=min(MODEL_DOWNLOAD_WORKERS, len(downloads))) as executor:
+        results = list(executor.map(lambda item: fetch_model(*item, space_free_size, keep), downloads))
+    logger.info(f'downloaded {len(downloads)} models in {time.time() - start:.1f}s')
+    return all(results)
+
+
+def refresh_stale_models():
+    # the webui model lists are not thread safe, they are refreshed once per type from the request thread
+    with inflight_lock:
+        model_types = [model_type for model_type in models_type_list if model_type in stale_model_types]
+        stale_model_types.clear()
+    for model_type in model_types:
+        refresh_models(model_type)
+
+
+def warm_page_cache(model_type, model_name):
+    try:
+        fd = os.open(model_cache.local_path(model_type, model_name), os.O_RDONLY)
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+        finally:
+            os.close(fd)
+    except Exception as e:
+        logger.info(f'warm page cache for {model_name} error: {e}')
+
+
+class ModelPrefetcher:
+    """
+    Downloads the models of requests that wait for the model slot while the current job runs,
+    the model wanted by the most waiting requests first.
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.demand = {}
+        self.done = set()
+        self.thread = None
+
+    def add(self, selected_models):
+        if not selected_models:
+            return
+        with self.condition:
+            for model_type, model_name, model_s3_pos in selected_model_items(selected_models):
+                key = model_cache.key(model_type, model_name)
+                item = self.demand.setdefault(key, {
+                    'type': model_type,
+                    'name': model_name,
+                    's3': model_s3_pos,
+                    'space_free_size': selected_models['space_free_size'],
+                    'count': 0,
+                })
+                item['count'] += 1
+            if not self.thread:
+                self.thread = threading.Thread(target=self.run, name='model-prefetch', daemon=True)
+                self.thread.start()
+            self.condition.notify()
+
+    def remove(self, selected_models):
+        if not selected_models:
+            return
+        with self.condition:
+            for model_type, model_name, _ in selected_model_items(selected_models):
+                key = model_cache.key(model_type, model_name)
+                item = self.demand.get(key)
+                if item:
+                    item['count'] -= 1
+                    if item['count'] <= 0:
+                        del self.demand[key]
+                        self.done.discard(key)
+
+    def next_model(self):
+        with self.condition:
+            while True:
+                candidates = [(key, item) for key, item in self.demand.items()
+                              if key not in self.done and key not in inflight]
+                if candidates:
+                    return max(candidates, key=lambda candidate: candidate[1]['count'])
+                self.condition.wait()
+
+    def run(self):
+        model_cache.load()
+        while True:
+            key, item = self.next_model()
+            with self.condition:
+                keep = set(self.demand) | active_models
+            try:
+                if fetch_model(item['type'], item['name'], item['s3'], item['space_free_size'], keep):
+                    if PREFETCH_TO_RAM:
+                        warm_page_cache(item['type'], item['name'])
+                    logger.info(f"prefetched {key} for {item['count']} waiting requests")
+                else:
+                    logger.info(f'no space to prefetch {key}')
+            except Exception as e:
+                logger.error(f'prefetch {key} error: {e}')
+            with self.condition:
+                # local now, or not worth retrying while these requests still wait
+                self.done.add(key)
+
+
+model_prefetcher = ModelPrefetcher()
+
 
-    logger.info("download finished")
+def refresh_models(model_type):
     if model_type == 'Stable-diffusion':
         sd_models.list_models()
     if model_type == 'hypernetworks':
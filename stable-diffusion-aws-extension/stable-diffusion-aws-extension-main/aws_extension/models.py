@@ -19,6 +19,8 @@ class InvocationsRequest(BaseModel):
     payload_string: Optional[str] = None
     workflow: Optional[str] = None
     port: Optional[str] = "8080"
+    # write generated images to S3 and return a manifest instead of base64 images
+    output_to_s3: Optional[bool] = None
 
 
 class PingResponse(BaseModel):
@@ -26,12 +26,28 @@ import re
 from modules.ui_components import ToolButton
 import asyncio
 import nest_asyncio
+import io
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+from requests.adapters import HTTPAdapter
 
 from utils import cp, tar, rm
 
 logger = logging.getLogger(__name__)
 logger.setLevel(utils.LOGGING_LEVEL)
 
+IMAGE_FETCH_WORKERS = 8
+# seconds the API holds a job request until the job is done
+LONG_POLL_SECONDS = 20
+# polling of a running inference job starts fast and backs off to the max interval
+POLL_INTERVAL = 0.5
+POLL_MAX_INTERVAL = 5
+POLL_BACKOFF = 1.5
+
+# one pooled session, so the images of a result reuse connections to S3
+http_session = requests.Session()
+http_session.mount('https://', HTTPAdapter(pool_connections=IMAGE_FETCH_WORKERS, pool_maxsize=IMAGE_FETCH_WORKERS))
+
 None_Option_For_On_Cloud_Model = "don't use on cloud inference"
 None_Option_For_Infer_Job = "No Selected"
 
@@ -273,8 +289,10 @@ def query_inference_job_list(task_type: str = '', status: str = '',
         return gr.Dropdown.update(choices=[])
 
 
-def get_inference_job(inference_job_id):
+def get_inference_job(inference_job_id, wait=0):
     url = f'inferences/{inference_job_id}'
+    if wait:
+        url = f'{url}?wait={wait}'
     response = server_request(url)
     logger.debug(f"get_inference_job response {response}")
     infer_id = ""
@@ -303,52 +321,65 @@ def get_inference_job(inference_job_id):
     return response.json()['data']
 
 
+def fetch_urls(urls: list, handle):
+    """
+    Fetches the urls concurrently and passes each response to handle as it arrives,
+    results keep the order of the urls and failed ones are left out.
+    """
+    def fetch(url):
+        try:
+            response = http_session.get(url)
+            response.raise_for_status()
+            return handle(url, response)
+        except requests.exceptions.RequestException as e:
+            logger.error(f"Error downloading image {url}: {e}")
+            return None
+
+    if not urls:
+        return []
+    with ThreadPoolExecutor(max_workers=min(IMAGE_FETCH_WORKERS, len(urls))) as executor:
+        return [result for result in executor.map(fetch, urls) if result is not None]
+
+
 def download_images(image_urls: list, local_directory: str):
     if not os.path.exists(local_directory):
         os.makedirs(local_directory)
 
-    image_list = []
-    for url in image_urls:
-        try:
-            response = requests.get(url)
-            response.raise_for_status()
-            image_name = os.path.basename(url).split('?')[0]
-            local_path = os.path.join(local_directory, image_name)
+    def save(url, response):
+        image_name = os.path.basename(url).split('?')[0]
+        local_path = os.path.join(local_directory, image_name)
 
-            with open(local_path, 'wb') as f:
-                f.write(response.content)
-            image_list.append(local_path)
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Error downloading image {url}: {e}")
-    return image_list
+        with open(local_path, 'wb') as f:
+            f.write(response.content)
+        return local_path
+
+    return fetch_urls(image_urls, save)
 
 
 def download_images_to_json(image_urls: list):
-    results = []
-    for url in image_urls:
-        try:
-            response = requests.get(url)
-            response.raise_for_status()
-            json_resp = response.json()
-            results.append(json_resp['info'])
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Error downloading image {url}: {e}")
-    return results
+    return fetch_urls(image_urls, lambda url, response: response.json()['info'])
 
 
 def download_images_to_pil(image_urls: list):
-    image_list = []
-    for url in image_urls:
-        try:
-            response = requests.get(url)
-            response.raise_for_status()
-            from PIL import Image
-            import io
-            pil_image = Image.open(io.BytesIO(response.content))
-            image_list.append(pil_image)
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Error downloading image {url}: {e}")
-    return image_list
+    def decode(url, response):
+        pil_image = Image.open(io.BytesIO(response.content))
+        # decode in the fetching thread instead of lazily on first use
+        pil_image.load()
+        return pil_image
+
+    return fetch_urls(image_urls, decode)
+
+
+def wait_for_inference_job(inference_id, resp):
+    interval = POLL_INTERVAL
+    while resp and resp['status'] == "inprogress":
+        start = time.time()
+        resp = get_inference_job(inference_id, wait=LONG_POLL_SECONDS)
+        # an API without long polling answers right away, fall back to polling with backoff
+        if resp and resp['status'] == "inprogress" and time.time() - start < POLL_INTERVAL:
+            time.sleep(interval)
+            interval = min(interval * POLL_BACKOFF, POLL_MAX_INTERVAL)
+    return resp
 
 
 def get_model_list_by_type(model_type, username=""):
@@ -719,9 +750,7 @@ def process_result_by_inference_id(inference_id_or_data, endpoint_type):
             raise Exception(resp)
 
         if resp['taskType'] in ['txt2img', 'img2img', 'interrogate_clip', 'interrogate_deepbooru']:
-            while resp and resp['status'] == "inprogress":
-                time.sleep(1)
-                resp = get_inference_job(inference_id)
+            resp = wait_for_inference_job(inference_id, resp)
             if resp is None:
                 logger.info(f"get_inference_job resp is null.")
                 return image_list, info_text, plaintext_to_html(infotexts), infotexts
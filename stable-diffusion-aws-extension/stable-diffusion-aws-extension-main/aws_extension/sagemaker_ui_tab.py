@@ -782,7 +782,9 @@ def model_upload_tab():
                     model['id'],
                 ])
 
-            return models, show_page_info, f"Page: {page}/{pages}    Total: {total} items    PerPage: {per_page}"
+            # pages and total are lower bounds while there are more checkpoints to list
+            more = '+' if resp.json()['data'].get('last_evaluated_key') else ''
+            return models, show_page_info, f"Page: {page}/{pages}{more}    Total: {total}{more} items    PerPage: {per_page}"
 
         gr.HTML(value="<b>Cloud Model List</b>")
         model_list = gr.Dataframe(headers=['name', 'type', 'user/roles', 'status', 'time', 'id'],
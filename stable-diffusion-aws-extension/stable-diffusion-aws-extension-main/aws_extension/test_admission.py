@@ -0,0 +1,110 @@
+import json
+import threading
+import time
+from unittest import TestCase
+
+from aws_extension.admission import AdmissionQueue, AdmissionRejected, RETRY_AFTER_SECONDS
+
+
+class AdmissionQueueTest(TestCase):
+
+    def setUp(self):
+        self.admission = AdmissionQueue({'model': 1, 'light': 2}, max_waiting=2, wait_timeout=5)
+
+    def acquire_in_thread(self, group, admitted: list, name=None):
+        def acquire():
+            try:
+                self.admission.acquire(group)
+                admitted.append(name or group)
+            except AdmissionRejected as e:
+                admitted.append(e.status_code)
+
+        thread = threading.Thread(target=acquire, daemon=True)
+        thread.start()
+        return thread
+
+    def wait_for_waiters(self, count):
+        deadline = time.time() + 2
+        while self.admission.waiting() < count and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.admission.waiting(), count)
+
+    def test_group_limits(self):
+        self.admission.acquire('model')
+        self.admission.acquire('light')
+        self.admission.acquire('light')
+
+        self.assertEqual(self.admission.stats()['running'], {'model': 1, 'light': 2})
+
+    def test_waiters_are_admitted_in_order(self):
+        self.admission.acquire('model')
+        admitted = []
+        first = self.acquire_in_thread('model', admitted, 'first')
+        self.wait_for_waiters(1)
+        second = self.acquire_in_thread('model', admitted, 'second')
+        self.wait_for_waiters(2)
+
+        self.admission.release('model')
+        first.join(2)
+        self.assertEqual(admitted, ['first'])
+
+        self.admission.release('model')
+        second.join(2)
+        self.assertEqual(admitted, ['first', 'second'])
+
+    def test_one_group_does_not_block_another(self):
+        self.admission.acquire('model')
+        admitted = []
+        waiting = self.acquire_in_thread('model', admitted)
+        self.wait_for_waiters(1)
+
+        self.admission.acquire('light')
+
+        self.assertEqual(admitted, [])
+        self.admission.release('model')
+        waiting.join(2)
+        self.assertEqual(admitted, ['model'])
+
+    def test_full_queue_is_rejected_with_429(self):
+        self.admission.acquire('model')
+        admitted = []
+        waiters = [self.acquire_in_thread('model', admitted) for _ in range(2)]
+        self.wait_for_waiters(2)
+
+        with self.assertRaises(AdmissionRejected) as e:
+            self.admission.acquire('model')
+        self.assertEqual(e.exception.status_code, 429)
+        self.assertEqual(self.admission.stats()['rejected'], 1)
+
+        for _ in waiters:
+            self.admission.release('model')
+        for waiter in waiters:
+            waiter.join(2)
+
+    def test_wait_timeout_is_rejected_with_503(self):
+        admission = AdmissionQueue({'model': 1}, max_waiting=2, wait_timeout=0.1)
+        admission.acquire('model')
+
+        with self.assertRaises(AdmissionRejected) as e:
+            admission.acquire('model')
+
+        self.assertEqual(e.exception.status_code, 503)
+        self.assertEqual(admission.waiting(), 0)
+
+    def test_rejection_response_has_retry_after(self):
+        response = AdmissionRejected(429, 'too many waiting requests: 2').response('job-1')
+
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.headers['Retry-After'], str(RETRY_AFTER_SECONDS))
+        self.assertEqual(json.loads(response.body), {'id': 'job-1', 'message': 'too many waiting requests: 2'})
+
+    def test_wait_histogram(self):
+        self.admission.acquire('light')
+        self.admission.observe_wait(7)
+
+        wait_seconds = self.admission.stats()['wait_seconds']
+        self.assertEqual(wait_seconds['count'], 2)
+        self.assertEqual(wait_seconds['buckets']['0.1'], 1)
+        self.assertEqual(wait_seconds['buckets']['5'], 1)
+        self.assertEqual(wait_seconds['buckets']['10'], 2)
+        self.assertEqual(wait_seconds['buckets']['+Inf'], 2)
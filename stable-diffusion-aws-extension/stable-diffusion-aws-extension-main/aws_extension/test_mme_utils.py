@@ -1,5 +1,12 @@
+import json
+import os
+import shutil
 import sys
+import tempfile
+import time
+from types import SimpleNamespace
 from unittest import TestCase
+from unittest.mock import patch
 
 
 class MmeUtilsTest(TestCase):
@@ -36,3 +43,191 @@ class MmeUtilsTest(TestCase):
         from mme_utils import checkspace_and_update_models
 
         checkspace_and_update_models(selected_models)
+
+
+class ModelCacheTest(TestCase):
+
+    def setUp(self):
+        from aws_extension import mme_utils
+
+        self.mme_utils = mme_utils
+        self.cwd = os.getcwd()
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+        # models_path is relative to the webui dir
+        os.chdir(self.root)
+        self.addCleanup(os.chdir, self.cwd)
+        self.free = 0
+        statvfs = patch.object(mme_utils.os, 'statvfs', side_effect=lambda path: self.fake_statvfs())
+        statvfs.start()
+        self.addCleanup(statvfs.stop)
+        self.cache = mme_utils.ModelCache('models/model_cache.json')
+
+    def fake_statvfs(self):
+        return SimpleNamespace(f_bavail=self.free, f_frsize=1)
+
+    def write_model(self, model_type, model_name, size):
+        path = self.mme_utils.ModelCache.local_path(model_type, model_name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(b'\0' * size)
+        return path
+
+    def add_model(self, model_type, model_name, size, hits=1, last_access=None):
+        self.write_model(model_type, model_name, size)
+        self.cache.add(model_type, model_name)
+        entry = self.cache.entries[self.cache.key(model_type, model_name)]
+        entry['hits'] = hits
+        entry['last_access'] = time.time() if last_access is None else last_access
+
+    def test_load_indexes_models_on_disk(self):
+        self.write_model('Stable-diffusion', 'v1-5.safetensors', 100)
+        self.write_model('Lora', 'sub/style.safetensors', 10)
+        self.write_model('Lora', 'notes.txt', 5)
+
+        self.cache.load()
+
+        self.assertEqual(set(self.cache.entries), {'Stable-diffusion/v1-5.safetensors', 'Lora/sub/style.safetensors'})
+        self.assertEqual(self.cache.entries['Stable-diffusion/v1-5.safetensors']['size'], 100)
+
+    def test_manifest_survives_restart(self):
+        self.write_model('Lora', 'style.safetensors', 10)
+        self.cache.load()
+        self.cache.touch('Lora', 'style.safetensors')
+        self.cache.save()
+
+        restarted = self.mme_utils.ModelCache('models/model_cache.json')
+        restarted.load()
+
+        self.assertGreater(restarted.entries['Lora/style.safetensors']['hits'], 0.9)
+
+    def test_has_drops_models_removed_from_disk(self):
+        path = self.write_model('Lora', 'style.safetensors', 10)
+        self.cache.add('Lora', 'style.safetensors')
+        os.remove(path)
+
+        self.assertFalse(self.cache.has('Lora', 'style.safetensors'))
+        self.assertNotIn('Lora/style.safetensors', self.cache.entries)
+
+    def test_weight_decays_with_half_life(self):
+        entry = {'hits': 4, 'last_access': time.time() - self.mme_utils.MODEL_CACHE_HALF_LIFE}
+
+        self.assertAlmostEqual(self.mme_utils.ModelCache.weight(entry), 2, places=2)
+
+    def test_reserve_evicts_cheapest_models_first(self):
+        # same size, the model used least recently goes first
+        self.add_model('Lora', 'old.safetensors', 100, hits=1, last_access=0)
+        self.add_model('Lora', 'recent.safetensors', 100, hits=1)
+        # bigger and hit often, the most expensive to bring back
+        self.add_model('Stable-diffusion', 'base.safetensors', 1000, hits=10)
+        self.free = 50
+
+        self.assertTrue(self.cache.reserve(120, 0, keep=set()))
+
+        self.assertFalse(os.path.exists('models/Lora/old.safetensors'))
+        self.assertTrue(os.path.exists('models/Lora/recent.safetensors'))
+        self.assertTrue(os.path.exists('models/Stable-diffusion/base.safetensors'))
+        self.assertEqual(self.cache.reserved, 120)
+
+    def test_reserve_keeps_models_of_the_request(self):
+        self.add_model('Lora', 'old.safetensors', 100, hits=1, last_access=0)
+        self.add_model('Lora', 'recent.safetensors', 100, hits=1)
+        self.free = 50
+
+        self.assertTrue(self.cache.reserve(120, 0, keep={'Lora/old.safetensors'}))
+
+        self.assertIn('Lora/old.safetensors', self.cache.entries)
+        self.assertNotIn('Lora/recent.safetensors', self.cache.entries)
+
+    def test_reserve_fails_when_not_enough_can_be_freed(self):
+        self.add_model('Lora', 'style.safetensors', 100)
+        self.free = 50
+
+        self.assertFalse(self.cache.reserve(500, 0, keep={'Lora/style.safetensors'}))
+        self.assertEqual(self.cache.reserved, 0)
+
+    def test_reservations_do_not_share_free_space(self):
+        self.free = 150
+
+        self.assertTrue(self.cache.reserve(100, 0, keep=set()))
+        self.assertFalse(self.cache.reserve(100, 0, keep=set()))
+
+        self.cache.release(100)
+        self.assertTrue(self.cache.reserve(100, 0, keep=set()))
+
+    def other_process(self, owner='1'):
+        alive = patch.object(self.mme_utils.ModelCache, 'is_alive', staticmethod(lambda pid: pid in self.alive))
+        alive.start()
+        self.addCleanup(alive.stop)
+        self.alive = {owner}
+        other = self.mme_utils.ModelCache('models/model_cache.json')
+        other.owner = owner
+        other.load()
+        return other
+
+    def test_reservations_of_other_processes_are_counted(self):
+        other = self.other_process()
+        self.free = 150
+
+        self.assertTrue(other.reserve(100, 0, keep=set()))
+        self.assertFalse(self.cache.reserve(100, 0, keep=set()))
+
+        other.release(100)
+        self.assertTrue(self.cache.reserve(100, 0, keep=set()))
+
+    def test_reservations_of_dead_processes_are_dropped(self):
+        other = self.other_process()
+        self.free = 150
+        other.reserve(100, 0, keep=set())
+
+        self.alive.clear()
+
+        self.assertTrue(self.cache.reserve(100, 0, keep=set()))
+
+    def test_models_pinned_by_other_processes_are_not_evicted(self):
+        self.add_model('Lora', 'old.safetensors', 100, hits=1, last_access=0)
+        self.add_model('Lora', 'recent.safetensors', 100, hits=1)
+        self.cache.save()
+        other = self.other_process()
+        other.pin({'Lora/old.safetensors'})
+        self.free = 50
+
+        self.assertTrue(self.cache.reserve(120, 0, keep=set()))
+
+        self.assertTrue(os.path.exists('models/Lora/old.safetensors'))
+        self.assertFalse(os.path.exists('models/Lora/recent.safetensors'))
+
+    def test_models_added_by_other_processes_are_kept_in_the_manifest(self):
+        other = self.other_process()
+        self.write_model('Lora', 'mine.safetensors', 10)
+        self.write_model('Lora', 'theirs.safetensors', 10)
+
+        self.cache.add('Lora', 'mine.safetensors')
+        other.add('Lora', 'theirs.safetensors')
+        self.cache.save()
+
+        restarted = self.mme_utils.ModelCache('models/model_cache.json')
+        restarted.load()
+        self.assertEqual(set(restarted.entries), {'Lora/mine.safetensors', 'Lora/theirs.safetensors'})
+
+    def test_models_evicted_by_other_processes_are_dropped(self):
+        self.add_model('Lora', 'old.safetensors', 100, hits=1, last_access=0)
+        self.cache.save()
+        other = self.other_process()
+        self.free = 50
+
+        self.assertTrue(other.reserve(100, 0, keep=set()))
+        self.cache.save()
+
+        self.assertNotIn('Lora/old.safetensors', self.cache.entries)
+
+    def test_reads_manifest_of_older_versions(self):
+        self.write_model('Lora', 'style.safetensors', 10)
+        os.makedirs('models', exist_ok=True)
+        with open('models/model_cache.json', 'w') as f:
+            json.dump({'Lora/style.safetensors': {'type': 'Lora', 'name': 'style.safetensors', 'size': 10,
+                                                  'last_access': 100, 'hits': 3}}, f)
+
+        self.cache.load()
+
+        self.assertEqual(self.cache.entries['Lora/style.safetensors']['hits'], 3)
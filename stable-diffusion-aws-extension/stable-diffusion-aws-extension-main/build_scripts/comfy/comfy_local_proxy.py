@@ -24,8 +24,8 @@ from watchdog.events import FileSystemEventHandler
 import subprocess
 from dotenv import load_dotenv
 import logging
-import fcntl
 import hashlib
+from comfy_sync_utils import BlobStore, SyncDebouncer
 
 DISABLE_AWS_PROXY = 'DISABLE_AWS_PROXY'
 
@@ -75,6 +75,10 @@ max_wait_time = os.environ.get('MAX_WAIT_TIME', 86400)
 msg_max_wait_time = os.environ.get('MSG_MAX_WAIT_TIME', 86400)
 is_master_process = os.getenv('MASTER_PROCESS') == 'true'
 no_need_sync_files = ['.autosave', '.cache', '.autosave1', '~', '.swp']
+BLOB_UPLOAD_WORKERS = int(os.environ.get('BLOB_UPLOAD_WORKERS', 8))
+SYNC_QUIET_SECONDS = float(os.environ.get('SYNC_QUIET_SECONDS', 3))
+s3_client = boto3.client('s3')
+blob_store = BlobStore(s3_client, bucket_name, BLOB_UPLOAD_WORKERS, ignore_files=no_need_sync_files)
 
 need_resend_msg_result = []
 PREPARE_ID = 'default'
@@ -167,6 +171,14 @@ def send_service_msg(server_use, msg):
     server_use.send_sync(event, data, sid)
 
 
+def parse_sync_messages(data, last_seq):
+    # get_sync_msg lambdas older than the since parameter ignore it and return every message as a list
+    if isinstance(data, list):
+        return data, last_seq
+    data = data or {}
+    return data.get("messages") or [], data.get("last_seq", last_seq)
+
+
 def handle_sync_messages(server_use, msg_array):
     already_synced = False
     global sync_msg_list
@@ -257,8 +269,9 @@ def execute_proxy(func):
 
             save_already = False
             if comfy_need_sync:
+                sync_msg_seq = 0
                 msg_future = executorThread.submit(send_get_request,
-                                             f"{api_url}/sync/{prompt_id}")
+                                             f"{api_url}/sync/{prompt_id}?since={sync_msg_seq}")
                 done, _ = concurrent.futures.wait([execute_future, msg_future],
                                                   return_when=concurrent.futures.ALL_COMPLETED)
                 already_synced = False
@@ -269,12 +282,13 @@ def execute_proxy(func):
                         msg_response = future.result()
                         logger.info(f"get syc msg: {msg_response.json()}")
                         if msg_response.status_code == 200:
-                            if 'data' not in msg_response.json() or not msg_response.json().get("data"):
+                            sync_messages, sync_msg_seq = parse_sync_messages(msg_response.json().get("data"), sync_msg_seq)
+                            if not sync_messages:
                                 logger.error("there is no response from sync msg by thread ")
                                 time.sleep(1)
                             else:
                                 logger.debug(msg_response.json())
-                                already_synced = handle_sync_messages(server_use, msg_response.json().get("data"))
+                                already_synced = handle_sync_messages(server_use, sync_messages)
                     elif future == execute_future:
                         execute_resp = future.result()
                         logger.info(f"get execute status: {execute_resp.status_code}")
@@ -332,19 +346,20 @@ def execute_proxy(func):
 
                 m = msg_max_wait_time
                 while not already_synced:
-                    msg_response = send_get_request(f"{api_url}/sync/{prompt_id}")
+                    msg_response = send_get_request(f"{api_url}/sync/{prompt_id}?since={sync_msg_seq}")
                     # logger.info(msg_response.json())
                     if msg_response.status_code == 200:
+                        sync_messages, sync_msg_seq = parse_sync_messages(msg_response.json().get("data"), sync_msg_seq)
                         if m <= 0:
                             logger.error("there is no response from sync msg by timeout")
                             already_synced = True
-                        elif 'data' not in msg_response.json() or not msg_response.json().get("data"):
+                        elif not sync_messages:
                             logger.error("there is no response from sync msg")
                             time.sleep(1)
                             m = m - 1
                         else:
                             logger.debug(msg_response.json())
-                            already_synced = handle_sync_messages(server_use, msg_response.json().get("data"))
+                            already_synced = handle_sync_messages(server_use, sync_messages)
                             logger.info(f"already_synced is :{already_synced}")
                             time.sleep(1)
                             m = m - 1
@@ -466,13 +481,9 @@ def sync_default_files():
         # os.system(s5cmd_syn_node_command)
         compress_and_upload(f"{DIR2}", prepare_version)
         logger.info(f" sync input files")
-        s5cmd_syn_input_command = f's5cmd --log=error sync --delete=true {DIR3}/ "s3://{bucket_name}/comfy/{comfy_endpoint}/{prepare_version}/input/"'
-        logger.info(f"sync input files start {s5cmd_syn_input_command}")
-        os.system(s5cmd_syn_input_command)
+        blob_store.sync_folder_blobs(comfy_endpoint, DIR3, prepare_version, 'input')
         logger.info(f" sync models files")
-        s5cmd_syn_model_command = f's5cmd --log=error sync --delete=true {DIR1}/ "s3://{bucket_name}/comfy/{comfy_endpoint}/{prepare_version}/models/"'
-        logger.info(f"sync models files start {s5cmd_syn_model_command}")
-        os.system(s5cmd_syn_model_command)
+        blob_store.sync_folder_blobs(comfy_endpoint, DIR1, prepare_version, 'models')
         logger.info(f"Files changed in:: {need_prepare} {DIR2} {DIR1} {DIR3}")
         url = api_url + "prepare"
         logger.info(f"URL:{url}")
@@ -489,183 +500,86 @@ def sync_default_files():
         return None
 
 
-def sync_files(filepath, is_folder, is_auto):
-    try:
-        directory = os.path.dirname(filepath)
-        logger.info(f"Directory changed in: {directory} {filepath}")
-        if not directory:
-            logger.info("root path no need to sync files by duplicate opt")
+def get_sync_type(filepath):
+    directory = os.path.dirname(filepath)
+    if not directory:
+        return None
+    for ignore_item in no_need_sync_files:
+        if filepath.endswith(ignore_item):
             return None
-        logger.info(f"Files changed in: {filepath}")
+    if (str(directory).endswith(f"{DIR2}" if DIR2.startswith("/") else f"/{DIR2}")
+            or str(filepath) == DIR2 or str(filepath) == f'./{DIR2}' or f"{DIR2}/" in filepath):
+        return 'nodes'
+    if (str(directory).endswith(f"{DIR3}" if DIR3.startswith("/") else f"/{DIR3}")
+            or str(filepath) == DIR3 or str(filepath) == f'./{DIR3}' or f"{DIR3}/" in filepath):
+        return 'inputs'
+    if (str(directory).endswith(f"{DIR1}" if DIR1.startswith("/") else f"/{DIR1}")
+            or str(filepath) == DIR1 or str(filepath) == f'./{DIR1}' or f"{DIR1}/" in filepath):
+        return 'models'
+    return None
+
+
+def sync_files(prepare_type, filepaths):
+    try:
         timestamp = str(int(time.time() * 1000))
-        need_prepare = False
-        prepare_type = 'default'
+        logger.info(f"Files changed in {prepare_type}: {filepaths} time is:{timestamp}")
         need_reboot = False
-        for ignore_item in no_need_sync_files:
-            if filepath.endswith(ignore_item):
-                logger.info(f"no need to sync files by ignore files {filepath} ends by {ignore_item}")
-                return None
         prepare_version = PREPARE_ID if PREPARE_MODE == 'additional' else timestamp
-        if (str(directory).endswith(f"{DIR2}" if DIR2.startswith("/") else f"/{DIR2}")
-                or str(filepath) == DIR2 or str(filepath) == f'./{DIR2}' or f"{DIR2}/" in filepath):
-            logger.info(f" sync custom nodes files: {filepath}")
+        if prepare_type == 'nodes':
             s5cmd_syn_node_command = f's5cmd --log=error sync --delete=true --exclude="*comfy_local_proxy.py" {DIR2}/ "s3://{bucket_name}/comfy/{comfy_endpoint}/{prepare_version}/custom_nodes/"'
-            # s5cmd_syn_node_command = f'aws s3 sync {DIR2}/ "s3://{bucket_name}/comfy/{comfy_endpoint}/{timestamp}/custom_nodes/"'
-            # s5cmd_syn_node_command = f's5cmd sync {DIR2}/* "s3://{bucket_name}/comfy/{comfy_endpoint}/{timestamp}/custom_nodes/"'
-
-            # custom_node文件夹有变化 稍后再同步
-            if is_auto and not is_folder_unlocked(directory):
-                logger.info("sync custom_nodes files is changing ,waiting.... ")
-                return None
             logger.info("sync custom_nodes files start")
             logger.info(s5cmd_syn_node_command)
             os.system(s5cmd_syn_node_command)
-            need_prepare = True
             need_reboot = True
-            prepare_type = 'nodes'
-        elif (str(directory).endswith(f"{DIR3}" if DIR3.startswith("/") else f"/{DIR3}")
-              or str(filepath) == DIR3 or str(filepath) == f'./{DIR3}' or f"{DIR3}/" in filepath):
-            logger.info(f" sync input files: {filepath}")
-            s5cmd_syn_input_command = f's5cmd --log=error sync --delete=true {DIR3}/ "s3://{bucket_name}/comfy/{comfy_endpoint}/{prepare_version}/input/"'
-
-            # 判断文件写完后再同步
-            if is_auto:
-                if bool(is_folder):
-                    can_sync = is_folder_unlocked(filepath)
-                else:
-                    can_sync = is_file_unlocked(filepath)
-                if not can_sync:
-                    logger.info("sync input files is changing ,waiting.... ")
-                    return None
+        elif prepare_type == 'inputs':
             logger.info("sync input files start")
-            logger.info(s5cmd_syn_input_command)
-            os.system(s5cmd_syn_input_command)
-            need_prepare = True
-            prepare_type = 'inputs'
-        elif (str(directory).endswith(f"{DIR1}" if DIR1.startswith("/") else f"/{DIR1}")
-              or str(filepath) == DIR1 or str(filepath) == f'./{DIR1}' or f"{DIR1}/" in filepath):
-            logger.info(f" sync models files: {filepath}")
-            s5cmd_syn_model_command = f's5cmd --log=error sync --delete=true {DIR1}/ "s3://{bucket_name}/comfy/{comfy_endpoint}/{prepare_version}/models/"'
-
-            # 判断文件写完后再同步
-            if is_auto:
-                if bool(is_folder):
-                    can_sync = is_folder_unlocked(filepath)
-                else:
-                    can_sync = is_file_unlocked(filepath)
-                # logger.info(f'is folder {directory} {is_folder} can_sync {can_sync}')
-                if not can_sync:
-                    logger.info("sync input models is changing ,waiting.... ")
-                    return None
-
+            blob_store.sync_folder_blobs(comfy_endpoint, DIR3, prepare_version, 'input')
+        else:
             logger.info("sync models files start")
-            logger.info(s5cmd_syn_model_command)
-            os.system(s5cmd_syn_model_command)
-            need_prepare = True
-            prepare_type = 'models'
-        logger.info(f"Files changed in:: {need_prepare} {str(directory)} {DIR2} {DIR1} {DIR3}")
-        if need_prepare:
-            url = api_url + "prepare"
-            logger.info(f"URL:{url}")
-            data = {"endpoint_name": comfy_endpoint, "need_reboot": need_reboot, "prepare_id":  prepare_version,
-                    "prepare_type": prepare_type}
-            logger.info(f"prepare params Data: {json.dumps(data, indent=4)}")
-            result = subprocess.run(["curl", "--location", "--request", "POST", url, "--header",
-                                     f"x-api-key: {api_token}", "--data-raw", json.dumps(data)],
-                                    capture_output=True, text=True)
-            logger.info(result.stdout)
-            return result.stdout
-        return None
+            blob_store.sync_folder_blobs(comfy_endpoint, DIR1, prepare_version, 'models')
+
+        url = api_url + "prepare"
+        logger.info(f"URL:{url}")
+        data = {"endpoint_name": comfy_endpoint, "need_reboot": need_reboot, "prepare_id": prepare_version,
+                "prepare_type": prepare_type}
+        logger.info(f"prepare params Data: {json.dumps(data, indent=4)}")
+        result = subprocess.run(["curl", "--location", "--request", "POST", url, "--header",
+                                 f"x-api-key: {api_token}", "--data-raw", json.dumps(data)],
+                                capture_output=True, text=True)
+        logger.info(result.stdout)
+        logger.info(f"finish prepare in : {str(int(time.time() * 1000))}")
+        return result.stdout
     except Exception as e:
         logger.info(f"sync_files error {e}")
         return None
 
 
-def is_folder_unlocked(directory):
-    # logger.info("check if folder ")
-    event_handler = MyHandlerWithCheck()
-    observer = Observer()
-    observer.schedule(event_handler, directory, recursive=True)
-    observer.start()
-    time.sleep(1)
-    result = False
-    try:
-        if event_handler.file_changed:
-            logger.info(f"folder {directory} is still changing..")
-            event_handler.file_changed = False
-            time.sleep(1)
-            if event_handler.file_changed:
-                logger.info(f"folder {directory} is still still changing..")
-            else:
-                logger.info(f"folder {directory} changing stopped")
-                result = True
-        else:
-            logger.info(f"folder {directory} not stopped")
-            result = True
-    except (KeyboardInterrupt, Exception) as e:
-        logger.info(f"folder {directory} changed exception {e}")
-    observer.stop()
-    return result
-
-
-def is_file_unlocked(file_path):
-    # logger.info("check if file ")
-    try:
-        initial_size = os.path.getsize(file_path)
-        initial_mtime = os.path.getmtime(file_path)
-        time.sleep(1)
-
-        current_size = os.path.getsize(file_path)
-        current_mtime = os.path.getmtime(file_path)
-        if current_size != initial_size or current_mtime != initial_mtime:
-            logger.info(f"unlock file error {file_path} is changing")
-            return False
-
-        with open(file_path, 'r') as f:
-            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
-            return True
-    except (IOError, OSError, Exception) as e:
-        logger.info(f"unlock file error {file_path} is writing")
-        logger.error(e)
-        return False
-
-
-class MyHandlerWithCheck(FileSystemEventHandler):
-    def __init__(self):
-        self.file_changed = False
-
-    def on_modified(self, event):
-        logger.info(f"custom_node folder is changing {event.src_path}")
-        self.file_changed = True
-
-    def on_deleted(self, event):
-        logger.info(f"custom_node folder is changing {event.src_path}")
-        self.file_changed = True
-
-    def on_created(self, event):
-        logger.info(f"custom_node folder is changing {event.src_path}")
-        self.file_changed = True
+stop_event = threading.Event()
+sync_debouncer = SyncDebouncer(SYNC_QUIET_SECONDS, get_sync_type, sync_files, stop_event)
 
 
 class MyHandlerWithSync(FileSystemEventHandler):
     def on_modified(self, event):
-        logger.info(f"{datetime.datetime.now()} files modified ，start to sync {event}")
-        sync_files(event.src_path, event.is_directory, True)
+        logger.debug(f"{datetime.datetime.now()} files modified {event}")
+        sync_debouncer.add(event.src_path)
 
     def on_created(self, event):
-        logger.info(f"{datetime.datetime.now()} files added ，start to sync {event}")
-        sync_files(event.src_path, event.is_directory, True)
+        logger.debug(f"{datetime.datetime.now()} files added {event}")
+        sync_debouncer.add(event.src_path)
 
     def on_deleted(self, event):
-        logger.info(f"{datetime.datetime.now()} files deleted ，start to sync {event}")
-        sync_files(event.src_path, event.is_directory, True)
+        logger.debug(f"{datetime.datetime.now()} files deleted {event}")
+        sync_debouncer.add(event.src_path)
 
-
-stop_event = threading.Event()
+    def on_moved(self, event):
+        logger.debug(f"{datetime.datetime.now()} files moved {event}")
+        sync_debouncer.add(event.src_path)
+        sync_debouncer.add(event.dest_path)
 
 
 def check_and_sync():
     logger.info("check_and_sync start")
+    threading.Thread(target=sync_debouncer.run, daemon=True).start()
     event_handler = MyHandlerWithSync()
     observer = Observer()
     try:
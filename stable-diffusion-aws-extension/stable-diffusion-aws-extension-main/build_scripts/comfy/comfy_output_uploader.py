@@ -0,0 +1,96 @@
+import concurrent.futures
+import logging
+import os
+import shutil
+import threading
+import time
+
+import boto3
+import folder_paths
+
+logger = logging.getLogger(__name__)
+logger.setLevel(os.environ.get('LOG_LEVEL') or logging.INFO)
+
+
+class OutputUploader:
+    """
+    Uploads the files of the running prompt to S3 as soon as a node reports them in its
+    "executed" event, so only the uploads still in flight are left to wait for when the
+    prompt ends.
+    """
+
+    def __init__(self, bucket: str, region: str, workers: int):
+        self.bucket = bucket
+        self.s3_client = boto3.client('s3', region_name=region)
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+        self.lock = threading.Lock()
+        self.targets = {}
+        self.submitted = set()
+        self.futures = {}
+
+    def start(self, targets: dict):
+        # targets maps a local directory to the S3 path its files go to, e.g. output/{prompt_id}
+        with self.lock:
+            self.targets = {os.path.abspath(local_path): s3_path for local_path, s3_path in targets.items()}
+            self.submitted = set()
+            self.futures = {}
+
+    def add_executed(self, output: dict):
+        # nodes report files relative to the directory of their type, which is the
+        # --output-directory / --temp-directory the app was started with
+        for items in (output or {}).values():
+            if not isinstance(items, list):
+                continue
+            for item in items:
+                if not isinstance(item, dict) or not item.get('filename') or not item.get('type'):
+                    continue
+                directory = folder_paths.get_directory_by_type(item['type'])
+                if directory:
+                    self.add(os.path.join(directory, item.get('subfolder') or '', item['filename']))
+
+    def add(self, file_path: str):
+        file_path = os.path.abspath(file_path)
+        with self.lock:
+            if file_path in self.submitted:
+                return
+            for local_path, s3_path in self.targets.items():
+                if file_path.startswith(local_path + os.sep) and os.path.isfile(file_path):
+                    file = f"/{os.path.relpath(file_path, local_path)}"
+                    self.submitted.add(file_path)
+                    future = self.pool.submit(self.upload, file_path, f"comfy/{s3_path}{file}")
+                    self.futures[future] = (s3_path, file)
+                    return
+
+    def upload(self, file_path: str, key: str):
+        start = time.time()
+        self.s3_client.upload_file(file_path, self.bucket, key)
+        logger.info(f"uploaded {file_path} to s3://{self.bucket}/{key} in {time.time() - start:.2f}s")
+
+    def finish(self):
+        """
+        Picks up the files no node reported, waits for the uploads and cleans up the local
+        directories. Returns the files uploaded under each S3 path, relative to it the way
+        s3_scan_files lists them, so the job result doesn't need to list the bucket again.
+        """
+        for local_path in list(self.targets):
+            for root, dirs, files in os.walk(local_path):
+                for file in files:
+                    self.add(os.path.join(root, file))
+
+        with self.lock:
+            futures = self.futures
+            self.futures = {}
+        uploaded = {s3_path: [] for s3_path in self.targets.values()}
+        for future in concurrent.futures.as_completed(futures):
+            s3_path, file = futures[future]
+            try:
+                future.result()
+                uploaded[s3_path].append(file)
+            except Exception as e:
+                logger.error(f"Error uploading output file: {e}")
+
+        for local_path in self.targets:
+            shutil.rmtree(local_path, ignore_errors=True)
+            logger.info(f'Files removed from local {local_path}')
+        self.start({})
+        return {s3_path: sorted(files) for s3_path, files in uploaded.items()}
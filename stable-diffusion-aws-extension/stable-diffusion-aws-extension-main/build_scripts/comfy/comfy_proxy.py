@@ -18,7 +18,6 @@ from watchdog.events import FileSystemEventHandler
 import subprocess
 from dotenv import load_dotenv
 
-import fcntl
 import hashlib
 
 import base64
@@ -35,6 +34,7 @@ from dataclasses import dataclass
 from typing import Optional
 
 from boto3.dynamodb.conditions import Key
+from comfy_sync_utils import BlobStore, SyncDebouncer, extract_s3_archive
 
 DISABLE_AWS_PROXY = 'DISABLE_AWS_PROXY'
 sync_msg_list = []
@@ -86,6 +86,10 @@ if is_on_ec2:
     is_master_process = os.getenv('MASTER_PROCESS') == 'true'
     program_name = os.getenv('PROGRAM_NAME')
     no_need_sync_files = ['.autosave', '.cache', '.autosave1', '~', '.swp']
+    BLOB_UPLOAD_WORKERS = int(os.environ.get('BLOB_UPLOAD_WORKERS', 8))
+    SYNC_QUIET_SECONDS = float(os.environ.get('SYNC_QUIET_SECONDS', 3))
+    s3_client = boto3.client('s3')
+    blob_store = BlobStore(s3_client, bucket_name, BLOB_UPLOAD_WORKERS, ignore_files=no_need_sync_files)
 
     need_resend_msg_result = []
     PREPARE_ID = 'default'
@@ -189,6 +193,14 @@ if is_on_ec2:
         server_use.send_sync(event, data, sid)
 
 
+    def parse_sync_messages(data, last_seq):
+        # get_sync_msg lambdas older than the since parameter ignore it and return every message as a list
+        if isinstance(data, list):
+            return data, last_seq
+        data = data or {}
+        return data.get("messages") or [], data.get("last_seq", last_seq)
+
+
     def handle_sync_messages(server_use, msg_array):
         already_synced = False
         global sync_msg_list
@@ -302,8 +314,9 @@ if is_on_ec2:
 
                 save_already = False
                 if comfy_need_sync:
+                    sync_msg_seq = 0
                     msg_future = executorThread.submit(send_get_request,
-                                                       f"{api_url}/sync/{prompt_id}")
+                                                       f"{api_url}/sync/{prompt_id}?since={sync_msg_seq}")
                     done, _ = concurrent.futures.wait([execute_future, msg_future],
                                                       return_when=concurrent.futures.ALL_COMPLETED)
                     already_synced = False
@@ -314,12 +327,13 @@ if is_on_ec2:
                             msg_response = future.result()
                             logger.info(f"get syc msg: {msg_response.json()}")
                             if msg_response.status_code == 200:
-                                if 'data' not in msg_response.json() or not msg_response.json().get("data"):
+                                sync_messages, sync_msg_seq = parse_sync_messages(msg_response.json().get("data"), sync_msg_seq)
+                                if not sync_messages:
                                     logger.error("there is no response from sync msg by thread ")
                                     time.sleep(1)
                                 else:
                                     logger.debug(msg_response.json())
-                                    already_synced = handle_sync_messages(server_use, msg_response.json().get("data"))
+                                    already_synced = handle_sync_messages(server_use, sync_messages)
                         elif future == execute_future:
                             execute_resp = future.result()
                             logger.info(f"get execute status: {execute_resp.status_code}")
@@ -391,19 +405,20 @@ if is_on_ec2:
 
                     m = msg_max_wait_time
                     while not already_synced:
-                        msg_response = send_get_request(f"{api_url}/sync/{prompt_id}")
+                        msg_response = send_get_request(f"{api_url}/sync/{prompt_id}?since={sync_msg_seq}")
                         # logger.info(msg_response.json())
                         if msg_response.status_code == 200:
+                            sync_messages, sync_msg_seq = parse_sync_messages(msg_response.json().get("data"), sync_msg_seq)
                             if m <= 0:
                                 logger.error("there is no response from sync msg by timeout")
                                 already_synced = True
-                            elif 'data' not in msg_response.json() or not msg_response.json().get("data"):
+                            elif not sync_messages:
                                 logger.error("there is no response from sync msg")
                                 time.sleep(1)
                                 m = m - 1
                             else:
                                 logger.debug(msg_response.json())
-                                already_synced = handle_sync_messages(server_use, msg_response.json().get("data"))
+                                already_synced = handle_sync_messages(server_use, sync_messages)
                                 logger.info(f"already_synced is :{already_synced}")
                                 time.sleep(1)
                                 m = m - 1
@@ -538,15 +553,11 @@ if is_on_ec2:
             if prepare_type in ['default', 'inputs']:
                 logger.info(f" sync input files")
                 # s5cmd_syn_input_command = f's5cmd --log=error sync --delete=true {DIR3}/ "s3://{bucket_name}/comfy/{comfy_endpoint}/{prepare_version}/input/"'
-                s5cmd_syn_input_command = f'aws s3 sync --delete {DIR3}/ "s3://{bucket_name}/comfy/{comfy_endpoint}/{prepare_version}/input/"'
-                logger.info(f"sync input files start {s5cmd_syn_input_command}")
-                os.system(s5cmd_syn_input_command)
+                blob_store.sync_folder_blobs(comfy_endpoint, DIR3, prepare_version, 'input')
             if prepare_type in ['default', 'models']:
                 logger.info(f" sync models files")
                 # s5cmd_syn_model_command = f's5cmd --log=error sync --delete=true {DIR1}/ "s3://{bucket_name}/comfy/{comfy_endpoint}/{prepare_version}/models/"'
-                s5cmd_syn_model_command = f'aws s3 sync --delete {DIR1}/ "s3://{bucket_name}/comfy/{comfy_endpoint}/{prepare_version}/models/"'
-                logger.info(f"sync models files start {s5cmd_syn_model_command}")
-                os.system(s5cmd_syn_model_command)
+                blob_store.sync_folder_blobs(comfy_endpoint, DIR1, prepare_version, 'models')
             logger.info(f"Files changed in:: {need_prepare} {prepare_type} {DIR2} {DIR1} {DIR3}")
 
             url = api_url + "prepare"
@@ -565,192 +576,87 @@ if is_on_ec2:
             return None
 
 
-    def sync_files(filepath, is_folder, is_auto):
+    def get_sync_type(filepath):
+        directory = os.path.dirname(filepath)
+        if not directory:
+            return None
+        for ignore_item in no_need_sync_files:
+            if filepath.endswith(ignore_item):
+                return None
+        if (str(directory).endswith(f"{DIR2}" if DIR2.startswith("/") else f"/{DIR2}")
+                or str(filepath) == DIR2 or str(filepath) == f'./{DIR2}' or f"{DIR2}/" in filepath):
+            return 'nodes'
+        if (str(directory).endswith(f"{DIR3}" if DIR3.startswith("/") else f"/{DIR3}")
+                or str(filepath) == DIR3 or str(filepath) == f'./{DIR3}' or f"{DIR3}/" in filepath):
+            return 'inputs'
+        if (str(directory).endswith(f"{DIR1}" if DIR1.startswith("/") else f"/{DIR1}")
+                or str(filepath) == DIR1 or str(filepath) == f'./{DIR1}' or f"{DIR1}/" in filepath):
+            return 'models'
+        return None
+
+
+    def sync_files(prepare_type, filepaths):
         comfy_endpoint = os.getenv("COMFY_ENDPOINT")
         try:
-            directory = os.path.dirname(filepath)
-            logger.info(f"Directory changed in: {directory} {filepath}")
-            if not directory:
-                logger.info("root path no need to sync files by duplicate opt")
-                return None
             timestamp = str(int(time.time() * 1000))
-            logger.info(f"Files changed in: {filepath} time is:{timestamp}")
-            need_prepare = False
-            prepare_type = 'inputs'
+            logger.info(f"Files changed in {prepare_type}: {filepaths} time is:{timestamp}")
             need_reboot = False
-            for ignore_item in no_need_sync_files:
-                if filepath.endswith(ignore_item):
-                    logger.info(f"no need to sync files by ignore files {filepath} ends by {ignore_item}")
-                    return None
             prepare_version = PREPARE_ID if PREPARE_MODE == 'additional' else timestamp
-            if (str(directory).endswith(f"{DIR2}" if DIR2.startswith("/") else f"/{DIR2}")
-                    or str(filepath) == DIR2 or str(filepath) == f'./{DIR2}' or f"{DIR2}/" in filepath):
-                logger.info(f" sync custom nodes files: {filepath}")
+            if prepare_type == 'nodes':
                 s5cmd_syn_node_command = f's5cmd --log=error sync --delete=true --exclude="*comfy_local_proxy.py" {DIR2}/ "s3://{bucket_name}/comfy/{comfy_endpoint}/{prepare_version}/custom_nodes/"'
-                # s5cmd_syn_node_command = f'aws s3 sync {DIR2}/ "s3://{bucket_name}/comfy/{comfy_endpoint}/{timestamp}/custom_nodes/"'
-                # s5cmd_syn_node_command = f's5cmd sync {DIR2}/* "s3://{bucket_name}/comfy/{comfy_endpoint}/{timestamp}/custom_nodes/"'
-
-                # custom_node文件夹有变化 稍后再同步
-                if is_auto and not is_folder_unlocked(directory):
-                    logger.info("sync custom_nodes files is changing ,waiting.... ")
-                    return None
                 logger.info("sync custom_nodes files start")
                 logger.info(s5cmd_syn_node_command)
                 os.system(s5cmd_syn_node_command)
-                need_prepare = True
                 need_reboot = True
-                prepare_type = 'nodes'
-            elif (str(directory).endswith(f"{DIR3}" if DIR3.startswith("/") else f"/{DIR3}")
-                  or str(filepath) == DIR3 or str(filepath) == f'./{DIR3}' or f"{DIR3}/" in filepath):
-                logger.info(f" sync input files: {filepath}")
-                s5cmd_syn_input_command = f'aws s3 sync --delete {DIR3}/ "s3://{bucket_name}/comfy/{comfy_endpoint}/{prepare_version}/input/"'
-                # s5cmd_syn_input_command = f'/usr/local/bin/s5cmd sync {DIR3}/ "s3://{bucket_name}/comfy/{comfy_endpoint}/{prepare_version}/input/"'
-
-                # 判断文件写完后再同步
-                if is_auto:
-                    if bool(is_folder):
-                        can_sync = is_folder_unlocked(filepath)
-                    else:
-                        can_sync = is_file_unlocked(filepath)
-                    if not can_sync:
-                        logger.info("sync input files is changing ,waiting.... ")
-                        return None
+            elif prepare_type == 'inputs':
                 logger.info("sync input files start")
-                logger.info(s5cmd_syn_input_command)
-                os.system(s5cmd_syn_input_command)
-                # result = subprocess.run(s5cmd_syn_input_command, shell=True, check=True, stdout=subprocess.PIPE)
-                # logger.info(result.stdout.decode())
-                need_prepare = True
-                prepare_type = 'inputs'
-            elif (str(directory).endswith(f"{DIR1}" if DIR1.startswith("/") else f"/{DIR1}")
-                  or str(filepath) == DIR1 or str(filepath) == f'./{DIR1}' or f"{DIR1}/" in filepath):
-                logger.info(f" sync models files: {filepath}")
-                s5cmd_syn_model_command = f'aws s3 sync --delete {DIR1}/ "s3://{bucket_name}/comfy/{comfy_endpoint}/{prepare_version}/models/"'
-                # s5cmd_syn_model_command = f'/usr/local/bin/s5cmd sync {DIR1}/ "s3://{bucket_name}/comfy/{comfy_endpoint}/{prepare_version}/models/"'
-
-                # 判断文件写完后再同步
-                if is_auto:
-                    if bool(is_folder):
-                        can_sync = is_folder_unlocked(filepath)
-                    else:
-                        can_sync = is_file_unlocked(filepath)
-                    # logger.info(f'is folder {directory} {is_folder} can_sync {can_sync}')
-                    if not can_sync:
-                        logger.info("sync input models is changing ,waiting.... ")
-                        return None
-
+                blob_store.sync_folder_blobs(comfy_endpoint, DIR3, prepare_version, 'input')
+            else:
                 logger.info("sync models files start")
-                logger.info(s5cmd_syn_model_command)
-                os.system(s5cmd_syn_model_command)
-                # result = subprocess.run(s5cmd_syn_model_command, shell=True, check=True, stdout=subprocess.PIPE)
-                # logger.info(result.stdout.decode())
-                need_prepare = True
-                prepare_type = 'models'
-            timestamp_sync = str(int(time.time() * 1000))
-            logger.info(f"Files changed in:: {need_prepare} {str(directory)} {DIR2} {DIR1} {DIR3}, time is:{timestamp_sync}")
-            if need_prepare:
-                url = api_url + "prepare"
-                logger.info(f"URL:{url}")
-                data = {"endpoint_name": comfy_endpoint, "need_reboot": need_reboot, "prepare_id": prepare_version,
-                        "prepare_type": prepare_type}
-                logger.info(f"prepare params Data: {json.dumps(data, indent=4)}")
-                result = subprocess.run(["curl", "--location", "--request", "POST", url, "--header",
-                                         f"x-api-key: {api_token}", "--data-raw", json.dumps(data)],
-                                        capture_output=True, text=True)
-                logger.info(result.stdout)
-                timestamp_prepare = str(int(time.time() * 1000))
-                logger.info(f"finish prepare in : {timestamp_prepare}")
-                return result.stdout
-            return None
+                blob_store.sync_folder_blobs(comfy_endpoint, DIR1, prepare_version, 'models')
+
+            url = api_url + "prepare"
+            logger.info(f"URL:{url}")
+            data = {"endpoint_name": comfy_endpoint, "need_reboot": need_reboot, "prepare_id": prepare_version,
+                    "prepare_type": prepare_type}
+            logger.info(f"prepare params Data: {json.dumps(data, indent=4)}")
+            result = subprocess.run(["curl", "--location", "--request", "POST", url, "--header",
+                                     f"x-api-key: {api_token}", "--data-raw", json.dumps(data)],
+                                    capture_output=True, text=True)
+            logger.info(result.stdout)
+            logger.info(f"finish prepare in : {str(int(time.time() * 1000))}")
+            return result.stdout
         except Exception as e:
             logger.info(f"sync_files error {e}")
             return None
 
 
-    def is_folder_unlocked(directory):
-        # logger.info("check if folder ")
-        event_handler = MyHandlerWithCheck()
-        observer = Observer()
-        observer.schedule(event_handler, directory, recursive=True)
-        observer.start()
-        time.sleep(1)
-        result = False
-        try:
-            if event_handler.file_changed:
-                logger.info(f"folder {directory} is still changing..")
-                event_handler.file_changed = False
-                time.sleep(1)
-                if event_handler.file_changed:
-                    logger.info(f"folder {directory} is still still changing..")
-                else:
-                    logger.info(f"folder {directory} changing stopped")
-                    result = True
-            else:
-                logger.info(f"folder {directory} not stopped")
-                result = True
-        except (KeyboardInterrupt, Exception) as e:
-            logger.info(f"folder {directory} changed exception {e}")
-        observer.stop()
-        return result
-
-
-    def is_file_unlocked(file_path):
-        # logger.info("check if file ")
-        try:
-            initial_size = os.path.getsize(file_path)
-            initial_mtime = os.path.getmtime(file_path)
-            time.sleep(1)
-
-            current_size = os.path.getsize(file_path)
-            current_mtime = os.path.getmtime(file_path)
-            if current_size != initial_size or current_mtime != initial_mtime:
-                logger.info(f"unlock file error {file_path} is changing")
-                return False
-
-            with open(file_path, 'r') as f:
-                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
-                return True
-        except (IOError, OSError, Exception) as e:
-            logger.info(f"unlock file error {file_path} is writing")
-            logger.error(e)
-            return False
-
-
-    class MyHandlerWithCheck(FileSystemEventHandler):
-        def __init__(self):
-            self.file_changed = False
-
-        def on_modified(self, event):
-            logger.info(f"custom_node folder is changing {event.src_path}")
-            self.file_changed = True
-
-        def on_deleted(self, event):
-            logger.info(f"custom_node folder is changing {event.src_path}")
-            self.file_changed = True
-
-        def on_created(self, event):
-            logger.info(f"custom_node folder is changing {event.src_path}")
-            self.file_changed = True
+    stop_event = threading.Event()
+    sync_debouncer = SyncDebouncer(SYNC_QUIET_SECONDS, get_sync_type, sync_files, stop_event)
 
 
     class MyHandlerWithSync(FileSystemEventHandler):
         def on_modified(self, event):
-            logger.info(f"{datetime.datetime.now()} files modified ，start to sync {event}")
-            sync_files(event.src_path, event.is_directory, True)
+            logger.debug(f"{datetime.datetime.now()} files modified {event}")
+            sync_debouncer.add(event.src_path)
 
         def on_created(self, event):
-            logger.info(f"{datetime.datetime.now()} files added ，start to sync {event}")
-            sync_files(event.src_path, event.is_directory, True)
+            logger.debug(f"{datetime.datetime.now()} files added {event}")
+            sync_debouncer.add(event.src_path)
 
         def on_deleted(self, event):
-            logger.info(f"{datetime.datetime.now()} files deleted ，start to sync {event}")
-            sync_files(event.src_path, event.is_directory, True)
+            logger.debug(f"{datetime.datetime.now()} files deleted {event}")
+            sync_debouncer.add(event.src_path)
 
+        def on_moved(self, event):
+            logger.debug(f"{datetime.datetime.now()} files moved {event}")
+            sync_debouncer.add(event.src_path)
+            sync_debouncer.add(event.dest_path)
 
-    stop_event = threading.Event()
 
     def check_and_sync():
         logger.info("check_and_sync start")
+        threading.Thread(target=sync_debouncer.run, daemon=True).start()
         event_handler = MyHandlerWithSync()
         observer = Observer()
         try:
@@ -1613,6 +1519,8 @@ if is_on_ec2:
 
 if is_on_sagemaker:
 
+    from comfy_output_uploader import OutputUploader
+
     global need_sync
     global prompt_id
     global executing
@@ -1647,8 +1555,13 @@ if is_on_sagemaker:
 
     ROOT_PATH = '/home/ubuntu/ComfyUI'
     sqs_client = boto3.client('sqs', region_name=REGION)
+    s3_client = boto3.client('s3', region_name=REGION)
 
     GC_WAIT_TIME = 1800
+    OUTPUT_UPLOAD_WORKERS = int(os.environ.get('OUTPUT_UPLOAD_WORKERS', 8))
+    BLOB_DOWNLOAD_WORKERS = int(os.environ.get('BLOB_DOWNLOAD_WORKERS', 8))
+    blob_store = BlobStore(s3_client, BUCKET, BLOB_DOWNLOAD_WORKERS, store_path=f'{ROOT_PATH}/.blobs')
+    ARCHIVE_EXTRACT_WORKERS = int(os.environ.get('ARCHIVE_EXTRACT_WORKERS', os.cpu_count() or 4))
 
 
     def print_env():
@@ -1700,13 +1613,17 @@ if is_on_sagemaker:
             prepare_type = sync_item['prepare_type']
             rlt = True
             if prepare_type in ['default', 'models']:
-                sync_models_rlt = sync_s3_files_or_folders_to_local(f'{request_id}/models/*', f'{ROOT_PATH}/models',
-                                                                    False)
+                sync_models_rlt = blob_store.sync_s3_blobs_to_local(ENDPOINT_NAME, f'{request_id}/models.manifest.json', f'{ROOT_PATH}/models')
+                if sync_models_rlt is None:
+                    sync_models_rlt = sync_s3_files_or_folders_to_local(f'{request_id}/models/*',
+                                                                        f'{ROOT_PATH}/models', False)
                 if not sync_models_rlt:
                     rlt = False
             if prepare_type in ['default', 'inputs']:
-                sync_inputs_rlt = sync_s3_files_or_folders_to_local(f'{request_id}/input/*', f'{ROOT_PATH}/input',
-                                                                    False)
+                sync_inputs_rlt = blob_store.sync_s3_blobs_to_local(ENDPOINT_NAME, f'{request_id}/input.manifest.json', f'{ROOT_PATH}/input')
+                if sync_inputs_rlt is None:
+                    sync_inputs_rlt = sync_s3_files_or_folders_to_local(f'{request_id}/input/*',
+                                                                        f'{ROOT_PATH}/input', False)
                 if not sync_inputs_rlt:
                     rlt = False
             if prepare_type in ['nodes']:
@@ -1765,11 +1682,50 @@ if is_on_sagemaker:
             return False
 
 
+    def sync_s3_archives_to_local(s3_prefix, local_path):
+        """
+        Extracts the .tar.gz archives under the prefix, several at a time. An archive whose ETag is
+        the one extracted last time, and whose directory is still there, is skipped.
+        """
+        state_file = f'{local_path}.archives.json'
+        try:
+            with open(state_file) as f:
+                extracted = json.load(f)
+        except (OSError, ValueError):
+            extracted = {}
+
+        pending = {}
+        paginator = s3_client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=BUCKET, Prefix=f'comfy/{ENDPOINT_NAME}/{s3_prefix}'):
+            for item in page.get('Contents', []):
+                filename = os.path.basename(item['Key'])
+                if not filename.endswith('.tar.gz'):
+                    continue
+                if (extracted.get(filename) == item['ETag']
+                        and os.path.isdir(os.path.join(local_path, filename[:-len('.tar.gz')]))):
+                    logger.info(f'File {filename} is already extracted')
+                    continue
+                pending[filename] = item
+
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=ARCHIVE_EXTRACT_WORKERS) as executor:
+                futures = {executor.submit(extract_s3_archive, s3_client, BUCKET, item['Key'], local_path): filename
+                           for filename, item in pending.items()}
+                for future in concurrent.futures.as_completed(futures):
+                    future.result()
+                    filename = futures[future]
+                    extracted[filename] = pending[filename]['ETag']
+        finally:
+            with open(state_file, 'w') as f:
+                json.dump(extracted, f)
+
+
     def sync_s3_files_or_folders_to_local(s3_path, local_path, need_un_tar):
         logger.info("sync_s3_models_or_inputs_to_local start")
         # s5cmd_command = f'{ROOT_PATH}/tools/s5cmd sync "s3://{bucket_name}/{s3_path}/*" "{local_path}/"'
         if need_un_tar:
-            s5cmd_command = f's5cmd sync "s3://{BUCKET}/comfy/{ENDPOINT_NAME}/{s3_path}" "{local_path}/"'
+            # archives are extracted straight from S3 by sync_s3_archives_to_local
+            s5cmd_command = f's5cmd sync --exclude "*.tar.gz" "s3://{BUCKET}/comfy/{ENDPOINT_NAME}/{s3_path}" "{local_path}/"'
         else:
             s5cmd_command = f's5cmd sync --delete=true "s3://{BUCKET}/comfy/{ENDPOINT_NAME}/{s3_path}" "{local_path}/"'
         # s5cmd_command = f's5cmd sync --delete=true "s3://{BUCKET}/comfy/{ENDPOINT_NAME}/{s3_path}" "{local_path}/"'
@@ -1779,36 +1735,14 @@ if is_on_sagemaker:
             os.system(s5cmd_command)
             logger.info(f'Files copied from "s3://{BUCKET}/comfy/{ENDPOINT_NAME}/{s3_path}" to "{local_path}/"')
             if need_un_tar:
-                for filename in os.listdir(local_path):
-                    if filename.endswith(".tar.gz"):
-                        tar_filepath = os.path.join(local_path, filename)
-                        # extract_path = os.path.splitext(os.path.splitext(tar_filepath)[0])[0]
-                        # os.makedirs(extract_path, exist_ok=True)
-                        # logger.info(f'Extracting extract_path is {extract_path}')
-
-                        with tarfile.open(tar_filepath, "r:gz") as tar:
-                            for member in tar.getmembers():
-                                tar.extract(member, path=local_path)
-                        os.remove(tar_filepath)
-                        logger.info(f'File {tar_filepath} extracted and removed')
+                sync_s3_archives_to_local(s3_path.rstrip('*'), local_path)
             return True
         except Exception as e:
             logger.info(f"Error executing s5cmd command: {e}")
             return False
 
 
-    def sync_local_outputs_to_s3(s3_path, local_path):
-        logger.info("sync_local_outputs_to_s3 start")
-        s5cmd_command = f's5cmd sync "{local_path}/*" "s3://{BUCKET}/comfy/{s3_path}/" '
-        try:
-            logger.info(s5cmd_command)
-            os.system(s5cmd_command)
-            logger.info(f'Files copied local to "s3://{BUCKET}/comfy/{s3_path}/" to "{local_path}/"')
-            clean_cmd = f'rm -rf {local_path}'
-            os.system(clean_cmd)
-            logger.info(f'Files removed from local {local_path}')
-        except Exception as e:
-            logger.info(f"Error executing s5cmd command: {e}")
+    output_uploader = OutputUploader(BUCKET, REGION, OUTPUT_UPLOAD_WORKERS)
 
 
     def sync_local_outputs_to_base64(local_path):
@@ -1902,10 +1836,6 @@ if is_on_sagemaker:
 
             prompt_id = json_data['prompt_id']
             server_instance.last_prompt_id = prompt_id
-            e = execution.PromptExecutor(server_instance)
-            outputs_to_execute = valid[2]
-            e.execute(json_data['prompt'], prompt_id, extra_data, outputs_to_execute)
-
             s3_out_path = f'output/{prompt_id}/{out_path}' if out_path is not None else f'output/{prompt_id}'
             s3_temp_path = f'temp/{prompt_id}/{out_path}' if out_path is not None else f'temp/{prompt_id}'
             local_out_path = f'{ROOT_PATH}/output/{out_path}' if out_path is not None else f'{ROOT_PATH}/output'
@@ -1914,15 +1844,22 @@ if is_on_sagemaker:
             logger.info(
                 f"s3_out_path is {s3_out_path} and s3_temp_path is {s3_temp_path} and local_out_path is {local_out_path} and local_temp_path is {local_temp_path}")
 
-            sync_local_outputs_to_s3(s3_out_path, local_out_path)
-            sync_local_outputs_to_s3(s3_temp_path, local_temp_path)
+            output_uploader.start({local_out_path: s3_out_path, local_temp_path: s3_temp_path})
+
+            e = execution.PromptExecutor(server_instance)
+            outputs_to_execute = valid[2]
+            e.execute(json_data['prompt'], prompt_id, extra_data, outputs_to_execute)
+
+            uploaded_files = output_uploader.finish()
 
             response_body = {
                 "prompt_id": prompt_id,
                 "instance_id": GEN_INSTANCE_ID,
                 "status": "success",
                 "output_path": f's3://{BUCKET}/comfy/{s3_out_path}',
+                "output_files": uploaded_files.get(s3_out_path, []),
                 "temp_path": f's3://{BUCKET}/comfy/{s3_temp_path}',
+                "temp_files": uploaded_files.get(s3_temp_path, []),
             }
             sen_finish_sqs_msg(prompt_id)
             logger.info(f"execute inference response is {response_body}")
@@ -2179,6 +2116,8 @@ if is_on_sagemaker:
             global prompt_id
             logger.info(f"send_sync_proxy start... {need_sync},{prompt_id} {args}")
             func(*args, **kwargs)
+            if executing and len(args) > 2 and args[1] == 'executed' and isinstance(args[2], dict):
+                output_uploader.add_executed(args[2].get('output'))
             if need_sync and QUEUE_URL and REGION:
                 logger.debug(f"send_sync_proxy params... {QUEUE_URL},{REGION},{need_sync},{prompt_id}")
                 event = args[1]
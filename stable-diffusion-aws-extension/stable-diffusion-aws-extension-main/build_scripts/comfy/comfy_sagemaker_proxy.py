@@ -1,10 +1,10 @@
 import base64
+import concurrent.futures
 import datetime
 import json
 import logging
 import os
 import sys
-import tarfile
 import time
 import uuid
 import gc
@@ -18,6 +18,8 @@ import folder_paths
 from aiohttp import web
 from boto3.dynamodb.conditions import Key
 import comfy
+from comfy_output_uploader import OutputUploader
+from comfy_sync_utils import BlobStore, extract_s3_archive
 
 global need_sync
 global prompt_id
@@ -52,8 +54,13 @@ logger.setLevel(os.environ.get('LOG_LEVEL') or logging.INFO)
 
 ROOT_PATH = '/home/ubuntu/ComfyUI'
 sqs_client = boto3.client('sqs', region_name=REGION)
+s3_client = boto3.client('s3', region_name=REGION)
 
 GC_WAIT_TIME = 1800
+OUTPUT_UPLOAD_WORKERS = int(os.environ.get('OUTPUT_UPLOAD_WORKERS', 8))
+BLOB_DOWNLOAD_WORKERS = int(os.environ.get('BLOB_DOWNLOAD_WORKERS', 8))
+blob_store = BlobStore(s3_client, BUCKET, BLOB_DOWNLOAD_WORKERS, store_path=f'{ROOT_PATH}/.blobs')
+ARCHIVE_EXTRACT_WORKERS = int(os.environ.get('ARCHIVE_EXTRACT_WORKERS', os.cpu_count() or 4))
 
 
 def print_env():
@@ -104,11 +111,17 @@ async def prepare_comfy_env(sync_item: dict):
         prepare_type = sync_item['prepare_type']
         rlt = True
         if prepare_type in ['default', 'models']:
-            sync_models_rlt = sync_s3_files_or_folders_to_local(f'{request_id}/models/*', f'{ROOT_PATH}/models', False)
+            sync_models_rlt = blob_store.sync_s3_blobs_to_local(ENDPOINT_NAME, f'{request_id}/models.manifest.json', f'{ROOT_PATH}/models')
+            if sync_models_rlt is None:
+                sync_models_rlt = sync_s3_files_or_folders_to_local(f'{request_id}/models/*', f'{ROOT_PATH}/models',
+                                                                    False)
             if not sync_models_rlt:
                 rlt = False
         if prepare_type in ['default', 'inputs']:
-            sync_inputs_rlt = sync_s3_files_or_folders_to_local(f'{request_id}/input/*', f'{ROOT_PATH}/input', False)
+            sync_inputs_rlt = blob_store.sync_s3_blobs_to_local(ENDPOINT_NAME, f'{request_id}/input.manifest.json', f'{ROOT_PATH}/input')
+            if sync_inputs_rlt is None:
+                sync_inputs_rlt = sync_s3_files_or_folders_to_local(f'{request_id}/input/*', f'{ROOT_PATH}/input',
+                                                                    False)
             if not sync_inputs_rlt:
                 rlt = False
         if prepare_type in ['default', 'nodes']:
@@ -164,11 +177,50 @@ async def prepare_comfy_env(sync_item: dict):
         return False
 
 
+def sync_s3_archives_to_local(s3_prefix, local_path):
+    """
+    Extracts the .tar.gz archives under the prefix, several at a time. An archive whose ETag is
+    the one extracted last time, and whose directory is still there, is skipped.
+    """
+    state_file = f'{local_path}.archives.json'
+    try:
+        with open(state_file) as f:
+            extracted = json.load(f)
+    except (OSError, ValueError):
+        extracted = {}
+
+    pending = {}
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=BUCKET, Prefix=f'comfy/{ENDPOINT_NAME}/{s3_prefix}'):
+        for item in page.get('Contents', []):
+            filename = os.path.basename(item['Key'])
+            if not filename.endswith('.tar.gz'):
+                continue
+            if (extracted.get(filename) == item['ETag']
+                    and os.path.isdir(os.path.join(local_path, filename[:-len('.tar.gz')]))):
+                logger.info(f'File {filename} is already extracted')
+                continue
+            pending[filename] = item
+
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=ARCHIVE_EXTRACT_WORKERS) as executor:
+            futures = {executor.submit(extract_s3_archive, s3_client, BUCKET, item['Key'], local_path): filename
+                       for filename, item in pending.items()}
+            for future in concurrent.futures.as_completed(futures):
+                future.result()
+                filename = futures[future]
+                extracted[filename] = pending[filename]['ETag']
+    finally:
+        with open(state_file, 'w') as f:
+            json.dump(extracted, f)
+
+
 def sync_s3_files_or_folders_to_local(s3_path, local_path, need_un_tar):
     logger.info("sync_s3_models_or_inputs_to_local start")
     # s5cmd_command = f'{ROOT_PATH}/tools/s5cmd sync "s3://{bucket_name}/{s3_path}/*" "{local_path}/"'
     if need_un_tar:
-        s5cmd_command = f's5cmd sync "s3://{BUCKET}/comfy/{ENDPOINT_NAME}/{s3_path}" "{local_path}/"'
+        # archives are extracted straight from S3 by sync_s3_archives_to_local
+        s5cmd_command = f's5cmd sync --exclude "*.tar.gz" "s3://{BUCKET}/comfy/{ENDPOINT_NAME}/{s3_path}" "{local_path}/"'
     else:
         s5cmd_command = f's5cmd sync --delete=true "s3://{BUCKET}/comfy/{ENDPOINT_NAME}/{s3_path}" "{local_path}/"'
     # s5cmd_command = f's5cmd sync --delete=true "s3://{BUCKET}/comfy/{ENDPOINT_NAME}/{s3_path}" "{local_path}/"'
@@ -178,36 +230,14 @@ def sync_s3_files_or_folders_to_local(s3_path, local_path, need_un_tar):
         os.system(s5cmd_command)
         logger.info(f'Files copied from "s3://{BUCKET}/comfy/{ENDPOINT_NAME}/{s3_path}" to "{local_path}/"')
         if need_un_tar:
-            for filename in os.listdir(local_path):
-                if filename.endswith(".tar.gz"):
-                    tar_filepath = os.path.join(local_path, filename)
-                    # extract_path = os.path.splitext(os.path.splitext(tar_filepath)[0])[0]
-                    # os.makedirs(extract_path, exist_ok=True)
-                    # logger.info(f'Extracting extract_path is {extract_path}')
-
-                    with tarfile.open(tar_filepath, "r:gz") as tar:
-                        for member in tar.getmembers():
-                            tar.extract(member, path=local_path)
-                    os.remove(tar_filepath)
-                    logger.info(f'File {tar_filepath} extracted and removed')
+            sync_s3_archives_to_local(s3_path.rstrip('*'), local_path)
         return True
     except Exception as e:
         logger.info(f"Error executing s5cmd command: {e}")
         return False
 
 
-def sync_local_outputs_to_s3(s3_path, local_path):
-    logger.info("sync_local_outputs_to_s3 start")
-    s5cmd_command = f's5cmd sync "{local_path}/*" "s3://{BUCKET}/comfy/{s3_path}/" '
-    try:
-        logger.info(s5cmd_command)
-        os.system(s5cmd_command)
-        logger.info(f'Files copied local to "s3://{BUCKET}/comfy/{s3_path}/" to "{local_path}/"')
-        clean_cmd = f'rm -rf {local_path}'
-        os.system(clean_cmd)
-        logger.info(f'Files removed from local {local_path}')
-    except Exception as e:
-        logger.info(f"Error executing s5cmd command: {e}")
+output_uploader = OutputUploader(BUCKET, REGION, OUTPUT_UPLOAD_WORKERS)
 
 
 def sync_local_outputs_to_base64(local_path):
@@ -300,10 +330,6 @@ async def execute_proxy(request):
 
         prompt_id = json_data['prompt_id']
         server_instance.last_prompt_id = prompt_id
-        e = execution.PromptExecutor(server_instance)
-        outputs_to_execute = valid[2]
-        e.execute(json_data['prompt'], prompt_id, extra_data, outputs_to_execute)
-
         s3_out_path = f'output/{prompt_id}/{out_path}' if out_path is not None else f'output/{prompt_id}'
         s3_temp_path = f'temp/{prompt_id}/{out_path}' if out_path is not None else f'temp/{prompt_id}'
         local_out_path = f'{ROOT_PATH}/output/{out_path}' if out_path is not None else f'{ROOT_PATH}/output'
@@ -311,15 +337,22 @@ async def execute_proxy(request):
 
         logger.info(f"s3_out_path is {s3_out_path} and s3_temp_path is {s3_temp_path} and local_out_path is {local_out_path} and local_temp_path is {local_temp_path}")
 
-        sync_local_outputs_to_s3(s3_out_path, local_out_path)
-        sync_local_outputs_to_s3(s3_temp_path, local_temp_path)
+        output_uploader.start({local_out_path: s3_out_path, local_temp_path: s3_temp_path})
+
+        e = execution.PromptExecutor(server_instance)
+        outputs_to_execute = valid[2]
+        e.execute(json_data['prompt'], prompt_id, extra_data, outputs_to_execute)
+
+        uploaded_files = output_uploader.finish()
 
         response_body = {
             "prompt_id": prompt_id,
             "instance_id": GEN_INSTANCE_ID,
             "status": "success",
             "output_path": f's3://{BUCKET}/comfy/{s3_out_path}',
+            "output_files": uploaded_files.get(s3_out_path, []),
             "temp_path": f's3://{BUCKET}/comfy/{s3_temp_path}',
+            "temp_files": uploaded_files.get(s3_temp_path, []),
         }
         sen_finish_sqs_msg(prompt_id)
         logger.info(f"execute inference response is {response_body}")
@@ -577,6 +610,8 @@ def send_sync_proxy(func):
         global prompt_id
         logger.info(f"send_sync_proxy start... {need_sync},{prompt_id} {args}")
         func(*args, **kwargs)
+        if executing and len(args) > 2 and args[1] == 'executed' and isinstance(args[2], dict):
+            output_uploader.add_executed(args[2].get('output'))
         if need_sync and QUEUE_URL and REGION:
             logger.debug(f"send_sync_proxy params... {QUEUE_URL},{REGION},{need_sync},{prompt_id}")
             event = args[1]
@@ -0,0 +1,226 @@
+import concurrent.futures
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tarfile
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+logger.setLevel(os.environ.get('LOG_LEVEL') or logging.INFO)
+
+
+def file_sha256(file_path):
+    sha256 = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(8 * 1024 * 1024), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def load_blob_sync_cache(cache_file):
+    try:
+        with open(cache_file) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def extract_s3_archive(s3_client, bucket, key, local_path):
+    start = time.time()
+    body = s3_client.get_object(Bucket=bucket, Key=key)['Body']
+    # stream mode reads the archive once, straight from the response, without a local copy
+    with tarfile.open(fileobj=body, mode='r|gz') as tar:
+        # the data filter refuses members outside local_path, links out of it and device files
+        if hasattr(tarfile, 'data_filter'):
+            tar.extractall(path=local_path, filter='data')
+        else:
+            tar.extractall(path=local_path)
+    logger.info(f'File s3://{bucket}/{key} extracted to {local_path} in {time.time() - start:.2f}s')
+
+
+def build_blob_manifest(folder_path, cached_files, ignore_files=()):
+    # files whose size and mtime did not change keep the hash from the last sync instead of being read again
+    files = {}
+    for root, dirs, names in os.walk(folder_path):
+        for name in names:
+            if any(name.endswith(ignore_item) for ignore_item in ignore_files):
+                continue
+            file_path = os.path.join(root, name)
+            relative_path = os.path.relpath(file_path, folder_path)
+            stat = os.stat(file_path)
+            cached = cached_files.get(relative_path)
+            if cached and cached['size'] == stat.st_size and cached['mtime'] == stat.st_mtime:
+                sha256 = cached['sha256']
+            else:
+                sha256 = file_sha256(file_path)
+            files[relative_path] = {'sha256': sha256, 'size': stat.st_size, 'mtime': stat.st_mtime}
+    return files
+
+
+class BlobStore:
+    """
+    Folders synced through S3 as content addressed blobs under comfy/{endpoint}/blobs/{sha256},
+    plus a manifest per folder and version that maps every relative path to its blob. The
+    syncing side uploads with sync_folder_blobs, the endpoints download with sync_s3_blobs_to_local.
+    """
+
+    def __init__(self, s3_client, bucket: str, workers: int, store_path: str = None, ignore_files=()):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.workers = workers
+        # local directory of the downloaded blobs, the synced files are hard links into it
+        self.store_path = store_path
+        self.ignore_files = ignore_files
+
+    def sync_folder_blobs(self, comfy_endpoint, folder_path, prepare_version, name):
+        """
+        Uploads the folder as blobs, only for contents the bucket does not have yet, and writes
+        the {prepare_version}/{name}.manifest.json of it.
+        """
+        folder_path = folder_path.rstrip('/')
+        cache_file = f"{folder_path}.blob_sync.json"
+        files = build_blob_manifest(folder_path, load_blob_sync_cache(cache_file), self.ignore_files)
+
+        blobs = {}
+        for relative_path, file in files.items():
+            blobs.setdefault(file['sha256'], os.path.join(folder_path, relative_path))
+
+        def upload_blob(item):
+            sha256, file_path = item
+            key = f"comfy/{comfy_endpoint}/blobs/{sha256}"
+            try:
+                self.s3_client.head_object(Bucket=self.bucket, Key=key)
+            except self.s3_client.exceptions.ClientError:
+                self.s3_client.upload_file(file_path, self.bucket, key)
+                return os.path.getsize(file_path)
+            return None
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+            uploaded = [size for size in executor.map(upload_blob, blobs.items()) if size is not None]
+
+        manifest = {'files': {relative_path: {'sha256': file['sha256'], 'size': file['size']}
+                              for relative_path, file in files.items()}}
+        self.s3_client.put_object(Bucket=self.bucket,
+                                  Key=f"comfy/{comfy_endpoint}/{prepare_version}/{name}.manifest.json",
+                                  Body=json.dumps(manifest))
+
+        with open(cache_file, 'w') as f:
+            json.dump(files, f)
+        logger.info(f"sync {folder_path} done: {len(files)} files, {len(uploaded)} new blobs, {sum(uploaded)} bytes uploaded")
+
+    def blob_path(self, sha256):
+        return os.path.join(self.store_path, sha256)
+
+    def link_blob(self, sha256, target_path):
+        os.makedirs(os.path.dirname(target_path), exist_ok=True)
+        tmp_path = f"{target_path}.{uuid.uuid4().hex}.tmp"
+        try:
+            os.link(self.blob_path(sha256), tmp_path)
+        except OSError:
+            # the blob store is on another file system
+            shutil.copyfile(self.blob_path(sha256), tmp_path)
+        os.replace(tmp_path, target_path)
+
+    def sync_s3_blobs_to_local(self, comfy_endpoint, manifest_path, local_path):
+        """
+        Brings local_path to the version described by a manifest written by the syncing side:
+        only blobs missing from the local blob store are downloaded, every file is a hard link
+        into the store, and files the manifest does not list are removed.
+        Returns None when there is no manifest, so the caller falls back to syncing the prefix.
+        """
+        logger.info(f"sync_s3_blobs_to_local start {manifest_path}")
+        try:
+            response = self.s3_client.get_object(Bucket=self.bucket, Key=f'comfy/{comfy_endpoint}/{manifest_path}')
+        except self.s3_client.exceptions.NoSuchKey:
+            logger.info(f"no manifest {manifest_path}, sync the prefix instead")
+            return None
+
+        try:
+            files = json.loads(response['Body'].read())['files']
+            os.makedirs(self.store_path, exist_ok=True)
+            missing = {file['sha256'] for file in files.values() if not os.path.exists(self.blob_path(file['sha256']))}
+
+            def download_blob(sha256):
+                tmp_path = f"{self.blob_path(sha256)}.{uuid.uuid4().hex}.tmp"
+                self.s3_client.download_file(self.bucket, f'comfy/{comfy_endpoint}/blobs/{sha256}', tmp_path)
+                os.replace(tmp_path, self.blob_path(sha256))
+
+            with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+                list(executor.map(download_blob, missing))
+
+            for relative_path, file in files.items():
+                target_path = os.path.join(local_path, relative_path)
+                if os.path.exists(target_path) and os.path.samefile(target_path, self.blob_path(file['sha256'])):
+                    continue
+                self.link_blob(file['sha256'], target_path)
+
+            for root, dirs, names in os.walk(local_path):
+                for name in names:
+                    file_path = os.path.join(root, name)
+                    if os.path.relpath(file_path, local_path) not in files:
+                        os.remove(file_path)
+
+            # blobs no file links to any more
+            for name in os.listdir(self.store_path):
+                if os.stat(self.blob_path(name)).st_nlink == 1:
+                    os.remove(self.blob_path(name))
+
+            logger.info(f'{len(files)} files synced to "{local_path}/", {len(missing)} blobs downloaded')
+            return True
+        except Exception as e:
+            logger.info(f"Error syncing blobs of {manifest_path}: {e}")
+            return False
+
+
+class SyncDebouncer:
+    """
+    Collects watchdog events per synced directory. Once a directory has had no events for
+    quiet_seconds, it is synced once and a single prepare is sent, on this worker thread
+    rather than the watchdog one.
+    get_sync_type maps a path to its directory type, or None for paths that are not synced,
+    sync_files(prepare_type, filepaths) syncs one directory, and run returns once stop_event is set.
+    """
+
+    def __init__(self, quiet_seconds, get_sync_type, sync_files, stop_event):
+        self.quiet_seconds = quiet_seconds
+        self.get_sync_type = get_sync_type
+        self.sync_files = sync_files
+        self.stop_event = stop_event
+        self.condition = threading.Condition()
+        self.changes = {}
+        self.last_event_time = {}
+
+    def add(self, filepath):
+        prepare_type = self.get_sync_type(filepath)
+        if not prepare_type:
+            return
+        with self.condition:
+            self.changes.setdefault(prepare_type, set()).add(filepath)
+            self.last_event_time[prepare_type] = time.time()
+            self.condition.notify()
+
+    def take_quiet(self):
+        now = time.time()
+        quiet = [prepare_type for prepare_type, last_time in self.last_event_time.items()
+                 if now - last_time >= self.quiet_seconds]
+        for prepare_type in quiet:
+            del self.last_event_time[prepare_type]
+        return {prepare_type: sorted(self.changes.pop(prepare_type)) for prepare_type in quiet}
+
+    def run(self):
+        while not self.stop_event.is_set():
+            with self.condition:
+                ready = self.take_quiet()
+                if not ready:
+                    # wake up when the oldest pending directory goes quiet, or now and then to see stop_event
+                    timeout = 1
+                    if self.last_event_time:
+                        timeout = min(timeout, min(self.last_event_time.values()) + self.quiet_seconds - time.time())
+                    self.condition.wait(max(timeout, 0.01))
+                    continue
+            for prepare_type, filepaths in ready.items():
+                self.sync_files(prepare_type, filepaths)
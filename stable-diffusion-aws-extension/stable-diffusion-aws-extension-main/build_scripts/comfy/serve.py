@@ -1,8 +1,11 @@
 import asyncio
 import datetime
+import json
 import logging
+import mmap
 import os
 import socket
+import struct
 import subprocess
 import sys
 import threading
@@ -15,6 +18,7 @@ import httpx
 import requests
 import uvicorn
 from fastapi import APIRouter, FastAPI, Request, HTTPException
+from fastapi.responses import StreamingResponse
 
 TIMEOUT_KEEP_ALIVE = 30
 SAGEMAKER_PORT = 8080
@@ -24,8 +28,13 @@ is_on_ec2 = os.getenv('ON_EC2') == 'true'
 program_name = os.getenv('PROGRAM_NAME', 'none')
 SLEEP_TIME = 5
 TIME_OUT_TIME = 86400
-MAX_KEEPALIVE_CONNECTIONS = 100
-MAX_CONNECTIONS = 1500
+HEARTBEAT_STALE_TIME = 60
+GPU_SLOTS_FILE = os.getenv('GPU_SLOTS_FILE', '/dev/shm/esd-comfy-gpu-slots')
+MAX_KEEPALIVE_CONNECTIONS = int(os.getenv('MAX_KEEPALIVE_CONNECTIONS', '100'))
+MAX_CONNECTIONS = int(os.getenv('MAX_CONNECTIONS', '1500'))
+CONNECT_TIME_OUT_TIME = float(os.getenv('CONNECT_TIME_OUT_TIME', '10'))
+HEALTH_CHECK_INTERVAL = float(os.getenv('HEALTH_CHECK_INTERVAL', '2'))
+HEALTH_CHECK_TIMEOUT = float(os.getenv('HEALTH_CHECK_TIMEOUT', '1'))
 
 app = FastAPI()
 
@@ -37,6 +46,10 @@ sagemaker_safe_port_range = os.getenv('SAGEMAKER_SAFE_PORT_RANGE', "8088-9088")
 start_port = int(sagemaker_safe_port_range.split('-')[0])
 available_apps = []
 is_multi_gpu = False
+app_condition = None
+heartbeat_task = None
+health_check_task = None
+gpu_slots = None
 cloudwatch = boto3.client('cloudwatch')
 
 endpoint_name = os.getenv('ENDPOINT_NAME')
@@ -57,41 +70,130 @@ class Api:
         self.queue_lock = queue_lock
         self.add_api_route("/invocations", invocations, methods=["POST"])
         self.add_api_route("/ping", ping, methods=["GET"], response_model={})
+        self.app.add_event_handler("startup", start_heartbeat)
+        self.app.add_event_handler("startup", start_health_check)
+        self.app.add_event_handler("shutdown", close_clients)
 
     def launch(self, server_name, port):
         self.app.include_router(self.router)
         uvicorn.run(self.app, host=server_name, port=port, timeout_keep_alive=TIMEOUT_KEEP_ALIVE)
 
 
+class GpuSlotTable:
+    """
+    One fixed-size slot per GPU in a shared mmap, holding the busy state, prompt id,
+    start time and heartbeat of the request running on that device.
+
+    The table is created by the parent process before the api process is forked and is
+    only written from the api process event loop. Each slot carries a sequence number that
+    is odd while a write is in progress, so readers in any process (check_sync, output
+    threads, metrics.py) never take a lock: they retry until they see a stable even value.
+    A writer that died mid-write leaves the sequence odd, so readers give up after
+    READ_RETRIES attempts and report the slot as busy with a stale heartbeat.
+    """
+    SLOT = struct.Struct("<IIdd64s")
+    IDLE = 0
+    BUSY = 1
+    READ_RETRIES = 1000
+
+    def __init__(self, path: str, slots: int, create: bool = False):
+        self.path = path
+        self.slots = slots
+        size = self.SLOT.size * slots
+        fd = os.open(path, (os.O_RDWR | os.O_CREAT) if create else os.O_RDWR)
+        try:
+            if create:
+                os.ftruncate(fd, 0)
+                os.ftruncate(fd, size)
+            self.buf = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+
+    def _write(self, device_id: int, state: int, prompt_id: str, start_time: float):
+        offset = device_id * self.SLOT.size
+        seq = struct.unpack_from("<I", self.buf, offset)[0] | 1
+        struct.pack_into("<I", self.buf, offset, seq)
+        self.SLOT.pack_into(self.buf, offset, seq, state, start_time, time.time(),
+                            prompt_id.encode()[:64])
+        struct.pack_into("<I", self.buf, offset, seq + 1)
+
+    def read(self, device_id: int):
+        offset = device_id * self.SLOT.size
+        for _ in range(self.READ_RETRIES):
+            seq, state, start_time, heartbeat, prompt_id = self.SLOT.unpack_from(self.buf, offset)
+            if seq % 2 == 0 and struct.unpack_from("<I", self.buf, offset)[0] == seq:
+                return {
+                    'busy': state == self.BUSY,
+                    'prompt_id': prompt_id.rstrip(b'\0').decode(),
+                    'start_time': start_time,
+                    'heartbeat': heartbeat,
+                }
+        logger.warning(f"gpu slot {device_id} is stuck in a write, reporting it as busy")
+        return {
+            'busy': True,
+            'prompt_id': '',
+            'start_time': 0.0,
+            'heartbeat': 0.0,
+        }
+
+    def read_all(self):
+        return [self.read(device_id) for device_id in range(self.slots)]
+
+    def set_busy(self, device_id: int, busy: bool):
+        if busy:
+            slot = self.read(device_id)
+            self._write(device_id, self.BUSY, slot['prompt_id'], slot['start_time'])
+        else:
+            self._write(device_id, self.IDLE, "", 0.0)
+
+    def set_prompt(self, device_id: int, prompt_id: str):
+        slot = self.read(device_id)
+        state = self.BUSY if slot['busy'] else self.IDLE
+        self._write(device_id, state, prompt_id, time.time() if prompt_id else 0.0)
+
+    def beat(self, device_id: int):
+        slot = self.read(device_id)
+        state = self.BUSY if slot['busy'] else self.IDLE
+        self._write(device_id, state, slot['prompt_id'], slot['start_time'])
+
+
 class ComfyApp:
     def __init__(self, host, port, device_id):
         self.host = host
         self.port = port
         self.device_id = device_id
         self.process = None
-        self.busy = False
         self.cwd = app_cwd
         self.name = f"{endpoint_instance_id}-gpus-{device_id}"
         self.stdout_thread = None
         self.stderr_thread = None
+        self.client = None
+        # kept up to date by health_check, so picking an app never blocks the event loop
+        self.ready = False
+
+    def get_client(self):
+        # created lazily so the client belongs to the event loop of the api process
+        if self.client is None or self.client.is_closed:
+            self.client = httpx.AsyncClient(base_url=f"http://{PHY_LOCALHOST}:{self.port}",
+                                            timeout=httpx.Timeout(TIME_OUT_TIME, connect=CONNECT_TIME_OUT_TIME),
+                                            limits=httpx.Limits(max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+                                                                max_connections=MAX_CONNECTIONS))
+        return self.client
+
+    async def close_client(self):
+        if self.client and not self.client.is_closed:
+            await self.client.aclose()
+        self.client = None
 
     def _handle_output(self, pipe, _):
         with pipe:
             for line in iter(pipe.readline, ''):
                 if line.strip():
-                    file = f"/tmp/gpu{self.device_id}"
-                    if os.path.exists(file):
-                        with open(file, "r") as file:
-                            cur_prompt_id = file.read().strip()
-                            if cur_prompt_id:
-                                logger.info(f"{self.name}-prompt-{cur_prompt_id}: {line.strip()}")
-                                # sys.stdout.write(f"{self.name}-prompt-{cur_prompt_id}: {line}")
-                            else:
-                                logger.info(f"{self.name}: {line.strip()}")
-                                # sys.stdout.write(f"{self.name}: {line}")
+                    cur_prompt_id = gpu_slots.read(self.device_id)['prompt_id'] if gpu_slots else ""
+                    if cur_prompt_id:
+                        logger.info(f"{self.name}-prompt-{cur_prompt_id}: {line.strip()}")
                     else:
                         logger.info(f"{self.name}: {line.strip()}")
-                        # sys.stdout.write(f"{self.name}: {line}")
 
     def start(self):
         cmd = ["python", "main.py",
@@ -150,6 +252,25 @@ class ComfyApp:
             result = sock.connect_ex(('127.0.0.1', self.port))
             return result == 0
 
+    async def check_ready(self):
+        try:
+            _, writer = await asyncio.wait_for(asyncio.open_connection(PHY_LOCALHOST, self.port),
+                                               timeout=HEALTH_CHECK_TIMEOUT)
+            writer.close()
+            await writer.wait_closed()
+            self.ready = True
+        except Exception:
+            self.ready = False
+        return self.ready
+
+    @property
+    def busy(self):
+        return gpu_slots.read(self.device_id)['busy']
+
+    @busy.setter
+    def busy(self, value: bool):
+        gpu_slots.set_busy(self.device_id, value)
+
     def set_prompt(self, request_obj=None):
         if request_obj and 'prompt_id' in request_obj:
             prompt_id = request_obj['prompt_id']
@@ -157,8 +278,7 @@ class ComfyApp:
             prompt_id = ""
 
         logger.debug(f"set_prompt '{prompt_id}' on device {self.device_id}")
-        with open(f"/tmp/gpu{self.device_id}", "w") as f:
-            f.write(str(prompt_id))
+        gpu_slots.set_prompt(self.device_id, str(prompt_id))
 
 
 def update_execute_job_table(prompt_id, key, value):
@@ -184,7 +304,6 @@ async def send_request(request_obj, comfy_app: ComfyApp, need_async: bool):
         record_metric(comfy_app, request_obj)
         logger.info(f"Starting on {comfy_app.port} {need_async} {request_obj}")
 
-        comfy_app.busy = True
         comfy_app.set_prompt(request_obj)
 
         request_obj['port'] = comfy_app.port
@@ -194,20 +313,7 @@ async def send_request(request_obj, comfy_app: ComfyApp, need_async: bool):
         update_execute_job_table(prompt_id=request_obj['prompt_id'], key="start_time", value=start_time)
 
         logger.info(f"Invocations start req: {request_obj}, url: {PHY_LOCALHOST}:{comfy_app.port}/execute_proxy")
-        # if need_async:
-        #     async with httpx.AsyncClient(timeout=TIME_OUT_TIME,
-        #                                  limits=httpx.Limits(max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
-        #                                                      max_connections=MAX_CONNECTIONS)) as client:
-        #         response = await client.post(f"http://{PHY_LOCALHOST}:{comfy_app.port}/execute_proxy", json=request_obj)
-        # else:
-        #     response = requests.post(f"http://{PHY_LOCALHOST}:{comfy_app.port}/execute_proxy", json=request_obj)
-        async with httpx.AsyncClient(timeout=TIME_OUT_TIME,
-                                     limits=httpx.Limits(max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
-                                                         max_connections=MAX_CONNECTIONS)) as client:
-            response = await client.post(f"http://{PHY_LOCALHOST}:{comfy_app.port}/execute_proxy", json=request_obj)
-
-        comfy_app.busy = False
-        comfy_app.set_prompt()
+        response = await comfy_app.get_client().post("/execute_proxy", json=request_obj)
 
         if response.status_code != 200:
             raise HTTPException(status_code=response.status_code,
@@ -217,52 +323,110 @@ async def send_request(request_obj, comfy_app: ComfyApp, need_async: bool):
         logger.error(f"send_request error {e}")
         raise HTTPException(status_code=500, detail=f"COMFY service not available for internal multi reqs {e}")
     finally:
-        comfy_app.busy = False
-        comfy_app.set_prompt()
+        await release_app(comfy_app)
+
+
+def get_app_condition():
+    global app_condition
+    if app_condition is None:
+        app_condition = asyncio.Condition()
+    return app_condition
+
+
+async def acquire_app(timeout=TIME_OUT_TIME):
+    condition = get_app_condition()
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    async with condition:
+        while True:
+            comfy_app = take_ready_app()
+            if comfy_app:
+                return comfy_app
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return None
+            try:
+                # woken by release_app or by health_check once an app is ready, re-checked periodically
+                await asyncio.wait_for(condition.wait(), min(remaining, SLEEP_TIME))
+            except asyncio.TimeoutError:
+                pass
+
+
+async def release_app(comfy_app: ComfyApp):
+    # clears the prompt id of the slot as well
+    comfy_app.busy = False
+    condition = get_app_condition()
+    async with condition:
+        condition.notify()
+
+
+async def dispatch_request(request_obj):
+    comfy_app = await acquire_app()
+    if comfy_app is None:
+        raise HTTPException(status_code=500, detail=f"COMFY service not available for reqs")
+    return await send_request(request_obj, comfy_app, is_multi_gpu)
+
+
+async def stream_results(req):
+    tasks = [asyncio.create_task(dispatch_request(request_obj)) for request_obj in req]
+    logger.info("all tasks completed send, waiting result")
+    try:
+        yield "["
+        first = True
+        for task in asyncio.as_completed(tasks):
+            try:
+                result = await task
+            except Exception as e:
+                logger.error(f"invocations error of {e}")
+                continue
+            logger.info(f"Finished invocation {result}")
+            yield ("" if first else ",") + json.dumps(result)
+            first = False
+        yield "]"
+    finally:
+        for task in tasks:
+            task.cancel()
 
 
 async def invocations(request: Request):
-    global is_multi_gpu
-    try:
-        if is_multi_gpu:
-            gpu_nums = get_gpu_count()
-            logger.info(f"Number of GPUs: {gpu_nums}")
-            req = await request.json()
-            logger.info(f"Starting multi invocation {req}")
-
-            tasks = []
-            for request_obj in req:
-                comfy_app = check_available_app(True)
-                max_retries = TIME_OUT_TIME
-                while comfy_app is None:
-                    if max_retries > 0:
-                        max_retries = max_retries - 60
-                        time.sleep(60)
-                        comfy_app = check_available_app(True)
-                    else:
-                        raise HTTPException(status_code=500, detail=f"COMFY service not available for multi reqs")
-                # if comfy_app is None:
-                #     raise HTTPException(status_code=500, detail=f"COMFY service not available for multi reqs")
-                tasks.append(send_request(request_obj, comfy_app, True))
-            logger.info("all tasks completed send, waiting result")
-            results = await asyncio.gather(*tasks)
-            logger.info(f'Finished invocations {results}')
-            return results
-        else:
-            req = await request.json()
-            result = []
-            logger.info(f"Starting single invocation request is: {req}")
-            for request_obj in req:
-                comfy_app = check_available_app(True)
-                if comfy_app is None:
-                    raise HTTPException(status_code=500, detail=f"COMFY service not available for single reqs")
-                response = await send_request(request_obj, comfy_app, False)
-                result.append(response)
-            logger.info(f"Finished invocations result: {result}")
-            return result
-    except Exception as e:
-        logger.error(f"invocations error of {e}")
-        return []
+    req = await request.json()
+    logger.info(f"Starting invocation is_multi_gpu: {is_multi_gpu}, request is: {req}")
+    return StreamingResponse(stream_results(req), media_type="application/json")
+
+
+async def heartbeat():
+    while True:
+        for item in available_apps:
+            gpu_slots.beat(item.device_id)
+        await asyncio.sleep(SLEEP_TIME)
+
+
+async def start_heartbeat():
+    global heartbeat_task
+    heartbeat_task = asyncio.create_task(heartbeat())
+
+
+async def health_check():
+    while True:
+        try:
+            states = await asyncio.gather(*[item.check_ready() for item in available_apps])
+            if any(states):
+                condition = get_app_condition()
+                async with condition:
+                    condition.notify_all()
+        except Exception as e:
+            logger.info(f"health_check error:{e}")
+        await asyncio.sleep(HEALTH_CHECK_INTERVAL)
+
+
+async def start_health_check():
+    global health_check_task
+    health_check_task = asyncio.create_task(health_check())
+
+
+async def close_clients():
+    for item in available_apps:
+        await item.close_client()
 
 
 def ping():
@@ -392,6 +556,11 @@ def get_gpu_count():
         return 0
 
 
+def create_gpu_slots(slots: int):
+    global gpu_slots
+    gpu_slots = GpuSlotTable(GPU_SLOTS_FILE, max(slots, 1), create=True)
+
+
 def start_comfy_servers():
     global is_multi_gpu
     gpu_nums = get_gpu_count()
@@ -400,6 +569,7 @@ def start_comfy_servers():
     else:
         is_multi_gpu = False
     logger.info(f"is_multi_gpu is {is_multi_gpu}")
+    create_gpu_slots(gpu_nums)
     for gpu_num in range(gpu_nums):
         port = start_port + gpu_num
         logger.info(f"start comfy server by device_id: {gpu_num}, port is {port}")
@@ -415,7 +585,7 @@ def get_available_app(need_check_busy: bool):
     for item in available_apps:
         logger.debug(f"get available apps {item.device_id} {item.busy}")
         if need_check_busy:
-            if item.is_port_ready() and not item.busy:
+            if not item.busy and item.is_port_ready():
                 item.busy = True
                 return item
         else:
@@ -424,6 +594,15 @@ def get_available_app(need_check_busy: bool):
     return None
 
 
+def take_ready_app():
+    # uses the readiness cached by health_check, it runs on the event loop under the app condition
+    for item in available_apps:
+        if item.ready and not item.busy:
+            item.busy = True
+            return item
+    return None
+
+
 def check_available_app(need_check_busy: bool):
     comfy_app = get_available_app(need_check_busy)
     i = 0
@@ -455,12 +634,16 @@ def check_sync():
 
             global available_apps
             for item in available_apps:
-                if item and item.port and not item.busy:
+                slot = gpu_slots.read(item.device_id)
+                if item and item.port and not slot['busy']:
                     logger.info(f"start check_reboot! {item.port}")
                     requests.post(f"http://{PHY_LOCALHOST}:{item.port}/reboot")
                     logger.debug(f"reboot response time : {datetime.datetime.now()}")
                 else:
-                    logger.info(f"not start check_reboot! {item}")
+                    logger.info(f"not start check_reboot! {item.name} is running prompt {slot['prompt_id']} "
+                                f"for {time.time() - slot['start_time']:.1f}s")
+                    if time.time() - slot['heartbeat'] > HEARTBEAT_STALE_TIME:
+                        logger.warning(f"{item.name} heartbeat is stale, api process may be stuck")
             time.sleep(SLEEP_TIME)
         except Exception as e:
             logger.info(f"check_and_reboot error:{e}")
@@ -469,6 +652,7 @@ def check_sync():
 
 if __name__ == "__main__":
     if is_on_ec2:
+        create_gpu_slots(1)
         comfy_app = ComfyApp(host='0.0.0.0', port=8188, device_id=0)
         comfy_app.start()
     else:
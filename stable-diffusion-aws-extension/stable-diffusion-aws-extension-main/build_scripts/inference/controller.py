@@ -1,4 +1,5 @@
 import asyncio
+import collections
 import datetime
 import json
 import logging
@@ -25,6 +26,13 @@ logger = logging.getLogger("Controller")
 logger.setLevel(logging.INFO)
 app = FastAPI()
 SLEEP_TIME = 30
+HEALTH_CHECK_INTERVAL = float(os.getenv('HEALTH_CHECK_INTERVAL', '2'))
+HEALTH_CHECK_TIMEOUT = 1
+WAIT_STATS_SIZE = 100
+WORKER_TIMEOUT = float(os.getenv('WORKER_TIMEOUT', '300'))
+WORKER_CONNECT_TIMEOUT = float(os.getenv('WORKER_CONNECT_TIMEOUT', '10'))
+WORKER_MAX_CONNECTIONS = int(os.getenv('WORKER_MAX_CONNECTIONS', '10'))
+WORKER_KEEPALIVE_TIMEOUT = float(os.getenv('WORKER_KEEPALIVE_TIMEOUT', '60'))
 service_type = os.getenv('SERVICE_TYPE', 'sd')
 endpoint_name = os.getenv('ENDPOINT_NAME')
 sagemaker_safe_port_range = os.getenv('SAGEMAKER_SAFE_PORT_RANGE')
@@ -40,6 +48,9 @@ class App:
         self.name = f"{service_type}-gpu{device_id}"
         self.process = None
         self.busy = False
+        self.ready = False
+        self.semaphore = asyncio.Semaphore(1)
+        self.session = None
         self.stdout_thread = None
         self.stderr_thread = None
         self.cmd = None
@@ -125,45 +136,165 @@ class App:
             result = sock.connect_ex(('127.0.0.1', self.port))
             return result == 0
 
+    async def check_ready(self):
+        try:
+            _, writer = await asyncio.wait_for(asyncio.open_connection(self.host, self.port),
+                                               timeout=HEALTH_CHECK_TIMEOUT)
+            writer.close()
+            await writer.wait_closed()
+            self.ready = True
+        except Exception:
+            self.ready = False
+        return self.ready
+
+    def get_session(self):
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(
+                base_url=f"http://127.0.0.1:{self.port}",
+                connector=aiohttp.TCPConnector(limit=WORKER_MAX_CONNECTIONS,
+                                               keepalive_timeout=WORKER_KEEPALIVE_TIMEOUT),
+                timeout=aiohttp.ClientTimeout(total=WORKER_TIMEOUT, connect=WORKER_CONNECT_TIMEOUT),
+            )
+        return self.session
+
+    async def close_session(self):
+        if self.session and not self.session.closed:
+            await self.session.close()
+        self.session = None
+
     async def invocations(self, payload, infer_id=None):
 
         try:
-            self.busy = True
             self.name = f"{service_type}-gpu{self.device_id}-{infer_id}"
 
             payload['port'] = self.port
             payload['out_path'] = self.device_id
 
-            url = f"http://127.0.0.1:{self.port}/invocations"
-            timeout = aiohttp.ClientTimeout(total=300)
-
-            async with aiohttp.ClientSession() as session:
-                async with session.post(url, json=payload, timeout=timeout) as response:
-                    if response.status != 200:
-                        result = json.dumps({
-                            "status_code": response.status,
-                            "detail": f"service returned an error: {await response.text()}"
-                        })
-                        self.busy = False
-                        return result
-                    response_data = await response.json()
-
-            self.busy = False
-            self.name = f"{service_type}-gpu{self.device_id}"
+            async with self.get_session().post("/invocations", json=payload) as response:
+                if response.status != 200:
+                    result = json.dumps({
+                        "status_code": response.status,
+                        "detail": f"service returned an error: {await response.text()}"
+                    })
+                    return result
+                response_data = await response.json()
 
             return response_data
         except Exception as e:
-            self.busy = False
             logger.error(f"invocations error:{e}")
             return json.dumps({
                 "status_code": 500,
                 "detail": f"service returned an error: {str(e)}"
             })
+        finally:
+            self.name = f"{service_type}-gpu{self.device_id}"
 
 
 apps: List[App] = []
 
 
+class Scheduler:
+    """
+    Hands incoming invocations to GPU apps in arrival order.
+
+    Requests wait in an asyncio queue; a single dispatcher pops them and
+    assigns each one to the first ready app whose semaphore is free. Readiness
+    is cached on the app and refreshed by a background health task, so the
+    request path never opens sockets to the workers.
+    """
+
+    def __init__(self):
+        self.pending = asyncio.Queue()
+        self.app_released = asyncio.Event()
+        self.waits = collections.deque(maxlen=WAIT_STATS_SIZE)
+        self.last_wait = 0.0
+        self.waiting = 0
+        self.tasks = []
+
+    def start(self):
+        self.tasks.append(asyncio.create_task(self.dispatch()))
+        self.tasks.append(asyncio.create_task(self.health_check()))
+
+    def queue_depth(self):
+        return self.waiting
+
+    def stats(self):
+        waits = list(self.waits)
+        return {
+            "queue_depth": self.queue_depth(),
+            "apps": len(apps),
+            "ready_apps": len([item for item in apps if item.ready]),
+            "busy_apps": len([item for item in apps if item.busy]),
+            "last_wait_seconds": round(self.last_wait, 3),
+            "avg_wait_seconds": round(sum(waits) / len(waits), 3) if waits else 0.0,
+            "max_wait_seconds": round(max(waits), 3) if waits else 0.0,
+        }
+
+    async def acquire(self, infer_id):
+        enqueued_at = time.perf_counter()
+        future = asyncio.get_running_loop().create_future()
+        self.waiting += 1
+        await self.pending.put((infer_id, future))
+        logger.info(f"controller_invocation {infer_id} queued, queue depth: {self.queue_depth()}")
+
+        try:
+            app = await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release(future.result())
+            raise
+        finally:
+            self.waiting -= 1
+
+        self.last_wait = time.perf_counter() - enqueued_at
+        self.waits.append(self.last_wait)
+        logger.info(f"controller_invocation {infer_id} assigned to {app.name} after {self.last_wait:.3f}s")
+        return app
+
+    def release(self, app: App):
+        app.busy = False
+        app.semaphore.release()
+        self.app_released.set()
+
+    async def _take_free_app(self):
+        for item in apps:
+            if item.ready and not item.semaphore.locked():
+                await item.semaphore.acquire()
+                item.busy = True
+                return item
+        return None
+
+    async def dispatch(self):
+        while True:
+            infer_id, future = await self.pending.get()
+            if future.done():
+                continue
+
+            app = await self._take_free_app()
+            while app is None:
+                self.app_released.clear()
+                await self.app_released.wait()
+                app = await self._take_free_app()
+
+            if future.done():
+                self.release(app)
+                continue
+            future.set_result(app)
+
+    async def health_check(self):
+        while not should_exit:
+            try:
+                states = await asyncio.gather(*[item.check_ready() for item in apps])
+                if any(states):
+                    self.app_released.set()
+            except Exception as e:
+                logger.info(f"health_check error:{e}")
+            await asyncio.sleep(HEALTH_CHECK_INTERVAL)
+
+
+scheduler: Scheduler = None
+
+
 def get_gpu_count():
     try:
         result = subprocess.run(['nvidia-smi', '-L'], capture_output=True, text=True, check=True)
@@ -204,7 +335,7 @@ def get_poll_app():
 def get_all_available_apps():
     list: List[App] = []
     for app in apps:
-        if app.is_port_ready() and not app.busy:
+        if app.ready and not app.busy:
             list.append(app)
 
     return list
@@ -254,12 +385,31 @@ def check_apps():
         if should_exit:
             return
         try:
-            logger.info(f"all_apps: {len(apps)} all_available_apps: {len(get_all_available_apps())}")
+            logger.info(f"all_apps: {len(apps)} all_available_apps: {len(get_all_available_apps())} "
+                        f"queue: {scheduler.stats() if scheduler else None}")
         except Exception as e:
             logger.info(f"check_and_reboot error:{e}")
             time.sleep(SLEEP_TIME)
 
 
+@app.on_event("startup")
+async def start_scheduler():
+    global scheduler
+    scheduler = Scheduler()
+    scheduler.start()
+
+
+@app.on_event("shutdown")
+async def close_sessions():
+    for cur_app in apps:
+        await cur_app.close_session()
+
+
+@app.get("/queue")
+async def queue():
+    return scheduler.stats()
+
+
 @app.get("/ping")
 async def ping():
     global should_exit
@@ -280,13 +430,11 @@ async def invocations(request: Request):
 
     logger.info(f"controller_invocation {infer_id} received")
 
-    while True:
-        app = get_available_app()
-        if app:
-            return await app.invocations(payload=payload, infer_id=infer_id)
-        else:
-            await asyncio.sleep(1)
-            logger.info(f'controller_invocation {infer_id} waiting for an available app...')
+    app = await scheduler.acquire(infer_id)
+    try:
+        return await app.invocations(payload=payload, infer_id=infer_id)
+    finally:
+        scheduler.release(app)
 
 
 def stop():
@@ -1,7 +1,9 @@
 import datetime
 import logging
+import mmap
 import os
 import shutil
+import struct
 import subprocess
 import threading
 import time
@@ -21,6 +23,13 @@ instance_init_seconds = os.getenv('INSTANCE_INIT_SECONDS')
 upload_endpoint_cache_seconds = os.getenv('UPLOAD_ENDPOINT_CACHE_SECONDS')
 download_file_size = os.getenv('DOWNLOAD_FILE_SIZE')
 
+gpu_slots_file = os.getenv('GPU_SLOTS_FILE', '/dev/shm/esd-comfy-gpu-slots')
+# layout must match GpuSlotTable in build_scripts/comfy/serve.py
+GPU_SLOT = struct.Struct("<IIdd64s")
+GPU_SLOT_BUSY = 1
+# a slot whose writer died mid-write stays odd, it is reported as busy after this many reads
+GPU_SLOT_READ_RETRIES = 1000
+
 endpoint_name = os.getenv('ENDPOINT_NAME', 'test')
 endpoint_instance_id = os.getenv('ENDPOINT_INSTANCE_ID', 'default')
 
@@ -82,8 +91,52 @@ def get_gpu_memory_utilization():
         return None
 
 
+def get_gpu_busy():
+    if not os.path.exists(gpu_slots_file) or os.path.getsize(gpu_slots_file) < GPU_SLOT.size:
+        return None
+    with open(gpu_slots_file, 'rb') as f:
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    busy = []
+    with buf:
+        for offset in range(0, len(buf) - GPU_SLOT.size + 1, GPU_SLOT.size):
+            state = GPU_SLOT_BUSY
+            for _ in range(GPU_SLOT_READ_RETRIES):
+                seq, slot_state, _, _, _ = GPU_SLOT.unpack_from(buf, offset)
+                if seq % 2 == 0 and struct.unpack_from("<I", buf, offset)[0] == seq:
+                    state = slot_state
+                    break
+            else:
+                logger.warning(f"gpu slot at {offset} is stuck in a write, reporting it as busy")
+            busy.append(state)
+    return busy
+
+
 def gpu_metrics():
     data = []
+    busy = get_gpu_busy()
+    if busy is not None:
+        for device_id, state in enumerate(busy):
+            data.append({
+                'MetricName': 'GPUBusy',
+                'Dimensions': [
+                    {
+                        'Name': 'Endpoint',
+                        'Value': endpoint_name
+                    },
+                    {
+                        'Name': 'Instance',
+                        'Value': endpoint_instance_id
+                    },
+                    {
+                        'Name': 'InstanceGPU',
+                        'Value': f"GPU{device_id}"
+                    }
+                ],
+                'Timestamp': datetime.datetime.utcnow(),
+                'Value': state,
+                'Unit': 'Count'
+            })
+
     utilization = get_gpu_utilization()
     if utilization is not None:
         for device_id, util in enumerate(utilization):
@@ -415,6 +415,14 @@ if [ -n "$ON_EC2" ]; then
     cp -f /serve.py /home/ubuntu/ComfyUI/
   fi
 
+  if [ -f "/comfy_output_uploader.py" ]; then
+    cp -f /comfy_output_uploader.py /home/ubuntu/ComfyUI/
+  fi
+
+  if [ -f "/comfy_sync_utils.py" ]; then
+    cp -f /comfy_sync_utils.py /home/ubuntu/ComfyUI/
+  fi
+
   if [ -d "/ComfyUI-AWS-Extension" ]; then
     rm -rf /home/ubuntu/ComfyUI/custom_nodes/ComfyUI-AWS-Extension
     cp -r /ComfyUI-AWS-Extension /home/ubuntu/ComfyUI/custom_nodes/
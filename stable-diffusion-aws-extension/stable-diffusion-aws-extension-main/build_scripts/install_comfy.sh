@@ -24,6 +24,8 @@ if [ -n "$ESD_COMMIT_ID" ]; then
 fi
 
 cp stable-diffusion-aws-extension/build_scripts/comfy/serve.py ComfyUI/
+cp stable-diffusion-aws-extension/build_scripts/comfy/comfy_output_uploader.py ComfyUI/
+cp stable-diffusion-aws-extension/build_scripts/comfy/comfy_sync_utils.py ComfyUI/
 cp stable-diffusion-aws-extension/build_scripts/comfy/comfy_proxy.py ComfyUI/custom_nodes/
 #  TODO 6.14 delete
 cp stable-diffusion-aws-extension/build_scripts/comfy/comfy_sagemaker_proxy.py ComfyUI/custom_nodes/
@@ -19,6 +19,8 @@ SUPERVISORD_FILE="$CONTAINER_PATH/supervisord.conf"
 START_SH=$(realpath ./build_scripts/inference/start.sh)
 START_PY=$(realpath ./build_scripts/comfy/serve.py)
 COMFY_PROXY=$(realpath ./build_scripts/comfy/comfy_proxy.py)
+COMFY_UPLOADER=$(realpath ./build_scripts/comfy/comfy_output_uploader.py)
+COMFY_SYNC_UTILS=$(realpath ./build_scripts/comfy/comfy_sync_utils.py)
 COMFY_EXT=$(realpath ./build_scripts/comfy/ComfyUI-AWS-Extension)
 IMAGE_SH=$(realpath ./docker_image.sh)
 
@@ -112,6 +114,8 @@ docker run -v $(realpath ~/.aws):/root/.aws \\
            -v $START_SH:/start.sh:ro \\
            -v $START_PY:/serve.py:ro \\
            -v $COMFY_PROXY:/comfy_proxy.py:ro \\
+           -v $COMFY_UPLOADER:/comfy_output_uploader.py:ro \\
+           -v $COMFY_SYNC_UTILS:/comfy_sync_utils.py:ro \\
            -v $COMFY_EXT:/ComfyUI-AWS-Extension:ro \\
            --gpus all \\
            -e IMAGE_HASH=$ACCOUNT_ID.dkr.ecr.$AWS_REGION.amazonaws.com/esd_container \\
@@ -5,7 +5,7 @@ import { Effect } from 'aws-cdk-lib/aws-iam';
 import { Architecture, Runtime } from 'aws-cdk-lib/aws-lambda';
 import { Construct } from 'constructs';
 import { ApiModels } from '../../shared/models';
-import { SCHEMA_CHECKPOINT_ID, SCHEMA_CHECKPOINT_STATUS, SCHEMA_CHECKPOINT_TYPE, SCHEMA_DEBUG, SCHEMA_MESSAGE } from '../../shared/schema';
+import { SCHEMA_CHECKPOINT_ID, SCHEMA_CHECKPOINT_STATUS, SCHEMA_CHECKPOINT_TYPE, SCHEMA_DEBUG, SCHEMA_LAST_KEY, SCHEMA_MESSAGE } from '../../shared/schema';
 
 
 export interface ListCheckPointsApiProps {
@@ -51,6 +51,9 @@ export class ListCheckPointsApi {
         'method.request.querystring.page': false,
         'method.request.querystring.per_page': false,
         'method.request.querystring.username': false,
+        'method.request.querystring.types': false,
+        'method.request.querystring.status': false,
+        'method.request.querystring.exclusive_start_key': false,
       },
       methodResponses: [
         ApiModels.methodResponse(this.responseModel(), '200'),
@@ -87,10 +90,13 @@ export class ListCheckPointsApi {
               },
               pages: {
                 type: JsonSchemaType.INTEGER,
+                description: 'Lower bound, one more than page while last_evaluated_key is set',
               },
               total: {
                 type: JsonSchemaType.INTEGER,
+                description: 'Lower bound, the checkpoints listed so far plus one while last_evaluated_key is set',
               },
+              last_evaluated_key: SCHEMA_LAST_KEY,
               checkpoints: {
                 type: JsonSchemaType.ARRAY,
                 items: {
@@ -202,7 +208,11 @@ export class ListCheckPointsApi {
         'dynamodb:Scan',
         'dynamodb:Query',
       ],
-      resources: [this.checkpointTable.tableArn, this.multiUserTable.tableArn],
+      resources: [
+        this.checkpointTable.tableArn,
+        `${this.checkpointTable.tableArn}/*`,
+        this.multiUserTable.tableArn,
+      ],
     }));
 
     newRole.addToPolicy(new aws_iam.PolicyStatement({
@@ -48,6 +48,9 @@ export class GetSyncMsgApi {
     this.router.addMethod(this.httpMethod, this.lambdaIntegration, {
       apiKeyRequired: true,
       operationName: 'GetSyncMessage',
+      requestParameters: {
+        'method.request.querystring.since': false,
+      },
       methodResponses: [
         ApiModels.methodResponses400(),
         ApiModels.methodResponses401(),
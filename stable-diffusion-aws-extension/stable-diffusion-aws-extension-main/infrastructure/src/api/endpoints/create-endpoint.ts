@@ -17,6 +17,7 @@ import {
   SCHEMA_ENDPOINT_MAX_INSTANCE_NUMBER,
   SCHEMA_ENDPOINT_MIN_INSTANCE_NUMBER,
   SCHEMA_ENDPOINT_NAME,
+  SCHEMA_ENDPOINT_OUTPUT_IMAGES_TO_S3,
   SCHEMA_ENDPOINT_OWNER_GROUP_OR_ROLE,
   SCHEMA_ENDPOINT_SERVICE_TYPE,
   SCHEMA_ENDPOINT_START_TIME,
@@ -134,6 +135,7 @@ export class CreateEndpointApi {
               owner_group_or_role: SCHEMA_ENDPOINT_OWNER_GROUP_OR_ROLE,
               min_instance_number: SCHEMA_ENDPOINT_MIN_INSTANCE_NUMBER,
               custom_extensions: SCHEMA_ENDPOINT_CUSTOM_EXTENSIONS,
+              output_images_to_s3: SCHEMA_ENDPOINT_OUTPUT_IMAGES_TO_S3,
             },
             required: [
               'EndpointDeploymentJobId',
@@ -200,6 +202,7 @@ export class CreateEndpointApi {
           autoscaling_enabled: {
             type: JsonSchemaType.BOOLEAN,
           },
+          output_images_to_s3: SCHEMA_ENDPOINT_OUTPUT_IMAGES_TO_S3,
           assign_to_roles: {
             type: JsonSchemaType.ARRAY,
             items: {
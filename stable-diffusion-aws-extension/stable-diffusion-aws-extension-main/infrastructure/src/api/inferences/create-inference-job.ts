@@ -25,6 +25,7 @@ export interface CreateInferenceJobApiProps {
   commonLayer: aws_lambda.LayerVersion;
   checkpointTable: aws_dynamodb.Table;
   multiUserTable: aws_dynamodb.Table;
+  instanceMonitorTable: aws_dynamodb.Table;
 }
 
 export class CreateInferenceJobApi {
@@ -39,12 +40,14 @@ export class CreateInferenceJobApi {
   private readonly router: aws_apigateway.Resource;
   private readonly checkpointTable: aws_dynamodb.Table;
   private readonly multiUserTable: aws_dynamodb.Table;
+  private readonly instanceMonitorTable: aws_dynamodb.Table;
 
   constructor(scope: Construct, id: string, props: CreateInferenceJobApiProps) {
     this.id = id;
     this.scope = scope;
     this.checkpointTable = props.checkpointTable;
     this.multiUserTable = props.multiUserTable;
+    this.instanceMonitorTable = props.instanceMonitorTable;
     this.endpointDeploymentTable = props.endpointDeploymentTable;
     this.inferenceJobTable = props.inferenceJobTable;
     this.layer = props.commonLayer;
@@ -230,6 +233,10 @@ export class CreateInferenceJobApi {
           payload_string: {
             type: JsonSchemaType.STRING,
           },
+          output_to_s3: {
+            type: JsonSchemaType.BOOLEAN,
+            description: 'Whether the endpoint writes result images to S3 itself, defaults to the endpoint setting',
+          },
           models: {
             type: JsonSchemaType.OBJECT,
             properties: {
@@ -271,6 +278,7 @@ export class CreateInferenceJobApi {
         this.endpointDeploymentTable.tableArn,
         this.checkpointTable.tableArn,
         this.multiUserTable.tableArn,
+        this.instanceMonitorTable.tableArn,
       ],
     }));
 
@@ -336,6 +344,7 @@ export class CreateInferenceJobApi {
       environment: {
         INFERENCE_JOB_TABLE: this.inferenceJobTable.tableName,
         CHECKPOINT_TABLE: this.checkpointTable.tableName,
+        INSTANCE_MONITOR_TABLE: this.instanceMonitorTable.tableName,
       },
       layers: [this.layer],
     });
@@ -53,6 +53,9 @@ export class GetInferenceJobApi {
       {
         apiKeyRequired: true,
         operationName: 'GetInferenceJob',
+        requestParameters: {
+          'method.request.querystring.wait': false,
+        },
         methodResponses: [
           ApiModels.methodResponse(this.responseModel()),
           ApiModels.methodResponses401(),
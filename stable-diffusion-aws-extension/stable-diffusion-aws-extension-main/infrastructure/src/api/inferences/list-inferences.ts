@@ -54,6 +54,7 @@ export class ListInferencesApi {
         'method.request.querystring.limit': false,
         'method.request.querystring.exclusive_start_key': false,
         'method.request.querystring.type': false,
+        'method.request.querystring.fields': false,
       },
       methodResponses: [
         ApiModels.methodResponse(this.responseModel()),
@@ -192,6 +192,8 @@ export class Middleware extends Stack {
       resourceProvider,
     });
 
+    const ddbComfyTables = new ComfyDatabase(this, 'comfy-ddb');
+
     new Inference(this, {
       routers: restApi.routers,
       s3_bucket: s3Bucket,
@@ -201,6 +203,7 @@ export class Middleware extends Stack {
       sd_endpoint_deployment_job_table: ddbTables.sDEndpointDeploymentJobTable,
       checkpointTable: ddbTables.checkpointTable,
       multiUserTable: ddbTables.multiUserTable,
+      instanceMonitorTable: ddbComfyTables.instanceMonitorTable,
       commonLayer: commonLayers.commonLayer,
       synthesizer: props.synthesizer,
       inferenceErrorTopic: snsTopics.inferenceResultErrorTopic,
@@ -219,8 +222,6 @@ export class Middleware extends Stack {
       logLevel: logLevel,
     });
 
-    const ddbComfyTables = new ComfyDatabase(this, 'comfy-ddb');
-
     const sqsStack = new SqsStack(this, 'comfy-sqs', {
       name: 'SyncComfyMsgJob',
       visibilityTimeout: 900,
@@ -34,6 +34,7 @@ export interface InferenceProps extends StackProps {
   sd_inference_job_table: aws_dynamodb.Table;
   sd_endpoint_deployment_job_table: aws_dynamodb.Table;
   checkpointTable: aws_dynamodb.Table;
+  instanceMonitorTable: aws_dynamodb.Table;
   commonLayer: PythonLayerVersion;
   resourceProvider: ResourceProvider;
 }
@@ -57,6 +58,7 @@ export class Inference {
         router: props.routers.inferences,
         s3Bucket: props.s3_bucket,
         multiUserTable: props.multiUserTable,
+        instanceMonitorTable: props.instanceMonitorTable,
       },
     );
 
@@ -80,6 +80,7 @@ async function createAndCheckResources() {
 
   await createGlobalSecondaryIndex('SDInferenceJobTable', 'taskType', 'createTime');
   await createGlobalSecondaryIndex('SDEndpointDeploymentJobTable', 'endpoint_name', 'startTime');
+  await createGlobalSecondaryIndex('CheckpointTable', 'checkpoint_type', 'timestamp', 'N');
 }
 
 async function waitTableReady(tableName: string) {
@@ -445,6 +445,11 @@ export const SCHEMA_ENDPOINT_CUSTOM_EXTENSIONS: JsonSchema = {
   description: 'Custom Extensions',
 };
 
+export const SCHEMA_ENDPOINT_OUTPUT_IMAGES_TO_S3: JsonSchema = {
+  type: JsonSchemaType.BOOLEAN,
+  description: 'Whether the endpoint writes result images to S3 itself and returns only their keys',
+};
+
 export const SCHEMA_EXECUTE_PROMPT_ID: JsonSchema = {
   type: JsonSchemaType.STRING,
   description: 'Prompt ID',
@@ -1,105 +1,81 @@
+import heapq
 import json
 import logging
 import os
+import time
+from decimal import Decimal
 
 from aws_lambda_powertools import Tracer
 
-from common.const import PERMISSION_CHECKPOINT_ALL, PERMISSION_CHECKPOINT_LIST
+from common.const import PERMISSION_CHECKPOINT_ALL, PERMISSION_CHECKPOINT_LIST, CHECKPOINT_TYPES, \
+    CHECKPOINT_TYPE_INDEX
 from common.ddb_service.client import DynamoDbUtilsService
 from common.response import ok
 from common.util import get_multi_query_params, get_query_param
-from libs.data_types import CheckPoint, PARTITION_KEYS, Role
+from libs.data_types import CheckPoint, PARTITION_KEYS
 from libs.utils import get_user_roles, check_user_permissions, get_permissions_by_username, permissions_check, \
-    response_error
+    response_error, encode_last_key, decode_last_key
 
 tracer = Tracer()
 checkpoint_table = os.environ.get('CHECKPOINT_TABLE')
 
 user_table = os.environ.get('MULTI_USER_TABLE')
+ROLE_CACHE_SECONDS = int(os.environ.get('ROLE_CACHE_SECONDS', 60))
+
+# attributes returned to the client, plus the index keys needed to build the cursor
+CHECKPOINT_PROJECTION = ['id', 'timestamp', 'checkpoint_type', 'checkpoint_status', 's3_location',
+                         'checkpoint_names', 'params', 'allowed_roles_or_users', 'source_path', 'target_path']
 
 logger = logging.getLogger(__name__)
 logger.setLevel(os.environ.get('LOG_LEVEL') or logging.ERROR)
 
 ddb_service = DynamoDbUtilsService(logger=logger)
 
+# survives between invocations of a warm lambda container
+role_cache = {}
+
 
-# GET /checkpoints?username=USER_NAME&types=value&status=value
+# GET /checkpoints?username=USER_NAME&types=value&status=value&per_page=10&exclusive_start_key=CURSOR
 @tracer.capture_lambda_handler
 def handler(event, context):
     try:
         logger.info(json.dumps(event))
-        _filter = {}
         requestor_name = permissions_check(event, [PERMISSION_CHECKPOINT_ALL, PERMISSION_CHECKPOINT_LIST])
-        user_roles = ['*']
 
         page = int(get_query_param(event, 'page', 1))
         per_page = int(get_query_param(event, 'per_page', 10))
         username = get_query_param(event, 'username', None)
+        exclusive_start_key = decode_last_key(get_query_param(event, 'exclusive_start_key', None))
 
         roles = get_multi_query_params(event, 'roles', default=[])
-
         status = get_multi_query_params(event, 'status')
-        if status:
-            _filter['checkpoint_status'] = status
+        types = get_multi_query_params(event, 'types') or CHECKPOINT_TYPES
 
-        types = get_multi_query_params(event, 'types')
-        if types:
-            _filter['checkpoint_type'] = types
+        requestor_permissions, user_roles = get_roles(requestor_name, username)
+        list_all = 'user' in requestor_permissions and 'all' in requestor_permissions['user']
 
-        if username:
-            user_roles = get_user_roles(ddb_service=ddb_service, user_table_name=user_table, username=username)
+        def permitted(ckpt: CheckPoint):
+            if len(roles) > 0 and set(roles).isdisjoint(set(ckpt.allowed_roles_or_users)):
+                return False
+            return list_all or check_user_permissions(ckpt.allowed_roles_or_users, user_roles, username)
 
-        requestor_permissions = get_permissions_by_username(ddb_service, user_table, requestor_name)
-        requestor_created_roles_rows = ddb_service.scan(table=user_table, filters={
-            'kind': PARTITION_KEYS.role,
-            'creator': requestor_name
-        })
-        for requestor_created_roles_row in requestor_created_roles_rows:
-            role = Role(**ddb_service.deserialize(requestor_created_roles_row))
-            user_roles.append(role.sort_key)
-
-        raw_ckpts = ddb_service.scan(table=checkpoint_table, filters=_filter)
-        if raw_ckpts is None or len(raw_ckpts) == 0:
-            data = {
-                'page': page,
-                'per_page': per_page,
-                'pages': 0,
-                'total': 0,
-                'checkpoints': []
-            }
-            return ok(data=data)
-
-        ckpts = []
-        for r in raw_ckpts:
-            ckpt = CheckPoint(**(ddb_service.deserialize(r)))
+        # the legacy page parameter is only honoured when no cursor is given
+        skip = 0 if exclusive_start_key else (page - 1) * per_page
+        if exclusive_start_key:
+            cursors = exclusive_start_key
+        else:
+            cursors = {checkpoint_type: {} for checkpoint_type in types}
 
-            if len(roles) > 0 and set(roles).isdisjoint(set(ckpt.allowed_roles_or_users)):
-                continue
-
-            if check_user_permissions(ckpt.allowed_roles_or_users, user_roles, username) or (
-                    'user' in requestor_permissions and 'all' in requestor_permissions['user']
-            ):
-                ckpts.append({
-                    'id': ckpt.id,
-                    's3Location': ckpt.s3_location,
-                    'type': ckpt.checkpoint_type,
-                    'status': ckpt.checkpoint_status.value,
-                    'name': ckpt.checkpoint_names,
-                    'created': ckpt.timestamp,
-                    'params': ckpt.params,
-                    'allowed_roles_or_users': ckpt.allowed_roles_or_users,
-                    'source_path': ckpt.source_path,
-                    'target_path': ckpt.target_path,
-                })
-
-        ckpts = sort_checkpoints(ckpts)
+        ckpts, last_evaluated_key = query_checkpoints(cursors, status, permitted, skip, per_page)
 
         data = {
             'page': page,
             'per_page': per_page,
-            'pages': int(len(ckpts) / per_page) + 1,
-            'total': len(ckpts),
-            'checkpoints': page_data(ckpts, page, per_page),
+            # the exact count would need a full read of the table, these are lower bounds
+            'pages': page + 1 if last_evaluated_key else (page if ckpts or page > 1 else 0),
+            'total': skip + len(ckpts) + (1 if last_evaluated_key else 0),
+            'checkpoints': ckpts,
+            'last_evaluated_key': encode_last_key(last_evaluated_key),
         }
 
         return ok(data=data, decimal=True)
@@ -107,15 +83,98 @@ def handler(event, context):
         return response_error(e)
 
 
-# todo will use query
-def page_data(data, page, per_page):
-    start = (page - 1) * per_page
-    end = page * per_page
-    return data[start:end]
+def get_roles(requestor_name: str, username: str):
+    cache_key = (requestor_name, username)
+    cached = role_cache.get(cache_key)
+    if cached and cached[0] > time.time():
+        return cached[1]
+
+    user_roles = ['*']
+    if username:
+        user_roles = get_user_roles(ddb_service=ddb_service, user_table_name=user_table, username=username)
+
+    requestor_permissions = get_permissions_by_username(ddb_service, user_table, requestor_name)
+    requestor_created_roles_rows = ddb_service.iter_query(table=user_table,
+                                                          key_values={'kind': PARTITION_KEYS.role},
+                                                          filters={'creator': requestor_name},
+                                                          projection=['sort_key'])
+    for requestor_created_roles_row in requestor_created_roles_rows:
+        user_roles.append(requestor_created_roles_row['sort_key'])
+
+    role_cache[cache_key] = (time.time() + ROLE_CACHE_SECONDS, (requestor_permissions, user_roles))
+    return requestor_permissions, user_roles
+
+
+def query_checkpoints(cursors, status, permitted, skip: int, per_page: int):
+    """
+    Merges the per type streams of checkpoint_type-timestamp-index newest first and keeps
+    reading until per_page permitted checkpoints are collected.
+
+    The cursor holds, per type that still has rows, the index key of the last row consumed
+    (an empty dict for a type not read yet); types that are exhausted are dropped from it.
+    """
+    heap = []
+    for i, (checkpoint_type, start_key) in enumerate(cursors.items()):
+        rows = ddb_service.iter_query(table=checkpoint_table,
+                                      key_values={'checkpoint_type': checkpoint_type},
+                                      filters={'checkpoint_status': status} if status else None,
+                                      projection=CHECKPOINT_PROJECTION,
+                                      index_name=CHECKPOINT_TYPE_INDEX,
+                                      page_size=per_page,
+                                      scan_forward=False,
+                                      exclusive_start_key=to_index_key(start_key))
+        push_next(heap, i, rows)
+
+    last_keys = dict(cursors)
+    ckpts = []
+    while heap and len(ckpts) < per_page:
+        _, i, row, rows = heapq.heappop(heap)
+        push_next(heap, i, rows)
+        last_keys[row['checkpoint_type']] = {
+            'id': row['id'],
+            'checkpoint_type': row['checkpoint_type'],
+            'timestamp': str(row['timestamp']),
+        }
+
+        ckpt = CheckPoint(**row)
+        if not permitted(ckpt):
+            continue
+        if skip > 0:
+            skip -= 1
+            continue
+
+        ckpts.append({
+            'id': ckpt.id,
+            's3Location': ckpt.s3_location,
+            'type': ckpt.checkpoint_type,
+            'status': ckpt.checkpoint_status.value,
+            'name': ckpt.checkpoint_names,
+            'created': ckpt.timestamp,
+            'params': ckpt.params,
+            'allowed_roles_or_users': ckpt.allowed_roles_or_users,
+            'source_path': ckpt.source_path,
+            'target_path': ckpt.target_path,
+        })
+
+    if not heap:
+        return ckpts, None
+
+    # only types with rows left are carried over to the next page
+    pending = {row['checkpoint_type'] for _, _, row, _ in heap}
+    return ckpts, {t: key for t, key in last_keys.items() if t in pending}
+
 
+def push_next(heap, i: int, rows):
+    row = next(rows, None)
+    if row is not None:
+        heapq.heappush(heap, (-row['timestamp'], i, row, rows))
 
-def sort_checkpoints(data):
-    if len(data) == 0:
-        return data
 
-    return sorted(data, key=lambda x: x['created'], reverse=True)
+def to_index_key(cursor):
+    if not cursor:
+        return None
+    return {
+        'id': cursor['id'],
+        'checkpoint_type': cursor['checkpoint_type'],
+        'timestamp': Decimal(cursor['timestamp']),
+    }
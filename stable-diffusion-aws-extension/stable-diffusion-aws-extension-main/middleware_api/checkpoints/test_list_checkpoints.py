@@ -0,0 +1,111 @@
+from decimal import Decimal
+from unittest import TestCase
+from unittest.mock import patch
+
+from checkpoints import list_checkpoints
+from common.const import CHECKPOINT_TYPES, COMFY_TYPE
+from libs.utils import decode_last_key, encode_last_key
+
+
+def checkpoint(checkpoint_id, checkpoint_type, timestamp, allowed=None):
+    return {
+        'id': checkpoint_id,
+        'checkpoint_type': checkpoint_type,
+        'timestamp': Decimal(timestamp),
+        'checkpoint_status': 'Active',
+        's3_location': f's3://bucket/{checkpoint_id}',
+        'checkpoint_names': [f'{checkpoint_id}.safetensors'],
+        'allowed_roles_or_users': allowed or ['*'],
+    }
+
+
+class FakeIndex:
+    """checkpoint_type-timestamp-index of a fake table, read newest first like the real query."""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.reads = 0
+
+    def iter_query(self, table, key_values, filters=None, projection=None, index_name=None, page_size=None,
+                   scan_forward=True, exclusive_start_key=None):
+        rows = sorted([row for row in self.rows if row['checkpoint_type'] == key_values['checkpoint_type']],
+                      key=lambda row: row['timestamp'], reverse=not scan_forward)
+        if exclusive_start_key:
+            rows = [row for row in rows if row['timestamp'] < exclusive_start_key['timestamp']]
+        for row in rows:
+            self.reads += 1
+            if filters and row['checkpoint_status'] != filters['checkpoint_status']:
+                continue
+            yield dict(row)
+
+
+class QueryCheckpointsTest(TestCase):
+
+    def setUp(self):
+        self.rows = [checkpoint(f'sd-{i}', 'Stable-diffusion', 100 + i * 3) for i in range(5)] + \
+                    [checkpoint(f'lora-{i}', 'Lora', 101 + i * 3) for i in range(4)] + \
+                    [checkpoint(f'vae-{i}', 'VAE', 102 + i * 10) for i in range(2)]
+        self.index = FakeIndex(self.rows)
+        patcher = patch.object(list_checkpoints, 'ddb_service', self.index)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def query(self, cursors, per_page, permitted=lambda ckpt: True, skip=0):
+        return list_checkpoints.query_checkpoints(cursors, None, permitted, skip, per_page)
+
+    def newest_first(self, rows):
+        return [row['id'] for row in sorted(rows, key=lambda row: row['timestamp'], reverse=True)]
+
+    def test_merges_types_newest_first(self):
+        ckpts, _ = self.query({t: {} for t in ['Stable-diffusion', 'Lora', 'VAE']}, 4)
+
+        self.assertEqual([ckpt['id'] for ckpt in ckpts], self.newest_first(self.rows)[:4])
+
+    def test_default_types_list_comfy_checkpoints(self):
+        self.rows.append(checkpoint('comfy-0', COMFY_TYPE, 200))
+
+        ckpts, _ = self.query({t: {} for t in CHECKPOINT_TYPES}, 1)
+
+        self.assertEqual([(ckpt['id'], ckpt['type']) for ckpt in ckpts], [('comfy-0', COMFY_TYPE)])
+
+    def test_cursor_pages_through_every_checkpoint_once(self):
+        cursors = {t: {} for t in ['Stable-diffusion', 'Lora', 'VAE']}
+        ids = []
+        while True:
+            ckpts, last_key = self.query(cursors, 3)
+            ids += [ckpt['id'] for ckpt in ckpts]
+            if not last_key:
+                break
+            # the cursor goes to the client and back as an opaque string
+            cursors = decode_last_key(encode_last_key(last_key))
+
+        self.assertEqual(ids, self.newest_first(self.rows))
+
+    def test_exhausted_types_are_dropped_from_the_cursor(self):
+        _, last_key = self.query({t: {} for t in ['Stable-diffusion', 'Lora', 'VAE']}, 3)
+        self.assertEqual(set(last_key), {'Stable-diffusion', 'Lora', 'VAE'})
+
+        ckpts, last_key = self.query({'VAE': {}}, 2)
+        self.assertEqual(len(ckpts), 2)
+        self.assertIsNone(last_key)
+
+    def test_page_is_filled_with_permitted_checkpoints(self):
+        self.rows[4]['allowed_roles_or_users'] = ['admin']
+        self.rows[3]['allowed_roles_or_users'] = ['admin']
+
+        ckpts, last_key = self.query({'Stable-diffusion': {}}, 3,
+                                     permitted=lambda ckpt: ckpt.allowed_roles_or_users != ['admin'])
+
+        self.assertEqual([ckpt['id'] for ckpt in ckpts], ['sd-2', 'sd-1', 'sd-0'])
+        self.assertIsNone(last_key)
+
+    def test_legacy_page_skips_rows(self):
+        ckpts, _ = self.query({t: {} for t in ['Stable-diffusion', 'Lora', 'VAE']}, 3, skip=3)
+
+        self.assertEqual([ckpt['id'] for ckpt in ckpts], self.newest_first(self.rows)[3:6])
+
+    def test_reads_only_what_the_page_needs(self):
+        self.query({t: {} for t in ['Stable-diffusion', 'Lora', 'VAE']}, 2)
+
+        # the two rows of the page plus one row read ahead per type
+        self.assertLessEqual(self.index.reads, 2 + 3)
@@ -7,6 +7,7 @@ import boto3
 from aws_lambda_powertools import Tracer
 
 from common.ddb_service.client import DynamoDbUtilsService
+from common.ddb_service.write_buffer import ItemUpdateBuffer
 from common.util import s3_scan_files, load_json_from_s3, record_count_metrics, \
     record_latency_metrics, record_queue_latency_metrics
 from libs.comfy_data_types import InferenceResult
@@ -66,22 +67,22 @@ def handler(event, context):
                                      ep_name=result.endpoint_name,
                                      service=ServiceType.Comfy.value)
 
-        if result.message:
-            update_execute_job_table(prompt_id=result.prompt_id, key="message", value=result.message)
+        with ItemUpdateBuffer(inference_table, 'prompt_id', logger=logger) as job_updates:
+            if result.message:
+                job_updates.set(result.prompt_id, "message", result.message)
 
-        if result.device_id:
-            update_execute_job_table(prompt_id=result.prompt_id, key="device_id", value=result.device_id)
+            if result.device_id:
+                job_updates.set(result.prompt_id, "device_id", result.device_id)
 
-        if result.endpoint_instance_id:
-            update_execute_job_table(prompt_id=result.prompt_id, key="endpoint_instance_id",
-                                     value=result.endpoint_instance_id)
+            if result.endpoint_instance_id:
+                job_updates.set(result.prompt_id, "endpoint_instance_id", result.endpoint_instance_id)
 
-        update_execute_job_table(prompt_id=result.prompt_id, key="status", value=result.status)
-        update_execute_job_table(prompt_id=result.prompt_id, key="output_path", value=result.output_path)
-        update_execute_job_table(prompt_id=result.prompt_id, key="output_files", value=result.output_files)
-        update_execute_job_table(prompt_id=result.prompt_id, key="temp_path", value=result.temp_path)
-        update_execute_job_table(prompt_id=result.prompt_id, key="temp_files", value=result.temp_files)
-        update_execute_job_table(prompt_id=result.prompt_id, key="complete_time", value=datetime.now().isoformat())
+            job_updates.set(result.prompt_id, "status", result.status)
+            job_updates.set(result.prompt_id, "output_path", result.output_path)
+            job_updates.set(result.prompt_id, "output_files", result.output_files)
+            job_updates.set(result.prompt_id, "temp_path", result.temp_path)
+            job_updates.set(result.prompt_id, "temp_files", result.temp_files)
+            job_updates.set(result.prompt_id, "complete_time", datetime.now().isoformat())
 
         if message["invocationStatus"] != "Completed":
             record_count_metrics(ep_name=result.endpoint_name,
@@ -101,20 +102,3 @@ def handler(event, context):
 
     return {}
 
-
-def update_execute_job_table(prompt_id, key, value):
-    logger.info(f"Update job with prompt_id: {prompt_id}, key: {key}, value: {value}")
-    try:
-        inference_table.update_item(
-            Key={
-                "prompt_id": prompt_id,
-            },
-            UpdateExpression=f"set #k = :r",
-            ExpressionAttributeNames={'#k': key},
-            ExpressionAttributeValues={':r': value},
-            ConditionExpression="attribute_exists(prompt_id)",
-            ReturnValues="UPDATED_NEW"
-        )
-    except Exception as e:
-        logger.error(f"Update execute job table error: {e}")
-        raise e
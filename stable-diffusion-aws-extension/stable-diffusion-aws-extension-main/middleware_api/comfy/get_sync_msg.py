@@ -5,7 +5,8 @@ import os
 import boto3
 from aws_lambda_powertools import Tracer
 
-from common.response import ok, no_content
+from common.response import ok, no_content, bad_request
+from common.util import get_query_param
 from libs.utils import response_error
 
 tracer = Tracer()
@@ -15,57 +16,42 @@ logger.setLevel(os.environ.get('LOG_LEVEL') or logging.ERROR)
 msg_table_name = os.environ.get('MSG_TABLE')
 ddb = boto3.client('dynamodb')
 
-
-def save_message_to_dynamodb(prompt_id, message):
-    try:
-        response = ddb.get_item(
-            TableName=msg_table_name,
-            Key={
-                'prompt_id': {'S': prompt_id}
-            }
-        )
-        existing_item = response.get('Item')
-        if existing_item:
-            existing_messages = json.loads(existing_item['message_body']['S'])
-            existing_messages.append(message)
-            ddb.update_item(
-                TableName=msg_table_name,
-                Key={
-                    'prompt_id': {'S': prompt_id}
-                },
-                UpdateExpression='SET message_body = :new_messages',
-                ExpressionAttributeValues={
-                    ':new_messages': {'S': json.dumps(existing_messages)}
-                }
-            )
-            logger.info(f"Message appended to existing record for prompt_id: {prompt_id}")
-        else:
-            ddb.put_item(
-                TableName=msg_table_name,
-                Item={
-                    'prompt_id': {'S': prompt_id},
-                    'message_body': {'S': json.dumps([message])}
-                }
-            )
-            logger.info(f"New record created for prompt_id: {prompt_id}")
-    except Exception as e:
-        logger.error(f"Error saving message to DynamoDB: {e}")
+MAX_MESSAGES = 1000
 
 
-def read_messages_from_dynamodb(prompt_id):
+def read_messages_from_dynamodb(prompt_id, since=None, limit=MAX_MESSAGES):
+    """
+    Read the messages of a prompt in sequence order, only those after `since` if given.
+    Returns the messages and the sequence of the last one, to be passed as `since` on the next read.
+    """
+    messages = []
+    last_seq = since
     try:
-        # process_sqs_messages_and_write_to_ddb(prompt_id)
-        response = ddb.query(
-            TableName=msg_table_name,
-            KeyConditionExpression='prompt_id = :pid',
-            ExpressionAttributeValues={':pid': {'S': prompt_id}},
-        )
-        messages = [json.loads(item['message_body']['S']) for item in response.get('Items', [])]
+        key_condition = 'prompt_id = :pid'
+        values = {':pid': {'S': prompt_id}}
+        if since is not None:
+            key_condition += ' AND request_time > :since'
+            values[':since'] = {'N': str(since)}
+
+        query_params = {
+            'TableName': msg_table_name,
+            'KeyConditionExpression': key_condition,
+            'ExpressionAttributeValues': values,
+            'Limit': limit,
+        }
+        while len(messages) < limit:
+            response = ddb.query(**query_params)
+            for item in response.get('Items', []):
+                messages.append(json.loads(item['message_body']['S']))
+                last_seq = int(item['request_time']['N'])
+            if 'LastEvaluatedKey' not in response:
+                break
+            query_params['ExclusiveStartKey'] = response['LastEvaluatedKey']
+            query_params['Limit'] = limit - len(messages)
         logger.info("read_messages_from_dynamodb response: {}".format(messages))
-        return messages
     except Exception as e:
         logger.error(f"Error reading messages from DynamoDB: {e}")
-        return []
+    return messages, last_seq
 
 
 @tracer.capture_lambda_handler
@@ -75,8 +61,17 @@ def handler(event, ctx):
         if 'pathParameters' not in event or not event['pathParameters'] or not event['pathParameters']['id']:
             return no_content()
         prompt_id = event['pathParameters']['id']
-        response = read_messages_from_dynamodb(prompt_id)
-        logger.info(f"get msg end... response: {response}")
-        return ok(data=response)
+        since = get_query_param(event, 'since')
+        if since is None:
+            messages, _ = read_messages_from_dynamodb(prompt_id)
+            logger.info(f"get msg end... response: {messages}")
+            return ok(data=messages)
+
+        if not since.isdigit():
+            return bad_request(message=f"since must be a message sequence number, got: {since}")
+
+        messages, last_seq = read_messages_from_dynamodb(prompt_id, int(since))
+        logger.info(f"get msg end... response: {messages} last_seq: {last_seq}")
+        return ok(data={'messages': messages, 'last_seq': last_seq})
     except Exception as e:
         return response_error(e)
@@ -1,4 +1,3 @@
-import datetime
 import json
 import logging
 import os
@@ -17,58 +16,50 @@ logger.setLevel(os.environ.get('LOG_LEVEL') or logging.ERROR)
 msg_table_name = os.environ.get("MSG_TABLE")
 ddb = boto3.client('dynamodb')
 
+# BatchWriteItem accepts at most 25 put requests per call
+BATCH_WRITE_SIZE = 25
+BATCH_WRITE_RETRIES = 5
 
-def save_message_to_dynamodb(prompt_id, message):
-    try:
-        response = ddb.get_item(
-            TableName=msg_table_name,
-            Key={
-                'prompt_id': {'S': prompt_id}
-            }
-        )
-        existing_item = response.get('Item')
-        if existing_item:
-            existing_messages = json.loads(existing_item['message_body']['S'])
-            existing_messages.append(message)
-            ddb.update_item(
-                TableName=msg_table_name,
-                Key={
-                    'prompt_id': {'S': prompt_id}
-                },
-                UpdateExpression='SET message_body = :new_messages',
-                ExpressionAttributeValues={
-                    ':new_messages': {'S': json.dumps(existing_messages)}
-                }
-            )
-            logger.info(f"Message appended to existing record for prompt_id: {prompt_id}")
-        else:
-            ddb.put_item(
-                TableName=msg_table_name,
-                Item={
-                    'prompt_id': {'S': prompt_id},
-                    'message_body': {'S': json.dumps([message])}
-                }
-            )
-            logger.info(f"New record created for prompt_id: {prompt_id}")
-    except Exception as e:
-        logger.error(f"Error saving message to DynamoDB: {e}")
+
+def message_sequence(record, i):
+    # the queue is FIFO grouped by prompt_id, so the SQS sequence number is increasing per prompt
+    # and stays the same when a record is redelivered, which makes the write idempotent
+    attributes = record.get('attributes') or {}
+    if 'SequenceNumber' in attributes:
+        return int(attributes['SequenceNumber'])
+    sent_time = int(attributes.get('SentTimestamp') or time.time() * 1000)
+    return sent_time * 1000 + i
 
 
-def save_message_to_dynamodb_by_one(prompt_id, message, i):
+def batch_write_messages(items):
+    requests = [{'PutRequest': {'Item': item}} for item in items]
+    for start in range(0, len(requests), BATCH_WRITE_SIZE):
+        chunk = {msg_table_name: requests[start:start + BATCH_WRITE_SIZE]}
+        retries = 0
+        while chunk:
+            response = ddb.batch_write_item(RequestItems=chunk)
+            chunk = response.get('UnprocessedItems')
+            if not chunk:
+                break
+            retries += 1
+            if retries > BATCH_WRITE_RETRIES:
+                raise Exception(f"Unprocessed messages after {BATCH_WRITE_RETRIES} retries: {chunk}")
+            time.sleep(0.05 * 2 ** retries)
+
+
+def save_messages_to_dynamodb(prompt_id, messages):
     try:
-        # request_time = f'{datetime.datetime.now()}_{i}'
-        request_time = int(time.time() * 1000) + i
-        ddb.put_item(
-            TableName=msg_table_name,
-            Item={
-                'prompt_id': {'S': prompt_id},
-                'request_time': {'N': str(request_time)},
-                'message_body': {'S': json.dumps([message])}
-            }
-        )
-        logger.info(f"New record created for prompt_id: {prompt_id}")
+        items = [{
+            'prompt_id': {'S': prompt_id},
+            'request_time': {'N': str(seq)},
+            'message_body': {'S': json.dumps([message])}
+        } for seq, message in messages]
+        batch_write_messages(items)
+        logger.info(f"{len(items)} records created for prompt_id: {prompt_id}")
     except Exception as e:
-        logger.error(f"Error saving message to DynamoDB: {e}")
+        logger.error(f"Error saving messages to DynamoDB: {e}")
+        # failing the invocation makes SQS deliver the batch again, the writes are idempotent
+        raise
 
 
 @tracer.capture_lambda_handler
@@ -78,28 +69,19 @@ def handler(raw_event, ctx):
         if 'Records' not in raw_event or not raw_event['Records']:
             logger.error("ignore empty records msg")
             return ok()
-        # msg_save = {}
-        i = 0
-        for message in raw_event['Records']:
-            if not message or 'body' not in message:
+        msg_save = {}
+        for i, record in enumerate(raw_event['Records']):
+            if not record or 'body' not in record:
                 logger.error("ignore empty body msg")
-                return ok()
-            msg = json.loads(message['body'])
+                continue
+            msg = json.loads(record['body'])
             logger.info(f"msg body: {msg}")
             if 'prompt_id' in msg and msg['prompt_id']:
-                prompt_id = msg['prompt_id']
-                # TODO batch save with no request_time
-                save_message_to_dynamodb_by_one(prompt_id, msg, i)
-                i = i+1
-            # if 'prompt_id' in msg and msg['prompt_id']:
-            #     if msg['prompt_id'] in msg_save.keys():
-            #         msg_save[msg['prompt_id']].append(msg)
-            #     else:
-            #         msg_save[msg['prompt_id']] = []
-            #         msg_save[msg['prompt_id']].append(msg)
-        # for item in msg_save.keys():
-        #     save_message_to_dynamodb(item, msg_save[item])
-        logger.info("execute end...")
-        return ok()
+                msg_save.setdefault(msg['prompt_id'], []).append((message_sequence(record, i), msg))
     except Exception as e:
         return response_error(e)
+
+    for prompt_id, messages in msg_save.items():
+        save_messages_to_dynamodb(prompt_id, messages)
+    logger.info("execute end...")
+    return ok()
@@ -0,0 +1,124 @@
+import json
+from unittest import TestCase
+from unittest.mock import patch
+
+from comfy import get_sync_msg
+
+
+def message(prompt_id, seq):
+    return {
+        'prompt_id': {'S': prompt_id},
+        'request_time': {'N': str(seq)},
+        'message_body': {'S': json.dumps({'event': 'executing', 'seq': seq})},
+    }
+
+
+class FakeMessageTable:
+    """Messages of a fake table, paged by `page_size` items like the real query."""
+
+    def __init__(self, items, page_size=2):
+        self.items = items
+        self.page_size = page_size
+        self.queries = []
+
+    def query(self, **params):
+        self.queries.append(params)
+        values = params['ExpressionAttributeValues']
+        since = int(values[':since']['N']) if ':since' in values else -1
+        start = params.get('ExclusiveStartKey', {}).get('request_time', -1)
+        items = [item for item in self.items
+                 if item['prompt_id']['S'] == values[':pid']['S']
+                 and int(item['request_time']['N']) > max(since, start)]
+        page = items[:min(self.page_size, params['Limit'])]
+        response = {'Items': page}
+        if len(items) > len(page):
+            response['LastEvaluatedKey'] = {'request_time': int(page[-1]['request_time']['N'])}
+        return response
+
+
+class ReadMessagesTest(TestCase):
+
+    def setUp(self):
+        self.table = FakeMessageTable([message('prompt-1', seq) for seq in range(1, 6)] + [message('prompt-2', 1)])
+        patcher = patch.object(get_sync_msg, 'ddb', self.table)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def seqs(self, messages):
+        return [msg['seq'] for msg in messages]
+
+    def test_reads_every_page(self):
+        messages, last_seq = get_sync_msg.read_messages_from_dynamodb('prompt-1')
+
+        self.assertEqual(self.seqs(messages), [1, 2, 3, 4, 5])
+        self.assertEqual(last_seq, 5)
+        self.assertEqual(len(self.table.queries), 3)
+
+    def test_reads_only_after_since(self):
+        messages, last_seq = get_sync_msg.read_messages_from_dynamodb('prompt-1', since=3)
+
+        self.assertEqual(self.seqs(messages), [4, 5])
+        self.assertEqual(last_seq, 5)
+        self.assertIn('request_time > :since', self.table.queries[0]['KeyConditionExpression'])
+
+    def test_last_seq_stays_when_nothing_is_new(self):
+        messages, last_seq = get_sync_msg.read_messages_from_dynamodb('prompt-1', since=5)
+
+        self.assertEqual(messages, [])
+        self.assertEqual(last_seq, 5)
+
+    def test_stops_at_limit(self):
+        messages, last_seq = get_sync_msg.read_messages_from_dynamodb('prompt-1', limit=3)
+
+        self.assertEqual(self.seqs(messages), [1, 2, 3])
+        self.assertEqual(last_seq, 3)
+        self.assertEqual(self.table.queries[-1]['Limit'], 1)
+
+    def test_query_error_returns_what_was_read(self):
+        query = self.table.query
+
+        def throttled_after_first_page(**params):
+            if 'ExclusiveStartKey' in params:
+                raise Exception('ProvisionedThroughputExceededException')
+            return query(**params)
+
+        self.table.query = throttled_after_first_page
+
+        messages, last_seq = get_sync_msg.read_messages_from_dynamodb('prompt-1')
+
+        self.assertEqual(self.seqs(messages), [1, 2])
+        self.assertEqual(last_seq, 2)
+
+
+class GetSyncMsgHandlerTest(TestCase):
+
+    def setUp(self):
+        self.table = FakeMessageTable([message('prompt-1', seq) for seq in range(1, 4)])
+        patcher = patch.object(get_sync_msg, 'ddb', self.table)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def get(self, since=None):
+        event = {'pathParameters': {'id': 'prompt-1'},
+                 'queryStringParameters': {'since': since} if since is not None else None}
+        response = get_sync_msg.handler(event, None)
+        return response['statusCode'], json.loads(response['body'])
+
+    def test_without_since_returns_the_legacy_list(self):
+        status, body = self.get()
+
+        self.assertEqual(status, 200)
+        self.assertEqual([msg['seq'] for msg in body['data']], [1, 2, 3])
+
+    def test_with_since_returns_messages_and_last_seq(self):
+        status, body = self.get('1')
+
+        self.assertEqual(status, 200)
+        self.assertEqual([msg['seq'] for msg in body['data']['messages']], [2, 3])
+        self.assertEqual(body['data']['last_seq'], 3)
+
+    def test_bad_since_is_rejected(self):
+        status, body = self.get('latest')
+
+        self.assertEqual(status, 400)
+        self.assertIn('latest', body['message'])
@@ -0,0 +1,34 @@
+import json
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+
+from comfy import sync_msg
+
+
+def sqs_event(*messages):
+    return {'Records': [{'body': json.dumps(message), 'attributes': {'SequenceNumber': str(i + 1)}}
+                        for i, message in enumerate(messages)]}
+
+
+@patch('comfy.sync_msg.time.sleep')
+class SyncMsgHandlerTest(TestCase):
+
+    def test_messages_saved(self, _sleep):
+        ddb = MagicMock()
+        ddb.batch_write_item.return_value = {'UnprocessedItems': {}}
+        with patch.object(sync_msg, 'ddb', ddb):
+            response = sync_msg.handler(sqs_event({'prompt_id': 'p1'}, {'prompt_id': 'p1'}), None)
+
+        self.assertEqual(200, response['statusCode'])
+        items = ddb.batch_write_item.call_args.kwargs['RequestItems'][sync_msg.msg_table_name]
+        self.assertEqual(['1', '2'], [item['PutRequest']['Item']['request_time']['N'] for item in items])
+
+    def test_unprocessed_messages_fail_the_batch(self, _sleep):
+        # SQS only delivers the batch again when the invocation fails
+        ddb = MagicMock()
+        ddb.batch_write_item.side_effect = lambda RequestItems: {'UnprocessedItems': RequestItems}
+        with patch.object(sync_msg, 'ddb', ddb):
+            with self.assertRaises(Exception):
+                sync_msg.handler(sqs_event({'prompt_id': 'p1'}), None)
+
+        self.assertEqual(sync_msg.BATCH_WRITE_RETRIES + 1, ddb.batch_write_item.call_count)
@@ -5,6 +5,7 @@ from enum import Enum, unique
 class LoraTrainType(Enum):
     KOHYA = 'kohya'
 
+
 @unique
 class CheckPointType(Enum):
     SD = "Stable-diffusion"
@@ -28,6 +29,10 @@ TRAIN_TYPE = "Stable-diffusion"
 
 COMFY_TYPE = 'Comfy'
 
+# every type SCHEMA_CHECKPOINT_TYPE allows, listed by default
+CHECKPOINT_TYPES = ["Stable-diffusion", "embeddings", "Lora", "hypernetworks", "ControlNet", "VAE", COMFY_TYPE]
+CHECKPOINT_TYPE_INDEX = 'checkpoint_type-timestamp-index'
+
 PERMISSION_INFERENCE_ALL = "inference:all"
 # todo will be remove, compatible with old data
 PERMISSION_INFERENCE_LIST = "inference:list"
@@ -1,17 +1,27 @@
 import datetime
 import enum
 import logging
+import queue
+import threading
+import time
 from decimal import Decimal
-from typing import Any, List, Dict
+from typing import Any, List, Dict, Iterator
 
 import boto3
 from aws_lambda_powertools import Tracer
+from boto3.dynamodb.types import TypeDeserializer
 from botocore.exceptions import ClientError
 
 from common.ddb_service.types_ import GetItemOutput, ScanOutput
 
 tracer = Tracer()
 
+BATCH_WRITE_SIZE = 25
+BATCH_WRITE_MAX_RETRIES = 8
+SEGMENT_QUEUE_PAGES = 2
+
+deserializer = TypeDeserializer()
+
 
 class DynamoDbUtilsService:
 
@@ -50,15 +60,23 @@ class DynamoDbUtilsService:
 
         for table_name, items in table_items.items():
             raws = [{'PutRequest': {'Item': self._serialize(item)}} for item in items]
-            batch = []
-            for raw in raws:
-                batch.append(raw)
-                if len(batch) == 25:
-                    self.client.batch_write_item(RequestItems={table_name: batch})
-                    batch = []
+            self.batch_write_requests(table_name, raws)
 
-            if len(batch) > 0:
-                self.client.batch_write_item(RequestItems={table_name: batch})
+    @tracer.capture_method
+    def batch_write_requests(self, table: str, requests: List[Dict[str, Any]]):
+        for i in range(0, len(requests), BATCH_WRITE_SIZE):
+            request_items = {table: requests[i:i + BATCH_WRITE_SIZE]}
+            retries = 0
+            while request_items:
+                resp = self.client.batch_write_item(RequestItems=request_items)
+                request_items = resp.get('UnprocessedItems')
+                if not request_items:
+                    break
+                if retries >= BATCH_WRITE_MAX_RETRIES:
+                    raise Exception(f'table {table} batch write failed, unprocessed items: {request_items}')
+                # exponential backoff as recommended for throttled batch writes
+                time.sleep(min(0.05 * (2 ** retries), 2))
+                retries += 1
 
     def update_item(self, table: str, key: Dict[str, Any], field_name: str, value: Any):
         search_keys = self._serialize(key)
@@ -169,6 +187,118 @@ class DynamoDbUtilsService:
             self.logger.error(f'table {table} keys_values: {key_values}')
             raise Exception(f'table {table} get_item failed with keys_values: {key_values}, e: {e}')
 
+    def iter_query(self, table: str, key_values: Dict[str, Any], filters: Dict[str, Any] = None,
+                   projection: List[str] = None, index_name: str = None, page_size: int = None,
+                   scan_forward: bool = True, exclusive_start_key: Dict[str, Any] = None) -> Iterator[Dict[str, Any]]:
+        """
+        Yields deserialized rows of a query page by page, so memory stays bounded by one page.
+        """
+        key_expressions, expression_values = self._get_ddb_filter(key_values)
+        kwargs = {
+            'TableName': table,
+            'KeyConditionExpression': key_expressions,
+            'ScanIndexForward': scan_forward,
+        }
+        if index_name:
+            kwargs['IndexName'] = index_name
+        if filters:
+            filter_expressions, filter_expression_values = self._get_ddb_filter(filters)
+            expression_values.update(filter_expression_values)
+            kwargs['FilterExpression'] = filter_expressions
+        kwargs['ExpressionAttributeValues'] = expression_values
+        self._set_projection(kwargs, projection)
+        if page_size:
+            kwargs['Limit'] = page_size
+        if exclusive_start_key:
+            kwargs['ExclusiveStartKey'] = self._serialize(exclusive_start_key)
+
+        for page in self._paginate(self.client.query, kwargs):
+            for item in page:
+                yield self.deserialize(item)
+
+    def iter_scan(self, table: str, filters: Dict[str, Any] = None, projection: List[str] = None,
+                  page_size: int = None, segments: int = 1) -> Iterator[Dict[str, Any]]:
+        """
+        Yields deserialized rows of a scan page by page. With segments > 1 the table is read
+        as a parallel scan (Segment/TotalSegments) on a thread pool; rows then come back in
+        no particular order.
+        """
+        kwargs = {'TableName': table}
+        if filters:
+            filter_expressions, expression_values = self._get_ddb_filter(filters)
+            kwargs['FilterExpression'] = filter_expressions
+            kwargs['ExpressionAttributeValues'] = expression_values
+        self._set_projection(kwargs, projection)
+        if page_size:
+            kwargs['Limit'] = page_size
+
+        if segments > 1:
+            pages = self._parallel_scan(kwargs, segments)
+        else:
+            pages = self._paginate(self.client.scan, kwargs)
+
+        for page in pages:
+            for item in page:
+                yield self.deserialize(item)
+
+    @staticmethod
+    def _set_projection(kwargs: Dict[str, Any], projection: List[str] = None):
+        if not projection:
+            return
+        names = {f'#p{i}': name for i, name in enumerate(projection)}
+        kwargs['ProjectionExpression'] = ', '.join(names.keys())
+        kwargs['ExpressionAttributeNames'] = names
+
+    @staticmethod
+    def _paginate(operation, kwargs: Dict[str, Any]):
+        resp = operation(**kwargs)
+        yield resp.get('Items', [])
+        while 'LastEvaluatedKey' in resp:
+            resp = operation(**{**kwargs, 'ExclusiveStartKey': resp['LastEvaluatedKey']})
+            yield resp.get('Items', [])
+
+    def _parallel_scan(self, kwargs: Dict[str, Any], segments: int):
+        pages = queue.Queue(maxsize=segments * SEGMENT_QUEUE_PAGES)
+        stop = threading.Event()
+        finished = object()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    pages.put(item, timeout=0.1)
+                    return
+                except queue.Full:
+                    continue
+
+        def scan_segment(segment: int):
+            try:
+                for page in self._paginate(self.client.scan, {**kwargs, 'Segment': segment,
+                                                              'TotalSegments': segments}):
+                    if stop.is_set():
+                        return
+                    put(page)
+            except Exception as e:
+                put(e)
+            finally:
+                put(finished)
+
+        workers = [threading.Thread(target=scan_segment, args=(segment,), daemon=True) for segment in range(segments)]
+        for worker in workers:
+            worker.start()
+
+        try:
+            running = segments
+            while running > 0:
+                page = pages.get()
+                if page is finished:
+                    running -= 1
+                elif isinstance(page, Exception):
+                    raise Exception(f"table {kwargs['TableName']} parallel scan failed: {page}")
+                else:
+                    yield page
+        finally:
+            stop.set()
+
     def _get_ddb_filter(self, filters: Dict[str, Any]):
         prepare_filter_expressions = []
         prefix = ':'
@@ -313,8 +443,6 @@ class DynamoDbUtilsService:
 
     @staticmethod
     def deserialize(rows: dict[str, dict[str, Any]]) -> dict[str, Any]:
-        boto3.resource('dynamodb')
         # To go from low-level format to python
-        deserializer = boto3.dynamodb.types.TypeDeserializer()
         python_data = {k: deserializer.deserialize(v) for k, v in rows.items()}
         return python_data
@@ -41,3 +41,153 @@
 #                                value='CERT_ISSUED')
 #
 #         # self.fail()
+
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+
+from common.ddb_service import client as ddb_client_module
+from common.ddb_service.client import DynamoDbUtilsService
+
+
+def put_request(i):
+    return {'PutRequest': {'Item': {'id': {'S': str(i)}}}}
+
+
+class BatchWriteRequestsTest(TestCase):
+
+    def setUp(self):
+        self.service = DynamoDbUtilsService()
+        self.service.client = MagicMock()
+        self.service.client.batch_write_item.return_value = {'UnprocessedItems': {}}
+
+    def test_requests_are_chunked_by_25(self):
+        self.service.batch_write_requests('table', [put_request(i) for i in range(60)])
+
+        chunks = [call.kwargs['RequestItems']['table'] for call in self.service.client.batch_write_item.call_args_list]
+        self.assertEqual([len(chunk) for chunk in chunks], [25, 25, 10])
+        self.assertEqual(chunks[2][-1], put_request(59))
+
+    @patch.object(ddb_client_module.time, 'sleep')
+    def test_unprocessed_items_are_retried(self, sleep):
+        unprocessed = {'table': [put_request(3)]}
+        self.service.client.batch_write_item.side_effect = [
+            {'UnprocessedItems': unprocessed},
+            {'UnprocessedItems': unprocessed},
+            {'UnprocessedItems': {}},
+        ]
+
+        self.service.batch_write_requests('table', [put_request(i) for i in range(5)])
+
+        calls = self.service.client.batch_write_item.call_args_list
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(calls[1].kwargs['RequestItems'], unprocessed)
+        self.assertEqual(calls[2].kwargs['RequestItems'], unprocessed)
+        # exponential backoff between the retries
+        self.assertEqual([call.args[0] for call in sleep.call_args_list], [0.05, 0.1])
+
+    @patch.object(ddb_client_module.time, 'sleep')
+    def test_gives_up_after_max_retries(self, sleep):
+        self.service.client.batch_write_item.return_value = {'UnprocessedItems': {'table': [put_request(0)]}}
+
+        with self.assertRaises(Exception):
+            self.service.batch_write_requests('table', [put_request(0)])
+
+        self.assertEqual(self.service.client.batch_write_item.call_count, ddb_client_module.BATCH_WRITE_MAX_RETRIES + 1)
+        self.assertEqual(sleep.call_count, ddb_client_module.BATCH_WRITE_MAX_RETRIES)
+
+    def test_batch_put_items_serializes_items(self):
+        self.service.batch_put_items({'table': [{'id': '1', 'count': 2}]})
+
+        request = self.service.client.batch_write_item.call_args.kwargs['RequestItems']['table'][0]
+        self.assertEqual(request, {'PutRequest': {'Item': {'id': {'S': '1'}, 'count': {'N': '2'}}}})
+
+
+def scan_pages(segment_rows, page_size):
+    """Fake scan/query over {segment: [ids]}, paging with LastEvaluatedKey."""
+
+    def operation(**kwargs):
+        rows = segment_rows[kwargs.get('Segment', 0)]
+        start = int(kwargs['ExclusiveStartKey']['id']['N']) if 'ExclusiveStartKey' in kwargs else 0
+        page = rows[start:start + page_size]
+        resp = {'Items': [{'id': {'S': row}} for row in page]}
+        if start + page_size < len(rows):
+            resp['LastEvaluatedKey'] = {'id': {'N': str(start + page_size)}}
+        return resp
+
+    return operation
+
+
+class IterQueryScanTest(TestCase):
+
+    def setUp(self):
+        self.service = DynamoDbUtilsService()
+        self.service.client = MagicMock()
+
+    def test_iter_query_follows_last_evaluated_key(self):
+        self.service.client.query.side_effect = scan_pages({0: [f'row-{i}' for i in range(7)]}, 3)
+
+        rows = list(self.service.iter_query('table', key_values={'taskType': 'txt2img'},
+                                            projection=['id', 'status'], index_name='index', page_size=3,
+                                            scan_forward=False))
+
+        self.assertEqual([row['id'] for row in rows], [f'row-{i}' for i in range(7)])
+        first = self.service.client.query.call_args_list[0].kwargs
+        self.assertEqual(first['IndexName'], 'index')
+        self.assertFalse(first['ScanIndexForward'])
+        self.assertEqual(first['Limit'], 3)
+        self.assertEqual(first['ProjectionExpression'], '#p0, #p1')
+        self.assertEqual(first['ExpressionAttributeNames'], {'#p0': 'id', '#p1': 'status'})
+        self.assertEqual(self.service.client.query.call_count, 3)
+
+    def test_iter_query_is_lazy(self):
+        self.service.client.query.side_effect = scan_pages({0: [f'row-{i}' for i in range(10)]}, 2)
+
+        rows = self.service.iter_query('table', key_values={'taskType': 'txt2img'}, page_size=2)
+        self.assertEqual(next(rows)['id'], 'row-0')
+        self.assertEqual(self.service.client.query.call_count, 1)
+
+    def test_iter_scan_single_segment(self):
+        self.service.client.scan.side_effect = scan_pages({0: [f'row-{i}' for i in range(5)]}, 2)
+
+        rows = list(self.service.iter_scan('table', filters={'status': 'succeed'}, page_size=2))
+
+        self.assertEqual([row['id'] for row in rows], [f'row-{i}' for i in range(5)])
+        first = self.service.client.scan.call_args_list[0].kwargs
+        self.assertNotIn('Segment', first)
+        self.assertIn('FilterExpression', first)
+
+    def test_iter_scan_parallel_segments_read_every_row(self):
+        segment_rows = {segment: [f'{segment}-{i}' for i in range(11)] for segment in range(4)}
+        self.service.client.scan.side_effect = scan_pages(segment_rows, 3)
+
+        rows = list(self.service.iter_scan('table', page_size=3, segments=4))
+
+        self.assertEqual(sorted(row['id'] for row in rows), sorted(sum(segment_rows.values(), [])))
+        segments = {call.kwargs['Segment'] for call in self.service.client.scan.call_args_list}
+        self.assertEqual(segments, {0, 1, 2, 3})
+        self.assertTrue(all(call.kwargs['TotalSegments'] == 4 for call in self.service.client.scan.call_args_list))
+
+    def test_iter_scan_parallel_segment_error_is_raised(self):
+        fake_scan = scan_pages({0: ['0-0'], 1: ['1-0']}, 1)
+
+        def scan(**kwargs):
+            if kwargs['Segment'] == 1:
+                raise Exception('ProvisionedThroughputExceededException')
+            return fake_scan(**kwargs)
+
+        self.service.client.scan.side_effect = scan
+
+        with self.assertRaises(Exception):
+            list(self.service.iter_scan('table', segments=2))
+
+    def test_iter_scan_parallel_stops_early(self):
+        segment_rows = {segment: [f'{segment}-{i}' for i in range(100)] for segment in range(2)}
+        self.service.client.scan.side_effect = scan_pages(segment_rows, 1)
+
+        rows = self.service.iter_scan('table', page_size=1, segments=2)
+        first = [next(rows)['id'] for _ in range(3)]
+        rows.close()
+
+        self.assertEqual(len(first), 3)
+        # the workers stop once the reader is gone instead of scanning the whole table
+        self.assertLess(self.service.client.scan.call_count, 200)
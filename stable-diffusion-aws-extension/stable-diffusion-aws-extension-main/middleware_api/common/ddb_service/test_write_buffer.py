@@ -0,0 +1,86 @@
+from unittest import TestCase
+from unittest.mock import MagicMock
+
+from common.ddb_service.write_buffer import ItemUpdateBuffer
+
+
+class ItemUpdateBufferTest(TestCase):
+
+    def setUp(self):
+        self.table = MagicMock()
+
+    def test_coalesces_changes_into_one_update_per_item(self):
+        with ItemUpdateBuffer(self.table, 'InferenceJobId') as updates:
+            updates.set('job-1', 'status', 'succeed')
+            updates.set('job-1', 'completeTime', '2024-01-01')
+            updates.append('job-1', 'image_names', ['image_0.png'])
+            updates.append('job-1', 'image_names', ['image_1.png'])
+            updates.set('job-2', 'status', 'failed')
+            self.table.update_item.assert_not_called()
+
+        self.assertEqual(self.table.update_item.call_count, 2)
+        job_1 = self.table.update_item.call_args_list[0].kwargs
+        self.assertEqual(job_1['Key'], {'InferenceJobId': 'job-1'})
+        self.assertEqual(job_1['UpdateExpression'],
+                         'SET #s0 = :s0, #s1 = :s1, #a0 = list_append(if_not_exists(#a0, :empty_list), :a0)')
+        self.assertEqual(job_1['ExpressionAttributeNames'],
+                         {'#s0': 'status', '#s1': 'completeTime', '#a0': 'image_names'})
+        self.assertEqual(job_1['ExpressionAttributeValues'],
+                         {':s0': 'succeed', ':s1': '2024-01-01', ':a0': ['image_0.png', 'image_1.png'],
+                          ':empty_list': []})
+        self.assertEqual(job_1['ConditionExpression'], 'attribute_exists(InferenceJobId)')
+        self.assertEqual(self.table.update_item.call_args_list[1].kwargs['Key'], {'InferenceJobId': 'job-2'})
+
+    def test_last_set_of_a_field_wins(self):
+        with ItemUpdateBuffer(self.table, 'prompt_id') as updates:
+            updates.set('prompt-1', 'status', 'running')
+            updates.set('prompt-1', 'status', 'success')
+
+        values = self.table.update_item.call_args.kwargs['ExpressionAttributeValues']
+        self.assertEqual(values, {':s0': 'success'})
+
+    def test_flush_one_key_keeps_the_others(self):
+        updates = ItemUpdateBuffer(self.table, 'prompt_id')
+        updates.set('prompt-1', 'status', 'success')
+        updates.set('prompt-2', 'status', 'failed')
+
+        updates.flush('prompt-1')
+        self.assertEqual(self.table.update_item.call_count, 1)
+        self.assertEqual(self.table.update_item.call_args.kwargs['Key'], {'prompt_id': 'prompt-1'})
+
+        updates.flush()
+        self.assertEqual(self.table.update_item.call_count, 2)
+        self.assertEqual(self.table.update_item.call_args.kwargs['Key'], {'prompt_id': 'prompt-2'})
+
+        updates.flush()
+        self.assertEqual(self.table.update_item.call_count, 2)
+
+    def test_empty_appends_are_not_written(self):
+        with ItemUpdateBuffer(self.table, 'prompt_id') as updates:
+            updates.append('prompt-1', 'output_files', [])
+
+        self.table.update_item.assert_not_called()
+
+    def test_update_error_is_raised(self):
+        self.table.update_item.side_effect = Exception('ConditionalCheckFailedException')
+        updates = ItemUpdateBuffer(self.table, 'prompt_id')
+        updates.set('prompt-1', 'status', 'success')
+
+        with self.assertRaises(Exception):
+            updates.flush()
+
+    def test_changes_are_written_when_the_block_raises(self):
+        with self.assertRaises(ValueError):
+            with ItemUpdateBuffer(self.table, 'InferenceJobId') as updates:
+                updates.set('job-1', 'status', 'failed')
+                raise ValueError('parse error')
+
+        self.assertEqual(self.table.update_item.call_args.kwargs['ExpressionAttributeValues'], {':s0': 'failed'})
+
+    def test_update_error_does_not_mask_the_error_of_the_block(self):
+        self.table.update_item.side_effect = Exception('ConditionalCheckFailedException')
+
+        with self.assertRaises(ValueError):
+            with ItemUpdateBuffer(self.table, 'InferenceJobId') as updates:
+                updates.set('job-1', 'status', 'failed')
+                raise ValueError('parse error')
@@ -0,0 +1,83 @@
+import logging
+from typing import Any, Dict, List
+
+
+class ItemUpdateBuffer:
+    """
+    Collects attribute changes for items of one table and writes each item with a single
+    UpdateItem call, instead of one call per attribute.
+
+    Usage:
+        with ItemUpdateBuffer(inference_table, 'InferenceJobId') as updates:
+            updates.set(inference_id, 'status', 'succeed')
+            updates.append(inference_id, 'image_names', ['image_0.png'])
+    """
+
+    def __init__(self, table, key_name: str, logger=None):
+        # table is a boto3 resource Table, as used by the callers
+        self.table = table
+        self.key_name = key_name
+        self.logger = logger or logging.getLogger('boto3')
+        self._sets: Dict[str, Dict[str, Any]] = {}
+        self._appends: Dict[str, Dict[str, List[Any]]] = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.flush()
+            return
+        # changes made before the error, like a failed status, are still written,
+        # but an error of that write must not replace the one raised in the block
+        try:
+            self.flush()
+        except Exception as e:
+            self.logger.error(f"Update {self.key_name} after {exc_type.__name__} error: {e}")
+
+    def set(self, key_value: str, field: str, value: Any):
+        self._sets.setdefault(key_value, {})[field] = value
+
+    def append(self, key_value: str, field: str, values: List[Any]):
+        if not values:
+            return
+        self._appends.setdefault(key_value, {}).setdefault(field, []).extend(values)
+
+    def flush(self, key_value: str = None):
+        keys = [key_value] if key_value else list(dict.fromkeys([*self._sets, *self._appends]))
+        for key in keys:
+            sets = self._sets.pop(key, {})
+            appends = self._appends.pop(key, {})
+            if sets or appends:
+                self._update_item(key, sets, appends)
+
+    def _update_item(self, key_value: str, sets: Dict[str, Any], appends: Dict[str, List[Any]]):
+        expressions = []
+        names = {}
+        values = {}
+
+        for i, (field, value) in enumerate(sets.items()):
+            names[f'#s{i}'] = field
+            values[f':s{i}'] = value
+            expressions.append(f'#s{i} = :s{i}')
+
+        for i, (field, items) in enumerate(appends.items()):
+            names[f'#a{i}'] = field
+            values[f':a{i}'] = items
+            expressions.append(f'#a{i} = list_append(if_not_exists(#a{i}, :empty_list), :a{i})')
+        if appends:
+            values[':empty_list'] = []
+
+        self.logger.info(f"Update {self.key_name}: {key_value}, set: {sets}, append: {appends}")
+        try:
+            self.table.update_item(
+                Key={self.key_name: key_value},
+                UpdateExpression='SET ' + ', '.join(expressions),
+                ExpressionAttributeNames=names,
+                ExpressionAttributeValues=values,
+                ConditionExpression=f"attribute_exists({self.key_name})",
+                ReturnValues="NONE"
+            )
+        except Exception as e:
+            self.logger.error(f"Update {self.key_name}: {key_value} error: {e}")
+            raise e
@@ -4,9 +4,11 @@ import enum
 import json
 import logging
 import os
+import time
+from collections import OrderedDict
 from functools import reduce
 from io import BytesIO
-from typing import Dict
+from typing import Dict, List
 
 import boto3
 import numpy
@@ -37,6 +39,11 @@ sagemaker_endpoint_table = os.environ.get('ENDPOINT_TABLE_NAME')
 esd_version = os.environ.get("ESD_VERSION")
 logs = boto3.client('logs')
 
+# presigned urls are reused across warm invocations until they get close to expiring
+PRESIGNED_URL_CACHE_SIZE = 10000
+PRESIGNED_URL_REFRESH_MARGIN = 300
+presigned_url_cache = OrderedDict()
+
 
 def record_count_metrics(ep_name: str,
                          metric_name='InferenceSucceed',
@@ -416,14 +423,17 @@ def s3_scan_files(job: InferenceResult):
     if job.status == 'fail':
         job.status = "failed"
 
+    # files reported by the worker are trusted, the bucket is only listed when they are missing
     if job.output_path:
-        job.output_files = s3_scan_files_in_patch(job.output_path)
+        if job.output_files is None:
+            job.output_files = s3_scan_files_in_patch(job.output_path)
     else:
         job.output_files = []
         job.output_path = ''
 
     if job.temp_path:
-        job.temp_files = s3_scan_files_in_patch(job.temp_path)
+        if job.temp_files is None:
+            job.temp_files = s3_scan_files_in_patch(job.temp_path)
     else:
         job.temp_files = []
         job.temp_path = ''
@@ -446,26 +456,39 @@ def s3_scan_files_in_patch(patch: str):
 def generate_presigned_url_for_key(key, expiration=3600):
     key = key.replace(f"s3://{bucket_name}/", '')
 
-    return s3.generate_presigned_url(
+    now = time.time()
+    cached = presigned_url_cache.get((key, expiration))
+    if cached and cached[1] - PRESIGNED_URL_REFRESH_MARGIN > now:
+        presigned_url_cache.move_to_end((key, expiration))
+        return cached[0]
+
+    url = s3.generate_presigned_url(
         'get_object',
         Params={'Bucket': bucket_name, 'Key': key},
         ExpiresIn=expiration
     )
 
+    presigned_url_cache[(key, expiration)] = (url, now + expiration)
+    if len(presigned_url_cache) > PRESIGNED_URL_CACHE_SIZE:
+        presigned_url_cache.popitem(last=False)
+
+    return url
+
+
+@tracer.capture_method
+def generate_presigned_urls(keys: List[str], expiration=3600) -> List[str]:
+    # signing is local, the shared client keeps its signer and credentials for every key
+    return [generate_presigned_url_for_key(key, expiration) for key in keys]
+
 
 @tracer.capture_method
 def generate_presigned_url_for_keys(prefix, keys, expiration=3600):
     if not prefix or not keys:
         return []
 
-    new_list = []
-
     prefix = prefix.replace(f"s3://{bucket_name}/", '')
 
-    for key in keys:
-        new_list.append(generate_presigned_url_for_key(f"{prefix}{key}", expiration))
-
-    return new_list
+    return generate_presigned_urls([f"{prefix}{key}" for key in keys], expiration)
 
 
 @tracer.capture_method
@@ -0,0 +1,15 @@
+import os
+
+# the lambda modules read their settings and table names from the environment at import time
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.setdefault('ESD_VERSION', 'v1.5.0-test')
+os.environ.setdefault('URL_SUFFIX', 'amazonaws.com')
+os.environ.setdefault('S3_BUCKET_NAME', 'test-bucket')
+os.environ.setdefault('ENDPOINT_TABLE_NAME', 'SDEndpointDeploymentJobTable')
+os.environ.setdefault('MULTI_USER_TABLE', 'MultiUserTable')
+os.environ.setdefault('CHECKPOINT_TABLE', 'CheckpointTable')
+os.environ.setdefault('MSG_TABLE', 'ComfyMessageTable')
+# set by the lambda runtime, the responses link to them for debugging
+os.environ.setdefault('AWS_LAMBDA_FUNCTION_NAME', 'test-function')
+os.environ.setdefault('AWS_LAMBDA_LOG_GROUP_NAME', '/aws/lambda/test-function')
+os.environ.setdefault('AWS_LAMBDA_LOG_STREAM_NAME', 'test-stream')
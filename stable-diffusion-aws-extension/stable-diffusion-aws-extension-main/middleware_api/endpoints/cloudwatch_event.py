@@ -42,11 +42,9 @@ def handler(event, context):
             clean_ds()
             return {}
 
-    eps = ddb_service.scan(sagemaker_endpoint_table)
-    logger.info(f"Endpoints: {eps}")
-
-    for ep in eps:
-        ep_name = ep['endpoint_name']['S']
+    for ep in ddb_service.iter_scan(sagemaker_endpoint_table, projection=['endpoint_name']):
+        ep_name = ep['endpoint_name']
+        logger.info(f"Endpoint: {ep_name}")
         ep = get_endpoint_by_name(ep_name)
 
         if ep.endpoint_status == 'Creating':
@@ -60,6 +60,8 @@ class CreateEndpointEvent:
     service_type: str = "sd"
     workflow: Optional[Workflow] = None
     workflow_name: str = ""
+    # the worker writes result images to S3 itself and returns only their keys
+    output_images_to_s3: bool = False
     # todo will be removed
     creator: str = ""
 
@@ -216,6 +218,7 @@ def handler(raw_event, ctx):
             max_instance_number=event.max_instance_number,
             custom_extensions=event.custom_extensions,
             service_type=event.service_type,
+            output_images_to_s3=event.output_images_to_s3,
         ).__dict__
 
         ddb_service.put_items(table=sagemaker_endpoint_table, entries=data)
@@ -253,6 +256,7 @@ def _create_sagemaker_model(name, model_data_url, endpoint_name, endpoint_id, ev
         'ESD_COMMIT_ID': esd_commit_id,
         'SERVICE_TYPE': event.service_type,
         'ON_SAGEMAKER': 'true',
+        'OUTPUT_IMAGES_TO_S3': 'true' if event.output_images_to_s3 else 'false',
         'AWS_REGION': aws_region,
         'AWS_DEFAULT_REGION': aws_region,
     }
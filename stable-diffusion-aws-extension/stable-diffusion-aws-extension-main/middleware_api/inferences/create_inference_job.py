@@ -2,7 +2,6 @@ import dataclasses
 import json
 import logging
 import os
-import random
 from datetime import datetime
 from typing import List, Any, Optional
 
@@ -17,6 +16,7 @@ from libs.data_types import CheckPoint, CheckPointStatus
 from libs.data_types import InferenceJob, Endpoint
 from libs.enums import EndpointStatus
 from libs.utils import get_user_roles, check_user_permissions, permissions_check, response_error, log_json
+from endpoint_affinity import pick_warm_endpoint
 from start_inference_job import inference_start
 
 tracer = Tracer()
@@ -43,6 +43,8 @@ class CreateInferenceEvent:
     user_id: Optional[str] = ""
     payload_string: Optional[str] = None
     workflow: Optional[str] = None
+    # None leaves it to the OUTPUT_IMAGES_TO_S3 setting of the endpoint
+    output_to_s3: Optional[bool] = None
 
 
 # POST /inferences
@@ -74,7 +76,8 @@ def handler(raw_event: dict, context: LambdaContext):
         # check if endpoint table for endpoint status and existence
         ep = _schedule_inference_endpoint(event.sagemaker_endpoint_name,
                                           event.inference_type,
-                                          username)
+                                          username,
+                                          event.models)
 
         if event.workflow:
             event.workflow = get_workflow_name(event.workflow, ep.instance_type)
@@ -100,6 +103,7 @@ def handler(raw_event: dict, context: LambdaContext):
                 'sagemaker_inference_endpoint_id': ep.EndpointDeploymentJobId,
                 'sagemaker_inference_instance_type': ep.instance_type,
                 'sagemaker_inference_endpoint_name': ep.endpoint_name,
+                'output_to_s3': event.output_to_s3,
             },
         )
         resp = {
@@ -204,7 +208,7 @@ def get_base_inference_param_s3_key(_type: str, request_id: str) -> str:
 
 # currently only two scheduling ways: by endpoint name and by user
 @tracer.capture_method
-def _schedule_inference_endpoint(endpoint_name, inference_type, user_id):
+def _schedule_inference_endpoint(endpoint_name, inference_type, user_id, models=None):
     tracer.put_annotation('endpoint_name', endpoint_name)
     # fixme: endpoint is not indexed by name, and this is very expensive query
     # fixme: we can either add index for endpoint name or make endpoint as the partition key
@@ -241,4 +245,6 @@ def _schedule_inference_endpoint(endpoint_name, inference_type, user_id):
 
         log_json('available_endpoints', available_endpoints)
 
-        return random.choice(available_endpoints)
+        # prefer the endpoints that have the checkpoint of the job warm
+        checkpoints = (models or {}).get('Stable-diffusion') or []
+        return pick_warm_endpoint(available_endpoints, checkpoints[0] if checkpoints else None)
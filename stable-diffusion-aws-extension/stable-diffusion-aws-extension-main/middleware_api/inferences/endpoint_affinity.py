@@ -0,0 +1,66 @@
+import logging
+import os
+import random
+from datetime import datetime, timedelta
+
+from common.ddb_service.client import DynamoDbUtilsService
+from libs.data_types import Endpoint
+
+instance_monitor_table = os.environ.get('INSTANCE_MONITOR_TABLE')
+# records of instances that stopped refreshing them for this long are ignored, the instance is gone
+INSTANCE_MODELS_TTL_SECONDS = int(os.environ.get('INSTANCE_MODELS_TTL_SECONDS', 300))
+
+logger = logging.getLogger(__name__)
+logger.setLevel(os.environ.get('LOG_LEVEL') or logging.ERROR)
+
+ddb_service = DynamoDbUtilsService(logger=logger)
+
+
+def instance_models(endpoint_name: str):
+    """
+    Returns the checkpoints loaded on and cached by the live instances of an endpoint, as the
+    SD workers record them in the instance monitor table.
+    """
+    loaded, cached = set(), set()
+    if not instance_monitor_table:
+        return loaded, cached
+
+    since = (datetime.utcnow() - timedelta(seconds=INSTANCE_MODELS_TTL_SECONDS)).isoformat()
+    rows = ddb_service.iter_query(table=instance_monitor_table,
+                                  key_values={'endpoint_name': endpoint_name},
+                                  projection=['loaded_models', 'cached_models', 'last_heartbeat_time'])
+    for row in rows:
+        # the timestamps are ISO strings of the same format, so they compare as strings
+        if (row.get('last_heartbeat_time') or '') < since:
+            continue
+        loaded.update(row.get('loaded_models') or [])
+        cached.update(row.get('cached_models') or [])
+    return loaded, cached
+
+
+def pick_warm_endpoint(endpoints: [Endpoint], checkpoint: str = None) -> Endpoint:
+    """
+    SageMaker spreads the requests of one endpoint over its instances, so checkpoint affinity
+    is applied when the endpoint of a job is chosen: one with an instance that has the
+    checkpoint loaded first, then one that has it on local disk, then any, at random within
+    each tier.
+    """
+    if checkpoint and len(endpoints) > 1:
+        loaded_on, cached_on = [], []
+        for endpoint in endpoints:
+            try:
+                loaded, cached = instance_models(endpoint.endpoint_name)
+            except Exception as e:
+                logger.error(f"read instance models of {endpoint.endpoint_name} error: {e}")
+                continue
+            if checkpoint in loaded:
+                loaded_on.append(endpoint)
+            elif checkpoint in cached:
+                cached_on.append(endpoint)
+
+        for tier in [loaded_on, cached_on]:
+            if tier:
+                logger.info(f"{checkpoint} is warm on {[endpoint.endpoint_name for endpoint in tier]}")
+                return random.choice(tier)
+
+    return random.choice(endpoints)
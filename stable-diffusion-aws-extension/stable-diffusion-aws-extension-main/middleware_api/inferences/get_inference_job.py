@@ -1,11 +1,13 @@
 import json
 import logging
 import os
+import time
 
 import boto3
 from aws_lambda_powertools import Tracer
 
 from common.response import ok, not_found
+from common.util import get_query_param, generate_presigned_urls
 from libs.utils import response_error, log_json
 
 tracer = Tracer()
@@ -16,8 +18,11 @@ logger.setLevel(os.environ.get('LOG_LEVEL') or logging.ERROR)
 dynamodb = boto3.resource('dynamodb')
 inference_job_table = dynamodb.Table(os.environ.get('INFERENCE_JOB_TABLE'))
 
-s3_bucket_name = os.environ.get('S3_BUCKET_NAME')
-s3 = boto3.client('s3')
+# API Gateway gives up on an integration after 29 seconds
+LONG_POLL_MAX_SECONDS = 25
+LONG_POLL_INTERVAL = 0.25
+LONG_POLL_MAX_INTERVAL = 2
+PENDING_STATUSES = ['created', 'inprogress']
 
 
 @tracer.capture_lambda_handler
@@ -26,52 +31,55 @@ def handler(event, ctx):
         logger.info(json.dumps(event))
 
         inference_id = event['pathParameters']['id']
+        # GET /inferences/{id}?wait=20 holds the request until the job is done or the time is up
+        wait = min(float(get_query_param(event, 'wait', 0)), LONG_POLL_MAX_SECONDS)
 
-        return get_infer_data(inference_id)
+        return get_infer_data(inference_id, wait, ctx)
     except Exception as e:
         return response_error(e)
 
 
 @tracer.capture_method
-def get_infer_data(inference_id: str):
-    inference = inference_job_table.get_item(Key={'InferenceJobId': inference_id})
+def wait_for_item(inference_id: str, wait: float, ctx):
+    deadline = time.time() + wait
+    if ctx:
+        # leave a second to build the response
+        deadline = min(deadline, time.time() + ctx.get_remaining_time_in_millis() / 1000 - 1)
+    interval = LONG_POLL_INTERVAL
+    while True:
+        inference = inference_job_table.get_item(Key={'InferenceJobId': inference_id}, ConsistentRead=True)
+        item = inference.get('Item')
+        remaining = deadline - time.time()
+        if not item or item.get('status') not in PENDING_STATUSES or remaining <= 0:
+            return item
+        time.sleep(min(interval, remaining))
+        interval = min(interval * 2, LONG_POLL_MAX_INTERVAL)
 
-    if 'Item' not in inference:
-        return not_found(message=f'inference with id {inference_id} not found')
 
-    item = inference['Item']
+@tracer.capture_method
+def get_infer_data(inference_id: str, wait: float = 0, ctx=None):
+    if wait > 0:
+        item = wait_for_item(inference_id, wait, ctx)
+    else:
+        item = inference_job_table.get_item(Key={'InferenceJobId': inference_id}).get('Item')
+
+    if not item:
+        return not_found(message=f'inference with id {inference_id} not found')
 
     log_json("inference job", item)
 
-    img_presigned_urls = []
-    if 'image_names' in item:
-        for image_name in item['image_names']:
-            presigned_url = generate_presigned_url(s3_bucket_name, f"out/{inference_id}/result/{image_name}")
-            img_presigned_urls.append(presigned_url)
-    else:
+    if 'image_names' not in item:
         item['image_names'] = []
 
-    output_presigned_urls = generate_presigned_url(
-        s3_bucket_name,
-        f"out/{inference_id}/result/{inference_id}_param.json")
+    prefix = f"out/{inference_id}/result/"
+    presigned_urls = generate_presigned_urls([f"{prefix}{name}" for name in item['image_names']]
+                                             + [f"{prefix}{inference_id}_param.json"])
 
     data = {
-        "img_presigned_urls": img_presigned_urls,
-        "output_presigned_urls": [output_presigned_urls],
+        "img_presigned_urls": presigned_urls[:-1],
+        "output_presigned_urls": presigned_urls[-1:],
         **item,
     }
 
     return ok(data=data, decimal=True)
 
-
-def generate_presigned_url(bucket_name: str, key: str, expiration=3600) -> str:
-    try:
-        response = s3.generate_presigned_url('get_object',
-                                             Params={'Bucket': bucket_name, 'Key': key},
-                                             ExpiresIn=expiration
-                                             )
-    except Exception as e:
-        logger.error(f"Error generating presigned URL: {e}")
-        raise
-
-    return response
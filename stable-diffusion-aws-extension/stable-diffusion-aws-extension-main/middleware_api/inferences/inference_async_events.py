@@ -7,7 +7,7 @@ from aws_lambda_powertools import Tracer
 
 from common.sns_util import send_message_to_sns
 from common.util import record_latency_metrics, record_count_metrics
-from inference_libs import parse_sagemaker_result, get_bucket_and_key, get_inference_job
+from inference_libs import parse_sagemaker_result, get_bucket_and_key, get_inference_job, inference_job_updates
 from start_inference_job import update_inference_job_table
 
 tracer = Tracer()
@@ -43,8 +43,9 @@ def handler(event, context):
     endpoint_name = message["requestParameters"]["endpointName"]
 
     if invocation_status != "Completed":
-        update_inference_job_table(inference_id, 'status', 'failed')
-        update_inference_job_table(inference_id, 'sagemakerRaw', str(message))
+        with inference_job_updates() as job_updates:
+            job_updates.set(inference_id, 'status', 'failed')
+            job_updates.set(inference_id, 'sagemakerRaw', str(message))
         print(f"Not complete invocation!")
         send_message_to_sns(message, SNS_TOPIC)
         record_count_metrics(ep_name=endpoint_name,
@@ -3,12 +3,14 @@ import io
 import json
 import logging
 import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 import boto3
 from PIL import Image
 from aws_lambda_powertools import Tracer
 
+from common.ddb_service.write_buffer import ItemUpdateBuffer
 from common.util import upload_file_to_s3, record_queue_latency_metrics
 from libs.enums import ServiceType
 from libs.utils import log_json
@@ -24,48 +26,86 @@ ddb_client = boto3.resource('dynamodb')
 inference_table = ddb_client.Table('SDInferenceJobTable')
 
 S3_BUCKET_NAME = os.environ.get('S3_BUCKET_NAME')
+UPLOAD_WORKERS = int(os.environ.get('UPLOAD_WORKERS', 8))
 
+IMAGE_SIGNATURES = [
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+    (b'\xff\xd8\xff', 'jpeg'),
+]
 
-@tracer.capture_method
-def parse_sagemaker_result(sagemaker_out, create_time, inference_id, task_type, endpoint_name):
-    update_inference_job_table(inference_id, 'completeTime', datetime.now().isoformat())
 
-    try:
-        # maybe start_time is not in the response
-        record_queue_latency_metrics(create_time=create_time,
-                                     start_time=sagemaker_out['start_time'],
-                                     ep_name=endpoint_name,
-                                     service=ServiceType.SD.value)
-        if task_type in ["interrogate_clip", "interrogate_deepbooru"]:
-            interrogate_clip_interrogate_deepbooru(sagemaker_out, inference_id)
-        elif task_type in ["txt2img", "img2img"]:
-            txt2_img_img(sagemaker_out, inference_id, endpoint_name)
-        elif task_type in ["extra-single-image", "rembg"]:
-            esi_rembg(sagemaker_out, inference_id, endpoint_name)
-
-        update_inference_job_table(inference_id, 'status', 'succeed')
-    except Exception as e:
-        update_inference_job_table(inference_id, 'status', 'failed')
-        raise e
+def inference_job_updates():
+    return ItemUpdateBuffer(inference_table, 'InferenceJobId', logger=logger)
 
 
-def decode_base64_to_image(encoding):
+@tracer.capture_method
+def parse_sagemaker_result(sagemaker_out, create_time, inference_id, task_type, endpoint_name):
+    # all field changes of this job are written with a single update_item at the end
+    with inference_job_updates() as job_updates:
+        job_updates.set(inference_id, 'completeTime', datetime.now().isoformat())
+
+        try:
+            # maybe start_time is not in the response
+            record_queue_latency_metrics(create_time=create_time,
+                                         start_time=sagemaker_out['start_time'],
+                                         ep_name=endpoint_name,
+                                         service=ServiceType.SD.value)
+            if task_type in ["interrogate_clip", "interrogate_deepbooru"]:
+                interrogate_clip_interrogate_deepbooru(sagemaker_out, inference_id, job_updates)
+            elif task_type in ["txt2img", "img2img"]:
+                txt2_img_img(sagemaker_out, inference_id, endpoint_name, job_updates)
+            elif task_type in ["extra-single-image", "rembg"]:
+                esi_rembg(sagemaker_out, inference_id, endpoint_name, job_updates)
+
+            job_updates.set(inference_id, 'status', 'succeed')
+        except Exception as e:
+            job_updates.set(inference_id, 'status', 'failed')
+            raise e
+
+
+def decode_base64_to_bytes(encoding):
     if encoding.startswith("data:image/"):
         encoding = encoding.split(";")[1].split(",")[1]
-    return Image.open(io.BytesIO(base64.b64decode(encoding)))
+    return base64.b64decode(encoding)
 
 
-def update_ddb_image(inference_id: str, image_name: str):
-    inference_table.update_item(
-        Key={
-            'InferenceJobId': inference_id
-        },
-        UpdateExpression='SET image_names = list_append(if_not_exists(image_names, :empty_list), :new_image)',
-        ExpressionAttributeValues={
-            ':new_image': [image_name],
-            ':empty_list': []
-        }
-    )
+def image_format(data: bytes):
+    for signature, fmt in IMAGE_SIGNATURES:
+        if data.startswith(signature):
+            return fmt
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'webp'
+    return None
+
+
+def to_png(data: bytes):
+    # payloads that are already PNG are stored as they are, only other formats pay for a re-encode
+    if image_format(data) == 'png':
+        return data
+    output = io.BytesIO()
+    Image.open(io.BytesIO(data)).save(output, format="PNG")
+    return output.getvalue()
+
+
+def put_result_objects(inference_id, objects):
+    def put(item):
+        file_name, body = item
+        s3_client.put_object(
+            Body=body,
+            Bucket=S3_BUCKET_NAME,
+            Key=f"out/{inference_id}/result/{file_name}"
+        )
+
+    if len(objects) <= 1:
+        for item in objects:
+            put(item)
+        return
+
+    with ThreadPoolExecutor(max_workers=min(UPLOAD_WORKERS, len(objects))) as executor:
+        # list() surfaces the first upload error
+        list(executor.map(put, objects))
 
 
 def get_bucket_and_key(s3uri):
@@ -112,54 +152,51 @@ def update_table_by_pk(table_name: str, pk: str, id: str, key: str, value):
         raise e
 
 
-def esi_rembg(sagemaker_out, inference_id, endpoint_name):
+def esi_rembg(sagemaker_out, inference_id, endpoint_name, job_updates: ItemUpdateBuffer):
+    # the worker has already written the image to S3
+    if 'image_manifest' in sagemaker_out:
+        manifest_image_names(sagemaker_out, inference_id, endpoint_name, job_updates)
+        return
+
     if 'image' not in sagemaker_out:
         raise Exception(sagemaker_out)
 
-    image = Image.open(io.BytesIO(base64.b64decode(sagemaker_out["image"])))
-    output = io.BytesIO()
-    image.save(output, format="PNG")
     # Upload the image to the S3 bucket
-    s3_client.put_object(
-        Body=output.getvalue(),
-        Bucket=S3_BUCKET_NAME,
-        Key=f"out/{inference_id}/result/image.png"
-    )
+    put_result_objects(inference_id, [("image.png", to_png(base64.b64decode(sagemaker_out["image"])))])
+
+    job_updates.append(inference_id, 'image_names', ["image.png"])
+
+    save_inference_parameters(sagemaker_out, inference_id, endpoint_name)
+
 
-    update_ddb_image(inference_id, "image.png")
+def manifest_image_names(sagemaker_out, inference_id, endpoint_name, job_updates: ItemUpdateBuffer):
+    image_names = [image['key'] for image in sagemaker_out['image_manifest']]
+    job_updates.append(inference_id, 'image_names', image_names)
 
     save_inference_parameters(sagemaker_out, inference_id, endpoint_name)
 
 
-def interrogate_clip_interrogate_deepbooru(sagemaker_out, inference_id):
+def interrogate_clip_interrogate_deepbooru(sagemaker_out, inference_id, job_updates: ItemUpdateBuffer):
     caption = sagemaker_out['caption']
     # Update the DynamoDB table for the caption
-    inference_table.update_item(
-        Key={
-            'InferenceJobId': inference_id
-        },
-        UpdateExpression='SET caption=:f',
-        ExpressionAttributeValues={
-            ':f': caption,
-        }
-    )
-
-
-def txt2_img_img(sagemaker_out, inference_id, endpoint_name):
+    job_updates.set(inference_id, 'caption', caption)
+
+
+def txt2_img_img(sagemaker_out, inference_id, endpoint_name, job_updates: ItemUpdateBuffer):
+    # the worker has already written the images to S3
+    if 'image_manifest' in sagemaker_out:
+        manifest_image_names(sagemaker_out, inference_id, endpoint_name, job_updates)
+        return
+
+    image_names = []
+    objects = []
     for count, b64image in enumerate(sagemaker_out["images"]):
         output_img_type = None
         if 'output_img_type' in sagemaker_out and sagemaker_out['output_img_type']:
             output_img_type = sagemaker_out['output_img_type']
             logger.info(f"handle_sagemaker_out: output_img_type is not null, {output_img_type}")
         if not output_img_type:
-            image = decode_base64_to_image(b64image)
-            output = io.BytesIO()
-            image.save(output, format="PNG")
-            s3_client.put_object(
-                Body=output.getvalue(),
-                Bucket=S3_BUCKET_NAME,
-                Key=f"out/{inference_id}/result/image_{count}.png"
-            )
+            objects.append((f"image_{count}.png", to_png(decode_base64_to_bytes(b64image))))
         else:
             gif_data = base64.b64decode(b64image.split(",", 1)[0])
             if len(output_img_type) == 1 and (output_img_type[0] == 'PNG' or output_img_type[0] == 'TXT'):
@@ -180,13 +217,13 @@ def txt2_img_img(sagemaker_out, inference_id, endpoint_name):
                     idx = count % type_count
                     img_type = output_img_type[idx].lower()
             logger.debug(f'img_type is :{img_type} count is:{count}')
-            s3_client.put_object(
-                Body=gif_data,
-                Bucket=S3_BUCKET_NAME,
-                Key=f"out/{inference_id}/result/image_{count}.{img_type}"
-            )
+            objects.append((f"image_{count}.{img_type}", gif_data))
 
-        update_ddb_image(inference_id, f"image_{count}.png")
+        image_names.append(f"image_{count}.png")
+
+    put_result_objects(inference_id, objects)
+
+    job_updates.append(inference_id, 'image_names', image_names)
 
     save_inference_parameters(sagemaker_out, inference_id, endpoint_name)
 
@@ -204,6 +241,9 @@ def save_inference_parameters(sagemaker_out, inference_id, endpoint_name):
     if 'info' in sagemaker_out:
         inference_parameters["info"] = sagemaker_out["info"]
 
+    if 'image_manifest' in sagemaker_out:
+        inference_parameters["image_manifest"] = sagemaker_out["image_manifest"]
+
     inference_parameters["endpoint_name"] = endpoint_name
     inference_parameters["inference_id"] = inference_id
 
@@ -1,14 +1,13 @@
+import dataclasses
 import json
 import logging
 import os
 
-import boto3
 from aws_lambda_powertools import Tracer
-from boto3.dynamodb.conditions import Key
 
 from common.ddb_service.client import DynamoDbUtilsService
 from common.response import ok
-from common.util import get_query_param
+from common.util import get_multi_query_params, get_query_param
 from libs.data_types import InferenceJob
 from libs.utils import get_user_roles, check_user_permissions, decode_last_key, encode_last_key, response_error
 
@@ -22,16 +21,18 @@ logger.setLevel(os.environ.get('LOG_LEVEL') or logging.ERROR)
 
 ddb_service = DynamoDbUtilsService(logger=logger)
 
-ddb = boto3.resource('dynamodb')
-table = ddb.Table(inference_table_name)
+INFERENCE_TYPE_INDEX = 'taskType-createTime-index'
+# list rows carry only these, large attributes like payload_string are opt-in with fields=
+SUMMARY_FIELDS = ['InferenceJobId', 'status', 'taskType', 'owner_group_or_role', 'startTime', 'createTime',
+                  'completeTime', 'image_names', 'params', 'inference_type']
+INFERENCE_FIELDS = [field.name for field in dataclasses.fields(InferenceJob)]
 
 
-# GET /inferences?last_evaluated_key=xxx&limit=10
+# GET /inferences?exclusive_start_key=xxx&limit=10&fields=payload_string&fields=sagemakerRaw
 @tracer.capture_lambda_handler
 def handler(event, ctx):
     try:
         logger.info(json.dumps(event))
-        _filter = {}
 
         # todo compatibility with old version
         # permissions_check(event, [PERMISSION_INFERENCE_ALL])
@@ -40,67 +41,22 @@ def handler(event, ctx):
         exclusive_start_key = get_query_param(event, 'exclusive_start_key')
         inference_type = get_query_param(event, 'type', 'txt2img')
         limit = int(get_query_param(event, 'limit', 10))
+        fields = get_multi_query_params(event, 'fields', default=[])
 
-        scan_kwargs = {
-            'Limit': limit,
-            'IndexName': "taskType-createTime-index",
-            'KeyConditionExpression': Key('taskType').eq(inference_type),
-            "ScanIndexForward": False
-        }
-
-        if exclusive_start_key:
-            scan_kwargs['ExclusiveStartKey'] = decode_last_key(exclusive_start_key)
-
-        logger.info(scan_kwargs)
-
-        response = table.query(**scan_kwargs)
+        projection = SUMMARY_FIELDS + [field for field in fields
+                                       if field in INFERENCE_FIELDS and field not in SUMMARY_FIELDS]
 
-        logger.info(json.dumps(response, default=str))
-
-        items = response.get('Items', [])
-        last_evaluated_key = encode_last_key(response.get('LastEvaluatedKey'))
-
-        results = []
-        user_roles = []
+        is_permitted = None
         if username:
             user_roles = get_user_roles(ddb_service=ddb_service, user_table_name=user_table, username=username)
+            is_permitted = lambda row: check_user_permissions(row.get('owner_group_or_role'), user_roles, username)
 
-        for row in items:
-            inference = InferenceJob(**row)
-
-            if not inference.payload_string:
-                inference.payload_string = "{}"
-
-            if not inference.sagemakerRaw:
-                inference.sagemakerRaw = {}
-
-            if not inference.image_names:
-                inference.image_names = []
-
-            if username:
-                if check_user_permissions(inference.owner_group_or_role, user_roles, username):
-                    results.append(inference.__dict__)
-            else:
-                results.append({
-                    "InferenceJobId": inference.InferenceJobId,
-                    "status": inference.status,
-                    "taskType": inference.taskType,
-                    "owner_group_or_role": inference.owner_group_or_role,
-                    "startTime": inference.startTime,
-                    "createTime": inference.createTime,
-                    "image_names": inference.image_names,
-                    "sagemakerRaw": inference.sagemakerRaw,
-                    "completeTime": inference.completeTime,
-                    "params": inference.params,
-                    "inference_type": inference.inference_type,
-                    "payload_string": inference.payload_string,
-                })
-
-        results = sort_inferences(results)
+        results, last_key = query_inferences(inference_type, projection, is_permitted, limit,
+                                             decode_last_key(exclusive_start_key))
 
         data = {
             'inferences': results,
-            'last_evaluated_key': last_evaluated_key
+            'last_evaluated_key': encode_last_key(last_key)
         }
 
         return ok(data=data, decimal=True)
@@ -108,8 +64,43 @@ def handler(event, ctx):
         return response_error(e)
 
 
-def sort_inferences(data):
-    if len(data) == 0:
-        return data
-
-    return sorted(data, key=lambda x: x['createTime'], reverse=True)
+def query_inferences(inference_type: str, projection, is_permitted, limit: int, start_key):
+    """
+    Reads taskType-createTime-index newest first, in the order the index already keeps,
+    until limit permitted rows are collected, so filtering by permissions never returns
+    a short page while older rows are left.
+
+    The cursor is the index key of the last row returned; it is None once the index is
+    exhausted.
+    """
+    rows = ddb_service.iter_query(table=inference_table_name,
+                                  key_values={'taskType': inference_type},
+                                  projection=projection,
+                                  index_name=INFERENCE_TYPE_INDEX,
+                                  page_size=limit if limit > 0 else None,
+                                  scan_forward=False,
+                                  exclusive_start_key=start_key)
+
+    results = []
+    for row in rows:
+        if is_permitted and not is_permitted(row):
+            continue
+
+        for field in projection:
+            row.setdefault(field, None)
+        if not row['image_names']:
+            row['image_names'] = []
+        if 'payload_string' in row and not row['payload_string']:
+            row['payload_string'] = "{}"
+        if 'sagemakerRaw' in row and not row['sagemakerRaw']:
+            row['sagemakerRaw'] = {}
+        results.append(row)
+
+        if 0 < limit <= len(results):
+            return results, {
+                'InferenceJobId': row['InferenceJobId'],
+                'taskType': row['taskType'],
+                'createTime': row['createTime'],
+            }
+
+    return results, None
@@ -77,7 +77,8 @@ def inference_start(job: InferenceJob, username):
         username=username,
         models=models,
         param_s3=job.params['input_body_s3'],
-        payload_string=job.payload_string
+        payload_string=job.payload_string,
+        output_to_s3=job.params.get('output_to_s3'),
     )
 
     log_json("inference job", job.__dict__)
@@ -0,0 +1,78 @@
+from datetime import datetime, timedelta
+from unittest import TestCase
+from unittest.mock import patch
+
+from inferences import endpoint_affinity
+from libs.data_types import Endpoint
+
+
+def instance(endpoint_name, loaded, cached=(), age=0):
+    return {
+        'endpoint_name': endpoint_name,
+        'gen_instance_id': f'{endpoint_name}-{len(loaded)}-{len(cached)}',
+        'loaded_models': list(loaded),
+        'cached_models': list(cached),
+        'last_heartbeat_time': (datetime.utcnow() - timedelta(seconds=age)).isoformat(),
+    }
+
+
+class FakeInstanceMonitorTable:
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    def iter_query(self, table, key_values, filters=None, projection=None, index_name=None, page_size=None,
+                   scan_forward=True, exclusive_start_key=None):
+        for row in self.rows:
+            if row['endpoint_name'] == key_values['endpoint_name']:
+                yield dict(row)
+
+
+class PickWarmEndpointTest(TestCase):
+
+    def setUp(self):
+        self.rows = []
+        for target, value in [('ddb_service', FakeInstanceMonitorTable(self.rows)),
+                              ('instance_monitor_table', 'ComfyInstanceMonitorTable')]:
+            patcher = patch.object(endpoint_affinity, target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.endpoints = [Endpoint(EndpointDeploymentJobId=name, endpoint_name=name)
+                          for name in ['sd-async-a', 'sd-async-b', 'sd-async-c']]
+
+    def pick(self, checkpoint, times=20):
+        return {endpoint_affinity.pick_warm_endpoint(self.endpoints, checkpoint).endpoint_name for _ in range(times)}
+
+    def test_prefers_endpoint_with_checkpoint_loaded(self):
+        self.rows += [instance('sd-async-a', [], ['v1-5.safetensors']),
+                      instance('sd-async-b', ['v1-5.safetensors']),
+                      instance('sd-async-c', ['xl.safetensors'])]
+
+        self.assertEqual(self.pick('v1-5.safetensors'), {'sd-async-b'})
+
+    def test_falls_back_to_checkpoint_on_disk(self):
+        self.rows += [instance('sd-async-a', ['xl.safetensors'], ['v1-5.safetensors']),
+                      instance('sd-async-c', ['xl.safetensors'])]
+
+        self.assertEqual(self.pick('v1-5.safetensors'), {'sd-async-a'})
+
+    def test_stale_records_are_ignored(self):
+        stale = endpoint_affinity.INSTANCE_MODELS_TTL_SECONDS + 60
+        self.rows += [instance('sd-async-b', ['v1-5.safetensors'], age=stale),
+                      instance('sd-async-c', [], ['v1-5.safetensors'])]
+
+        self.assertEqual(self.pick('v1-5.safetensors'), {'sd-async-c'})
+
+    def test_cold_checkpoint_picks_any_endpoint(self):
+        self.rows += [instance('sd-async-a', ['xl.safetensors'])]
+
+        self.assertEqual(self.pick('v1-5.safetensors', times=200), {'sd-async-a', 'sd-async-b', 'sd-async-c'})
+
+    def test_read_error_falls_back_to_any_endpoint(self):
+        def broken(**kwargs):
+            raise Exception('ResourceNotFoundException')
+            yield
+
+        endpoint_affinity.ddb_service.iter_query = broken
+
+        self.assertEqual(len(self.pick('v1-5.safetensors', times=200)), 3)
@@ -185,6 +185,7 @@ class Endpoint:
     min_instance_number: str = None
     custom_extensions: str = ""
     service_type: str = ""
+    output_images_to_s3: bool = False
 
 
 @dataclass
@@ -216,3 +217,5 @@ class InvocationRequest:
     param_s3: Optional[str] = None
     payload_string: Optional[str] = None
     workflow: Optional[str] = None
+    # the endpoint's OUTPUT_IMAGES_TO_S3 applies when not set
+    output_to_s3: Optional[bool] = None
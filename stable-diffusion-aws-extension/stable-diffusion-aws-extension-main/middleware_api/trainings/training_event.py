@@ -34,16 +34,16 @@ def handler(event, ctx):
     logger.info(json.dumps(event))
     train_job_name = event['detail']['TrainingJobName']
 
-    rows = ddb_service.scan(train_table, filters={
+    row = next(ddb_service.iter_scan(train_table, filters={
         'sagemaker_train_name': train_job_name,
-    })
+    }), None)
 
-    logger.info(rows)
+    logger.info(row)
 
-    if not rows or len(rows) == 0:
+    if not row:
         return not_found(message=f'training job {train_job_name} is not found')
 
-    training_job = TrainJob(**(ddb_service.deserialize(rows[0])))
+    training_job = TrainJob(**row)
 
     logger.info(training_job)
 
@@ -147,10 +147,8 @@ def get_logs_presign(job_id, logs):
 
 
 def insert_ckpt(output_name, job: TrainJob):
-    raw_ckpts = ddb_service.scan(checkpoint_table)
-    for r in raw_ckpts:
-        ckpt = CheckPoint(**(ddb_service.deserialize(r)))
-        if output_name in ckpt.checkpoint_names:
+    for ckpt in ddb_service.iter_scan(checkpoint_table, projection=['checkpoint_names']):
+        if output_name in (ckpt.get('checkpoint_names') or []):
             return
 
     checkpoint = CheckPoint(
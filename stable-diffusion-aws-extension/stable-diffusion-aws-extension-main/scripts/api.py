@@ -1,25 +1,52 @@
-import hashlib
+import base64
+import io
+import shutil
 import json
 import logging
 import os
 import traceback
 import copy
 import datetime
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 import boto3
+from PIL import Image
 from fastapi import FastAPI
 
 from modules import sd_models
 import modules.extras
 import sys
+from aws_extension.admission import AdmissionQueue, AdmissionRejected
 from aws_extension.models import InvocationsRequest
-from aws_extension.mme_utils import checkspace_and_update_models, download_model, models_path
+from aws_extension.mme_utils import checkspace_and_update_models, download_model, models_path, model_prefetcher, \
+    loaded_models, models_dir_gate, model_cache
 import requests
 from utils import get_bucket_name_from_s3_path, get_path_from_s3_path, download_folder_from_s3_by_tar, \
     upload_folder_to_s3_by_tar, read_from_s3
 
-THREAD_CHECK_COUNT = 1
-CONDITION_POOL_MAX_COUNT = 10
-CONDITION_WAIT_TIME_OUT = 100000
+# requests allowed to wait for a slot, beyond that they are turned away with a 429
+ADMISSION_QUEUE_SIZE = int(os.getenv('ADMISSION_QUEUE_SIZE', 10))
+# seconds a request waits for a slot before it is turned away with a 503
+ADMISSION_WAIT_TIME_OUT = int(os.getenv('ADMISSION_WAIT_TIME_OUT', 3600))
+MODEL_RELOCATE_WORKERS = int(os.getenv('MODEL_RELOCATE_WORKERS', 8))
+
+# tasks that may load another checkpoint share one slot, lighter tasks run beside them
+TASK_GROUPS = {
+    'txt2img': 'model',
+    'img2img': 'model',
+    'db-create-model': 'model',
+    'merge-checkpoint': 'model',
+    'interrogate_clip': 'light',
+    'interrogate_deepbooru': 'light',
+    'extra-single-image': 'light',
+    'extra-batch-images': 'light',
+    'rembg': 'light',
+}
+TASK_GROUP_CONCURRENCY = {
+    'model': 1,
+    'light': int(os.getenv('LIGHT_TASK_CONCURRENCY', 2)),
+}
 
 
 def dummy_function(*args, **kwargs):
@@ -37,6 +64,18 @@ endpoint_instance_id = os.getenv('ENDPOINT_INSTANCE_ID', 'default')
 ddb_client = boto3.resource('dynamodb')
 inference_table = ddb_client.Table('SDInferenceJobTable')
 
+s3_client = boto3.client('s3')
+bucket_name = os.getenv('S3_BUCKET_NAME')
+# when enabled, generated images go straight to S3 and only a manifest of them is returned,
+# a request can still override it with output_to_s3
+output_images_to_s3 = os.getenv('OUTPUT_IMAGES_TO_S3', 'false') == 'true'
+UPLOAD_WORKERS = 8
+
+# the inference lambdas read the models of each instance from here to send jobs where their checkpoint is warm
+instance_monitor_table_name = os.getenv('COMFY_INSTANCE_MONITOR_TABLE')
+# the record is refreshed at least this often, readers skip records that go stale
+INSTANCE_MODELS_INTERVAL = int(os.getenv('INSTANCE_MODELS_INTERVAL', 60))
+
 
 def update_execute_job_table(prompt_id, key, value):
     logger.info(f"Update job with prompt_id: {prompt_id}, key: {key}, value: {value}")
@@ -56,6 +95,59 @@ def update_execute_job_table(prompt_id, key, value):
         raise e
 
 
+class InstanceModels:
+    """
+    Keeps the record of this instance in the instance monitor table up to date with the
+    checkpoint in GPU memory and the checkpoints on local disk. The record is written when
+    they change and at least every INSTANCE_MODELS_INTERVAL seconds, which serves as the
+    heartbeat readers use to tell the instance is still there.
+    """
+
+    def __init__(self, table_name):
+        self.table = ddb_client.Table(table_name) if table_name and endpoint_name else None
+        self.lock = threading.Lock()
+        self.published = None
+        self.published_at = 0
+
+    @staticmethod
+    def current():
+        with model_cache.lock:
+            cached = sorted(entry['name'] for entry in model_cache.entries.values()
+                            if entry['type'] == 'Stable-diffusion')
+        return loaded_models.checkpoint, cached
+
+    def publish(self, force=False):
+        if self.table is None:
+            return
+        state = self.current()
+        with self.lock:
+            if not force and state == self.published and time.time() - self.published_at < INSTANCE_MODELS_INTERVAL:
+                return
+            self.published, self.published_at = state, time.time()
+
+        checkpoint, cached = state
+        try:
+            self.table.put_item(Item={
+                'endpoint_name': endpoint_name,
+                'gen_instance_id': endpoint_instance_id,
+                'endpoint_id': os.getenv('ENDPOINT_ID'),
+                'loaded_models': [checkpoint] if checkpoint else [],
+                'cached_models': cached,
+                'last_heartbeat_time': datetime.datetime.utcnow().isoformat(),
+            })
+        except Exception as e:
+            logger.error(f"publish instance models error: {e}")
+
+    def run(self):
+        model_cache.load()
+        while True:
+            self.publish(force=True)
+            time.sleep(INSTANCE_MODELS_INTERVAL)
+
+
+instance_models = InstanceModels(instance_monitor_table_name)
+
+
 def record_metric(req: InvocationsRequest):
     data = [
         {
@@ -259,6 +351,84 @@ def get_output_img_type(payload: dict):
         return None
 
 
+def decode_result_image(b64image):
+    """
+    Returns the bytes of an image with its format and size, read from the header without
+    decoding the pixels, or a None format when PIL can't identify the image.
+    """
+    if b64image.startswith("data:image/"):
+        b64image = b64image.split(";")[1].split(",")[1]
+    data = base64.b64decode(b64image)
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            return data, image.format.lower(), image.size
+    except Exception as e:
+        logger.debug(f"decode_result_image error:{e}")
+        return data, None, None
+
+
+def get_infotexts(resp: dict):
+    try:
+        info = resp.get('info')
+        if isinstance(info, str):
+            info = json.loads(info)
+        return info.get('infotexts') or []
+    except Exception as e:
+        logger.debug(f"get_infotexts error:{e}")
+        return []
+
+
+def upload_result_images(inference_id, b64images, file_names, infotexts):
+    """
+    Writes the images of a result to out/{inference_id}/result/ in parallel and returns a manifest
+    of them, or None when the format of an image can not be told from its bytes, the response is
+    then left as is.
+    """
+    objects = []
+    for count, b64image in enumerate(b64images):
+        data, fmt, size = decode_result_image(b64image)
+        if not fmt:
+            return None
+        objects.append((f"{file_names[count]}.{fmt}", data, size, infotexts[count] if count < len(infotexts) else None))
+
+    def put(item):
+        file_name, body, (width, height), infotext = item
+        s3_client.put_object(Body=body, Bucket=bucket_name, Key=f"out/{inference_id}/result/{file_name}")
+        return {
+            'key': file_name,
+            'size': len(body),
+            'width': width,
+            'height': height,
+            'infotext': infotext,
+        }
+
+    with ThreadPoolExecutor(max_workers=max(1, min(UPLOAD_WORKERS, len(objects)))) as executor:
+        return list(executor.map(put, objects))
+
+
+def images_to_s3(req: InvocationsRequest, resp: dict):
+    output_to_s3 = output_images_to_s3 if req.output_to_s3 is None else req.output_to_s3
+    if not output_to_s3 or not bucket_name:
+        return resp
+
+    if resp.get('images'):
+        images = resp['images']
+        manifest = upload_result_images(req.id, images, [f"image_{i}" for i in range(len(images))],
+                                        get_infotexts(resp))
+        field = 'images'
+    elif resp.get('image'):
+        manifest = upload_result_images(req.id, [resp['image']], ['image'], [])
+        field = 'image'
+    else:
+        return resp
+
+    if manifest is not None:
+        resp['image_manifest'] = manifest
+        del resp[field]
+
+    return resp
+
+
 def parse_constant(c: str) -> float:
     if c == "NaN":
         raise ValueError("NaN is not valid JSON")
@@ -273,12 +443,9 @@ def sagemaker_api(_, app: FastAPI):
     logger.info(app.__dict__)
     logger.info(app)
     logger.debug("Loading Sagemaker API Endpoints.")
-    import threading
-    from collections import deque
-    global condition
-    condition = threading.Condition()
-    global thread_deque
-    thread_deque = deque()
+    admission = AdmissionQueue(TASK_GROUP_CONCURRENCY, ADMISSION_QUEUE_SIZE, ADMISSION_WAIT_TIME_OUT)
+    if instance_models.table is not None:
+        threading.Thread(target=instance_models.run, daemon=True).start()
 
     def wrap_response(start_time, data):
         data['start_time'] = start_time
@@ -292,236 +459,300 @@ def sagemaker_api(_, app: FastAPI):
         logger.info(f'-------invocation on port {req.port}------')
         logger.info(json.dumps(req.__dict__, default=str))
 
-        start_time = datetime.datetime.now().isoformat()
-
-        update_execute_job_table(req.id, 'startTime', start_time)
-
-        record_metric(req)
-
-        with condition:
-            try:
-                thread_deque.append(req)
-                logger.info(f"{threading.current_thread().ident}_{threading.current_thread().name} {len(thread_deque)}")
-                if len(thread_deque) > THREAD_CHECK_COUNT and len(thread_deque) <= CONDITION_POOL_MAX_COUNT:
-                    logger.info(f"wait {threading.current_thread().ident}_{threading.current_thread().name} {len(thread_deque)}")
-                    condition.wait(timeout=CONDITION_WAIT_TIME_OUT)
-                elif len(thread_deque) > CONDITION_POOL_MAX_COUNT:
-                    logger.info(f"waiting thread too much in condition pool {len(thread_deque)}, max: {CONDITION_POOL_MAX_COUNT}")
-                    raise MemoryError
-
-                logger.info(f"task is {req.task}")
-                logger.info(f"models is {req.models}")
-
-                payload_string = None
-                # if it has payload_string, use it
-                if req.payload_string:
-                    payload_string = req.payload_string
-                elif req.param_s3:
-                    payload_string = read_from_s3(req.param_s3)
-
-                payload = json.loads(payload_string, parse_constant=parse_constant)
-
-                if req.task == 'txt2img':
-                    logger.info(f"{threading.current_thread().ident}_{threading.current_thread().name}_______ txt2img start !!!!!!!!")
-                    checkspace_and_update_models(req.models)
-                    logger.info(f"{threading.current_thread().ident}_{threading.current_thread().name}_______ txt2img models update !!!!!!!!")
-                    image_type = get_output_img_type(payload)
-                    logger.debug(f"image_type:{image_type}")
-                    resp = {}
-                    if image_type:
-                        logger.debug(f"set output_img_type:{image_type}")
-                        resp["output_img_type"] = image_type
-                    response = requests.post(url=f'http://0.0.0.0:{req.port}/sdapi/v1/txt2img',
-                                             json=payload)
-                    logger.info(f"{threading.current_thread().ident}_{threading.current_thread().name}_______ txt2img end !!!!!!!! {len(response.json())}")
-                    resp.update(response.json())
-                    return wrap_response(start_time, resp)
-                elif req.task == 'img2img':
-                    logger.info(f"{threading.current_thread().ident}_{threading.current_thread().name}_______ img2img start!!!!!!!!")
-                    checkspace_and_update_models(req.models)
-                    logger.info(f"{threading.current_thread().ident}_{threading.current_thread().name}_______ txt2img models update !!!!!!!!")
-                    image_type = get_output_img_type(payload)
-                    logger.debug(f"image_type:{image_type}")
-                    resp = {}
-                    if image_type:
-                        logger.debug(f"set output_img_type:{image_type}")
-                        resp["output_img_type"] = image_type
-                    response = requests.post(url=f'http://0.0.0.0:{req.port}/sdapi/v1/img2img',
-                                             json=payload)
-                    logger.info(f"{threading.current_thread().ident}_{threading.current_thread().name}_______ img2img end !!!!!!!!{len(response.json())}")
-                    resp.update(response.json())
-                    return wrap_response(start_time, resp)
-                elif req.task == 'interrogate_clip' or req.task == 'interrogate_deepbooru':
-                    response = requests.post(url=f'http://0.0.0.0:{req.port}/sdapi/v1/interrogate',
-                                             json=json.loads(req.interrogate_payload.json()))
-                    return wrap_response(start_time, response.json())
-                elif req.task == 'extra-single-image':
-                    response = requests.post(url=f'http://0.0.0.0:{req.port}/sdapi/v1/extra-single-image',
-                                             json=payload)
-                    return wrap_response(start_time, response.json())
-                elif req.task == 'extra-batch-images':
-                    response = requests.post(url=f'http://0.0.0.0:{req.port}/sdapi/v1/extra-batch-images',
-                                             json=payload)
-                    return wrap_response(start_time, response.json())
-                elif req.task == 'rembg':
-                    response = requests.post(url=f'http://0.0.0.0:{req.port}/rembg', json=payload)
-                    return wrap_response(start_time, response.json())
-                elif req.task == 'db-create-model':
-                    r"""
-                    task: db-create-model
-                    db_create_model_payload:
-                        :s3_input_path: S3 path for download src model.
-                        :s3_output_path: S3 path for upload generated model.
-                        :ckpt_from_cloud: Whether to get ckpt from cloud or local.
-                        :job_id: job id.
-                        :param
-                            :new_model_name: generated model name.
-                            :ckpt_path: S3 path for download src model.
-                            :db_new_model_shared_src="",
-                            :from_hub=False,
-                            :new_model_url="",
-                            :new_model_token="",
-                            :extract_ema=False,
-                            :train_unfrozen=False,
-                            :is_512=True,
-                    """
-                    try:
-                        db_create_model_payload = json.loads(req.db_create_model_payload)
-                        job_id = db_create_model_payload["job_id"]
-                        s3_output_path = db_create_model_payload["s3_output_path"]
-                        output_bucket_name = get_bucket_name_from_s3_path(s3_output_path)
-                        output_path = get_path_from_s3_path(s3_output_path)
-                        db_create_model_params = db_create_model_payload["param"]["create_model_params"]
-                        if "ckpt_from_cloud" in db_create_model_payload["param"]:
-                            ckpt_from_s3 = db_create_model_payload["param"]["ckpt_from_cloud"]
+        group = TASK_GROUPS.get(req.task, 'model')
+        # while waiting for the model slot, the models of this request are fetched in the background
+        prefetch = group == 'model' and req.models
+        if prefetch:
+            model_prefetcher.add(req.models)
+        try:
+            admission.acquire(group)
+        except AdmissionRejected as e:
+            logger.info(f"reject {req.id} {req.task}: {e.message}")
+            return e.response(req.id)
+        finally:
+            if prefetch:
+                model_prefetcher.remove(req.models)
+
+        try:
+            logger.info(f"{threading.current_thread().ident}_{threading.current_thread().name} admitted as {group}")
+            # a rejected request is retried elsewhere, so only an admitted one starts the job
+            start_time = datetime.datetime.now().isoformat()
+
+            update_execute_job_table(req.id, 'startTime', start_time)
+
+            record_metric(req)
+
+            logger.info(f"task is {req.task}")
+            logger.info(f"models is {req.models}")
+
+            payload_string = None
+            # if it has payload_string, use it
+            if req.payload_string:
+                payload_string = req.payload_string
+            elif req.param_s3:
+                payload_string = read_from_s3(req.param_s3)
+
+            payload = json.loads(payload_string, parse_constant=parse_constant)
+
+            if req.task == 'txt2img':
+                logger.info(f"{threading.current_thread().ident}_{threading.current_thread().name}_______ txt2img start !!!!!!!!")
+                checkspace_and_update_models(req.models)
+                logger.info(f"{threading.current_thread().ident}_{threading.current_thread().name}_______ txt2img models update !!!!!!!!")
+                image_type = get_output_img_type(payload)
+                logger.debug(f"image_type:{image_type}")
+                resp = {}
+                if image_type:
+                    logger.debug(f"set output_img_type:{image_type}")
+                    resp["output_img_type"] = image_type
+                response = requests.post(url=f'http://0.0.0.0:{req.port}/sdapi/v1/txt2img',
+                                         json=payload)
+                logger.info(f"{threading.current_thread().ident}_{threading.current_thread().name}_______ txt2img end !!!!!!!! {len(response.json())}")
+                resp.update(response.json())
+                return wrap_response(start_time, images_to_s3(req, resp))
+            elif req.task == 'img2img':
+                logger.info(f"{threading.current_thread().ident}_{threading.current_thread().name}_______ img2img start!!!!!!!!")
+                checkspace_and_update_models(req.models)
+                logger.info(f"{threading.current_thread().ident}_{threading.current_thread().name}_______ txt2img models update !!!!!!!!")
+                image_type = get_output_img_type(payload)
+                logger.debug(f"image_type:{image_type}")
+                resp = {}
+                if image_type:
+                    logger.debug(f"set output_img_type:{image_type}")
+                    resp["output_img_type"] = image_type
+                response = requests.post(url=f'http://0.0.0.0:{req.port}/sdapi/v1/img2img',
+                                         json=payload)
+                logger.info(f"{threading.current_thread().ident}_{threading.current_thread().name}_______ img2img end !!!!!!!!{len(response.json())}")
+                resp.update(response.json())
+                return wrap_response(start_time, images_to_s3(req, resp))
+            elif req.task == 'interrogate_clip' or req.task == 'interrogate_deepbooru':
+                response = requests.post(url=f'http://0.0.0.0:{req.port}/sdapi/v1/interrogate',
+                                         json=json.loads(req.interrogate_payload.json()))
+                return wrap_response(start_time, response.json())
+            elif req.task == 'extra-single-image':
+                response = requests.post(url=f'http://0.0.0.0:{req.port}/sdapi/v1/extra-single-image',
+                                         json=payload)
+                return wrap_response(start_time, images_to_s3(req, response.json()))
+            elif req.task == 'extra-batch-images':
+                response = requests.post(url=f'http://0.0.0.0:{req.port}/sdapi/v1/extra-batch-images',
+                                         json=payload)
+                return wrap_response(start_time, response.json())
+            elif req.task == 'rembg':
+                response = requests.post(url=f'http://0.0.0.0:{req.port}/rembg', json=payload)
+                return wrap_response(start_time, images_to_s3(req, response.json()))
+            elif req.task == 'db-create-model':
+                r"""
+                task: db-create-model
+                db_create_model_payload:
+                    :s3_input_path: S3 path for download src model.
+                    :s3_output_path: S3 path for upload generated model.
+                    :ckpt_from_cloud: Whether to get ckpt from cloud or local.
+                    :job_id: job id.
+                    :param
+                        :new_model_name: generated model name.
+                        :ckpt_path: S3 path for download src model.
+                        :db_new_model_shared_src="",
+                        :from_hub=False,
+                        :new_model_url="",
+                        :new_model_token="",
+                        :extract_ema=False,
+                        :train_unfrozen=False,
+                        :is_512=True,
+                """
+                try:
+                    db_create_model_payload = json.loads(req.db_create_model_payload)
+                    job_id = db_create_model_payload["job_id"]
+                    s3_output_path = db_create_model_payload["s3_output_path"]
+                    output_bucket_name = get_bucket_name_from_s3_path(s3_output_path)
+                    output_path = get_path_from_s3_path(s3_output_path)
+                    db_create_model_params = db_create_model_payload["param"]["create_model_params"]
+                    if "ckpt_from_cloud" in db_create_model_payload["param"]:
+                        ckpt_from_s3 = db_create_model_payload["param"]["ckpt_from_cloud"]
+                    else:
+                        ckpt_from_s3 = False
+                    if not db_create_model_params['from_hub']:
+                        if ckpt_from_s3:
+                            s3_input_path = db_create_model_payload["param"]["s3_ckpt_path"]
+                            local_model_path = db_create_model_params["ckpt_path"]
+                            input_path = get_path_from_s3_path(s3_input_path)
+                            logger.info(f"ckpt from s3 {input_path} {local_model_path}")
                         else:
-                            ckpt_from_s3 = False
-                        if not db_create_model_params['from_hub']:
-                            if ckpt_from_s3:
-                                s3_input_path = db_create_model_payload["param"]["s3_ckpt_path"]
-                                local_model_path = db_create_model_params["ckpt_path"]
-                                input_path = get_path_from_s3_path(s3_input_path)
-                                logger.info(f"ckpt from s3 {input_path} {local_model_path}")
-                            else:
-                                s3_input_path = db_create_model_payload["s3_input_path"]
-                                local_model_path = db_create_model_params["ckpt_path"]
-                                input_path = os.path.join(get_path_from_s3_path(s3_input_path), local_model_path)
-                                logger.info(f"ckpt from local {input_path} {local_model_path}")
-                            input_bucket_name = get_bucket_name_from_s3_path(s3_input_path)
-                            logger.info("Check disk usage before download.")
-                            os.system("df -h")
-                            logger.info(f"Download src model from s3 {input_bucket_name} {input_path} {local_model_path}")
-                            download_folder_from_s3_by_tar(input_bucket_name, input_path, local_model_path)
-                            # Refresh the ckpt list.
-                            sd_models.list_models()
-                            logger.info("Check disk usage after download.")
-                            os.system("df -h")
-                        logger.info("Start creating model.")
-                        create_model_func_args = copy.deepcopy(db_create_model_params)
-                        local_response = create_model(**create_model_func_args)
-                        target_local_model_dir = f'models/dreambooth/{db_create_model_params["new_model_name"]}'
-                        logger.info(f"Upload tgt model to s3 {target_local_model_dir} {output_bucket_name} {output_path}")
-                        upload_folder_to_s3_by_tar(target_local_model_dir, output_bucket_name, output_path)
-                        config_file = os.path.join(target_local_model_dir, "db_config.json")
-                        with open(config_file, 'r') as openfile:
-                            config_dict = json.load(openfile)
-                        message = {
-                            "response": local_response,
-                            "config_dict": config_dict
-                        }
-                        response = {
-                            "id": job_id,
-                            "statusCode": 200,
-                            "message": message,
-                            "outputLocation": [f'{s3_output_path}/db_create_model_params["new_model_name"]']
-                        }
-                        return response
-                    except Exception as e:
-                        response = {
-                            "id": job_id,
-                            "statusCode": 500,
-                            "message": traceback.format_exc(),
-                        }
-                        logger.error(traceback.format_exc())
-                        return response
-                    finally:
-                        # Clean up
-                        logger.info("Delete src model.")
-                        delete_src_command = f"rm -rf models/Stable-diffusion/{db_create_model_params['ckpt_path']}"
-                        logger.info(delete_src_command)
-                        os.system(delete_src_command)
-                        logger.info("Delete tgt model.")
-                        delete_tgt_command = f"rm -rf models/dreambooth/{db_create_model_params['new_model_name']}"
-                        logger.info(delete_tgt_command)
-                        os.system(delete_tgt_command)
-                        logger.info("Check disk usage after request.")
+                            s3_input_path = db_create_model_payload["s3_input_path"]
+                            local_model_path = db_create_model_params["ckpt_path"]
+                            input_path = os.path.join(get_path_from_s3_path(s3_input_path), local_model_path)
+                            logger.info(f"ckpt from local {input_path} {local_model_path}")
+                        input_bucket_name = get_bucket_name_from_s3_path(s3_input_path)
+                        logger.info("Check disk usage before download.")
                         os.system("df -h")
-                elif req.task == 'merge-checkpoint':
-                    try:
-                        output_model_position = merge_model_on_cloud(req)
-                        response = {
-                            "statusCode": 200,
-                            "message": output_model_position,
-                        }
-                        return response
-                    except Exception as e:
-                        traceback.print_exc()
-                else:
-                    raise NotImplementedError
-            except Exception as e:
-                traceback.print_exc()
-            finally:
-                thread_deque.popleft()
-                condition.notify()
+                        logger.info(f"Download src model from s3 {input_bucket_name} {input_path} {local_model_path}")
+                        download_folder_from_s3_by_tar(input_bucket_name, input_path, local_model_path)
+                        # Refresh the ckpt list.
+                        sd_models.list_models()
+                        logger.info("Check disk usage after download.")
+                        os.system("df -h")
+                    logger.info("Start creating model.")
+                    create_model_func_args = copy.deepcopy(db_create_model_params)
+                    local_response = create_model(**create_model_func_args)
+                    target_local_model_dir = f'models/dreambooth/{db_create_model_params["new_model_name"]}'
+                    logger.info(f"Upload tgt model to s3 {target_local_model_dir} {output_bucket_name} {output_path}")
+                    upload_folder_to_s3_by_tar(target_local_model_dir, output_bucket_name, output_path)
+                    config_file = os.path.join(target_local_model_dir, "db_config.json")
+                    with open(config_file, 'r') as openfile:
+                        config_dict = json.load(openfile)
+                    message = {
+                        "response": local_response,
+                        "config_dict": config_dict
+                    }
+                    response = {
+                        "id": job_id,
+                        "statusCode": 200,
+                        "message": message,
+                        "outputLocation": [f'{s3_output_path}/db_create_model_params["new_model_name"]']
+                    }
+                    return response
+                except Exception as e:
+                    response = {
+                        "id": job_id,
+                        "statusCode": 500,
+                        "message": traceback.format_exc(),
+                    }
+                    logger.error(traceback.format_exc())
+                    return response
+                finally:
+                    # Clean up
+                    logger.info("Delete src model.")
+                    delete_src_command = f"rm -rf models/Stable-diffusion/{db_create_model_params['ckpt_path']}"
+                    logger.info(delete_src_command)
+                    os.system(delete_src_command)
+                    logger.info("Delete tgt model.")
+                    delete_tgt_command = f"rm -rf models/dreambooth/{db_create_model_params['new_model_name']}"
+                    logger.info(delete_tgt_command)
+                    os.system(delete_tgt_command)
+                    logger.info("Check disk usage after request.")
+                    os.system("df -h")
+            elif req.task == 'merge-checkpoint':
+                try:
+                    output_model_position = merge_model_on_cloud(req)
+                    response = {
+                        "statusCode": 200,
+                        "message": output_model_position,
+                    }
+                    return response
+                except Exception as e:
+                    traceback.print_exc()
+            else:
+                raise NotImplementedError
+        except Exception as e:
+            traceback.print_exc()
+        finally:
+            admission.release(group)
+            if group == 'model':
+                # the request may have loaded another checkpoint or downloaded models
+                instance_models.publish()
 
     @app.get("/ping")
     def ping():
         return {'status': 'Healthy'}
 
+    @app.get("/invocations/queue")
+    def queue():
+        return admission.stats()
 
-def md5(fname):
-    hash_md5 = hashlib.md5()
-    with open(fname, "rb") as f:
-        for chunk in iter(lambda: f.read(4096), b""):
-            hash_md5.update(chunk)
-    return hash_md5.hexdigest()
+    @app.get("/invocations/models")
+    def models():
+        return {
+            'checkpoint': loaded_models.checkpoint,
+            'vae': loaded_models.vae,
+            **loaded_models.stats,
+        }
 
 
-def get_file_md5_dict(path):
-    file_dict = {}
-    for root, dirs, files in os.walk(path):
-        for file in files:
-            file_dict[file] = md5(os.path.join(root, file))
-    return file_dict
+def is_same_file(src, dst):
+    try:
+        src_stat = os.stat(src)
+        dst_stat = os.stat(dst)
+    except FileNotFoundError:
+        return False
+    return src_stat.st_size == dst_stat.st_size and int(src_stat.st_mtime) == int(dst_stat.st_mtime)
+
+
+def copy_tree(src_dir, dst_dir, mirror=False):
+    """
+    Copies the files of src_dir (following links, like cp -rL) that are missing or differ
+    in size or mtime in dst_dir, in parallel. copyfile uses sendfile, so the data never
+    passes through small user space buffers. With mirror, files of dst_dir that are gone
+    from src_dir are removed as well. Returns the files that failed to copy.
+    """
+    files = []
+    src_files = set()
+    for root, dirs, names in os.walk(src_dir, followlinks=True):
+        for name in names:
+            rel_path = os.path.relpath(os.path.join(root, name), src_dir)
+            src_files.add(rel_path)
+            if not is_same_file(os.path.join(src_dir, rel_path), os.path.join(dst_dir, rel_path)):
+                files.append(rel_path)
+
+    if mirror:
+        for root, dirs, names in os.walk(dst_dir):
+            for name in names:
+                rel_path = os.path.relpath(os.path.join(root, name), dst_dir)
+                if rel_path not in src_files:
+                    logger.info(f"remove {rel_path} from {dst_dir}, it is gone from {src_dir}")
+                    os.remove(os.path.join(dst_dir, rel_path))
+
+    def copy_file(rel_path):
+        src = os.path.join(src_dir, rel_path)
+        dst = os.path.join(dst_dir, rel_path)
+        tmp = f'{dst}.copying'
+        try:
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            shutil.copyfile(src, tmp)
+            shutil.copystat(src, tmp)
+            os.replace(tmp, dst)
+            # size and mtime of the copy against the source stand in for a full hash of both trees
+            return None if is_same_file(src, dst) else rel_path
+        except Exception as e:
+            logger.error(f"copy {src} error: {e}")
+            return rel_path
 
+    with ThreadPoolExecutor(max_workers=MODEL_RELOCATE_WORKERS) as executor:
+        return [rel_path for rel_path in executor.map(copy_file, files) if rel_path]
 
-def move_model_to_tmp(_, app: FastAPI):
-    logger.info("Copy model dir to tmp")
-    model_tmp_dir = f"models"
-    # for mutil gpus
-    if os.path.exists(f"/tmp/{model_tmp_dir}"):
+
+def relocate_models(model_tmp_dir):
+    start = time.time()
+    failed = copy_tree("models", model_tmp_dir)
+    if failed:
+        logger.info(f"Failed to copy model dir, use the original dir: {failed[:10]}")
         return
-    os.system(f"cp -rL models /tmp/{model_tmp_dir}")
-    src_file_dict = get_file_md5_dict("models")
-    tgt_file_dict = get_file_md5_dict(f"/tmp/{model_tmp_dir}")
-    is_complete = True
-    for file in src_file_dict:
-        logger.info(f"Src file {file} md5 {src_file_dict[file]}")
-        if file not in tgt_file_dict:
-            is_complete = False
-            break
-        if src_file_dict[file] != tgt_file_dict[file]:
-            is_complete = False
-            break
-    if is_complete:
-        os.system(f"rm -rf models")
+
+    # downloads and evictions of every GPU's process are held back while the last changes,
+    # deletions included, are copied and the link replaces the dir
+    with models_dir_gate.replace():
+        failed = copy_tree("models", model_tmp_dir, mirror=True)
+        if failed:
+            logger.info(f"Failed to copy model dir, use the original dir: {failed[:10]}")
+            return
+        os.rename("models", "models.relocated")
         logger.info("Link model dir")
-        os.system(f"ln -s /tmp/{model_tmp_dir} models")
-    else:
-        logger.info("Failed to copy model dir, use the original dir")
+        os.symlink(model_tmp_dir, "models")
+
+    shutil.rmtree("models.relocated", ignore_errors=True)
+    logger.info(f"Model dir moved to {model_tmp_dir} in {time.time() - start:.1f}s")
     logger.info("Check disk usage on app started")
     os.system("df -h")
 
+
+def move_model_to_tmp(_, app: FastAPI):
+    logger.info("Copy model dir to tmp")
+    model_tmp_dir = "/tmp/models"
+    # for mutil gpus, only the first app moves the dir
+    try:
+        os.makedirs(model_tmp_dir)
+    except FileExistsError:
+        return
+    # the app serves from the original dir until the copy is complete
+    threading.Thread(target=relocate_models, args=(model_tmp_dir,), name="relocate-models", daemon=True).start()
+
 try:
     import modules.script_callbacks as script_callbacks
 
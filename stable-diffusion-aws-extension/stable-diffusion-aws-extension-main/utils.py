@@ -25,67 +25,6 @@ logger.setLevel(LOGGING_LEVEL)
 s3_client = boto3.client('s3')
 
 
-class ModelsRef:
-    def __init__(self):
-        self.models_ref = {}
-
-    def get_models_ref_dict(self):
-        return self.models_ref
-
-    def add_models_ref(self, model_name):
-        if model_name in self.models_ref:
-            self.models_ref[model_name] += 1
-        else:
-            self.models_ref[model_name] = 0
-
-    def remove_model_ref(self,model_name):
-        if self.models_ref.get(model_name):
-            del self.models_ref[model_name]
-
-    def get_models_ref(self, model_name):
-        return self.models_ref.get(model_name)
-
-    def get_least_ref_model(self):
-        sorted_models = sorted(self.models_ref.items(), key=lambda item: item[1])
-        if sorted_models:
-            least_ref_model, least_counter = sorted_models[0]
-            return least_ref_model,least_counter
-        else:
-            return None,None
-
-    def pop_least_ref_model(self):
-        sorted_models = sorted(self.models_ref.items(), key=lambda item: item[1])
-        if sorted_models:
-            least_ref_model, least_counter = sorted_models[0]
-            del self.models_ref[least_ref_model]
-            return least_ref_model,least_counter
-        else:
-            return None,None
-
-    def get_sorted_models(self, key_list=None):
-        print('!!!!!!!!!!!', key_list)
-        if key_list is None:
-            return sorted(self.models_ref.items(), key=lambda item: item[1])
-        else:
-            models_ref_tmp = {}
-            for key_value in key_list:
-                if key_value not in self.models_ref.keys():
-                    models_ref_tmp[key_value] = -1
-                else:
-                    models_ref_tmp[key_value] = self.models_ref[key_value]
-            models_sorted_info = sorted(models_ref_tmp.items(), key=lambda item: item[1])
-            models_sorted = []
-            for model_info in models_sorted_info:
-                models_sorted.append(model_info[0])
-            return models_sorted
-
-# sd_models_Ref = ModelsRef()
-# cn_models_Ref = ModelsRef()
-# lora_models_Ref = ModelsRef()
-# hyper_models_Ref = ModelsRef()
-# embedding_Ref = ModelsRef()
-
-
 def upload_folder_to_s3(local_folder_path, bucket_name, s3_folder_path):
     for root, dirs, files in os.walk(local_folder_path):
         for file in files: